@@ -6,40 +6,52 @@ import json
 import logging
 import os
 import sys
-from typing import List, Set
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import requests
 import yaml
-from git import Repo
+from github_client import get_client
+from release_changes import RELEASE_DIR_NAME, REPO_ROOT, iter_changed_release_files, read_file_at
 
 GITHUB_API_URL = "https://api.github.com"
 DEFAULT_REPO_OWNER = "canonical"
-RELEASE_DIR_NAME = "releases"
 MAIN_BRANCH_NAMES = ["main", "master"]
 GITHUB_TOKEN_NAME = "KUBEFLOW_BOT_TOKEN"
+RANGE_ENV_NAME = "BRANCH_CREATION_RANGE"
+DEFAULT_RANGE = "HEAD~1..HEAD"
+CONCURRENCY_ENV_NAME = "BRANCH_CREATION_CONCURRENCY"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BRANCH_CACHE_ENV_NAME = "DEFAULT_BRANCH_CACHE_FILE"
+DEFAULT_BRANCH_CACHE_FILE = os.path.join(
+    os.path.expanduser("~"), ".cache", "kubeflow-ci", "default_branches.json"
+)
+# How long, in seconds, a cached default branch is trusted before being fetched again
+DEFAULT_BRANCH_CACHE_TTL = 24 * 60 * 60
+# How many repositories to look up, or refs to create, in each GraphQL query
+GRAPHQL_BATCH_SIZE = 50
+BACKEND_ENV_NAME = "BRANCH_CREATION_BACKEND"
+# Backends for creating branches: one REST request per lookup and creation, or batched GraphQL
+REST_BACKEND = "rest"
+GRAPHQL_BACKEND = "graphql"
+# Release directories with at least this many bundle files are parsed in a pool of processes
+PARSE_PROCESSES_THRESHOLD = 32
+# The libyaml based loader is much faster, but PyYAML is not always built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Outcomes of creating a branch
+CREATED = "created"
+EXISTS = "exists"
+FAILED = "failed"
 
 HEADERS = {"content-type": "application/vnd.github.v3+json"}
 logger = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 
-def get_git_diff() -> List[str]:
-    """Return a list of file paths of files changed in the last commit"""
-    cur_repo = Repo.init(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-    diff = cur_repo.git.diff("HEAD~1..HEAD", name_only=True).split("\n")
-    return diff
-
-
-def get_modified_releases_dirs(git_diff_file_paths: List[str]) -> Set[str]:
-    """Takes list of file paths as input, returns a list of releases directory path."""
-    result = []
-    for file_path in git_diff_file_paths:
-        split_path = file_path.split("/")
-        if split_path[0] == RELEASE_DIR_NAME and split_path[-1].endswith(".yaml"):
-            result.append(f"{RELEASE_DIR_NAME}/{split_path[1]}")
-    return set(result)
-
-
 def trim_bundle_dict(full_bundle_dict: dict) -> dict:
     """Return dictionary with charm information.
 
@@ -71,28 +83,72 @@ def trim_bundle_dict(full_bundle_dict: dict) -> dict:
     return result
 
 
+def load_yaml(stream):
+    """Parse yaml with the libyaml based loader when PyYAML was built with it"""
+    return yaml.load(stream, Loader=YAML_LOADER)
+
+
+def parse_bundle_file(yaml_file_path: str) -> dict:
+    """Parse a bundle yaml file and return its charms, in the format of trim_bundle_dict"""
+    with open(yaml_file_path, "r") as file:
+        return trim_bundle_dict(load_yaml(file))
+
+
+def merge_charms_info(result: dict, charms_info: dict, origins: dict, source: str) -> List[str]:
+    """Merge the charms of a bundle file into result, in place.
+
+    `origins` maps each charm of result to the file that defined it, and is updated as well.
+    As before, the last file defining a charm wins.  Returns a message for each charm that an
+    earlier file defined with a different track, since only one of the tracks gets a branch.
+    """
+    conflicts = []
+    for charm, info in charms_info.items():
+        previous = result.get(charm)
+        if previous is not None and previous["version"] != info["version"]:
+            conflicts.append(
+                f"Charm `{charm}` has track `{previous['version']}` in `{origins[charm]}` but "
+                f"track `{info['version']}` in `{source}`"
+            )
+        result[charm] = info
+        origins[charm] = source
+    return conflicts
+
+
+def _parse_bundle_files(yaml_file_paths: List[str]) -> Iterable[dict]:
+    """Parse bundle files, in a pool of processes when there are many, keeping their order"""
+    if len(yaml_file_paths) < PARSE_PROCESSES_THRESHOLD:
+        return map(parse_bundle_file, yaml_file_paths)
+    with ProcessPoolExecutor() as executor:
+        chunksize = max(1, len(yaml_file_paths) // ((os.cpu_count() or 1) * 4))
+        return list(executor.map(parse_bundle_file, yaml_file_paths, chunksize=chunksize))
+
+
 def parse_yamls(release_directory: str) -> dict:
     """Parse bundle yaml and returns a dictionary.
 
     Takes the path of directory as input (path relative to the root of this repo),
     returns a dictionary
     { "<charm_name>": {"version": str, "github_repo_name": str }}
+    Files are parsed in a pool of processes when there are at least PARSE_PROCESSES_THRESHOLD of
+    them.  Charms defined with different tracks by two files are logged as conflicts.
     Error is logged if the directory does not exists
     """
     path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", release_directory))
 
     if os.path.isdir(path):
-        yaml_files = [file_name for file_name in os.listdir(path) if file_name.endswith(".yaml")]
-        # use yaml to parse each file
+        yaml_files = sorted(
+            file_name for file_name in os.listdir(path) if file_name.endswith(".yaml")
+        )
         if not yaml_files:
             logger.warning(f"func parse_yamls: No yamls files are present in directory `{path}`")
-        result = {}
-        for yaml_file_name in yaml_files:
-            yaml_file_path = os.path.join(path, yaml_file_name)
-            logger.info(f"Parsing charms in yaml `{yaml_file_path}`")
-            with open(yaml_file_path, "r") as file:
-                file_content = yaml.safe_load(file)
-                result = {**result, **trim_bundle_dict(file_content)}
+        logger.info(f"Parsing charms in {len(yaml_files)} yamls of `{path}`")
+        yaml_file_paths = [os.path.join(path, yaml_file_name) for yaml_file_name in yaml_files]
+        result, origins = {}, {}
+        for yaml_file_path, charms_info in zip(
+            yaml_file_paths, _parse_bundle_files(yaml_file_paths)
+        ):
+            for conflict in merge_charms_info(result, charms_info, origins, yaml_file_path):
+                logger.warning(f"Conflicting tracks in `{release_directory}`: {conflict}")
         logger.info(f"Finished parsing yamls in `{release_directory}`.")
         logger.info(f"Resulting charms info: {result}")
         return result
@@ -100,14 +156,154 @@ def parse_yamls(release_directory: str) -> dict:
         logger.error(f"Cannot proceed with script. Failed to find directory {path}")
 
 
+def github_client():
+    """Return the Github client shared by every request of this script."""
+    return get_client(os.environ.get(GITHUB_TOKEN_NAME), GITHUB_API_URL)
+
+
+class DefaultBranchResolver:
+    """Resolves the default branch of repositories, caching them in a file.
+
+    Default branches are looked up once per repository, either through a single batched GraphQL
+    query for every repository of a release (see prefetch) or one REST request per repository,
+    and then trusted for `ttl` seconds.  The cache file is a JSON object of
+    { "<owner>/<repo>": {"default_branch": str, "fetched_at": float }}
+    If no cache file is given, default branches are only cached in memory.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None, ttl: float = DEFAULT_BRANCH_CACHE_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache = self._load()
+
+    def _load(self) -> dict:
+        """Return the content of the cache file, or an empty cache if it cannot be read"""
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable default branch cache `{self.cache_file}`: {e}")
+            return {}
+
+    def _save(self):
+        """Write the cache to the cache file, atomically so readers never see a partial file"""
+        if self.cache_file is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        temporary_file = f"{self.cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_file, "w") as file:
+            json.dump(self._cache, file, indent=2, sort_keys=True)
+        os.replace(temporary_file, self.cache_file)
+
+    def cached(self, full_name: str) -> Optional[str]:
+        """Return the cached default branch of a repository, if it has not expired"""
+        with self._lock:
+            entry = self._cache.get(full_name)
+        if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        return entry["default_branch"]
+
+    def store(self, default_branches: Dict[str, str]):
+        """Cache the default branches of repositories, given as { "<owner>/<repo>": str }"""
+        if not default_branches:
+            return
+        now = time.time()
+        with self._lock:
+            for full_name, default_branch in default_branches.items():
+                self._cache[full_name] = {"default_branch": default_branch, "fetched_at": now}
+            self._save()
+
+    def prefetch(self, full_names: Iterable[str]) -> None:
+        """Look up the default branches of many repositories with batched GraphQL queries.
+
+        Repositories with a fresh cached default branch are skipped.  Failures are only logged:
+        repositories that could not be looked up are resolved one by one by resolve instead.
+        """
+        missing = sorted({name for name in full_names if self.cached(name) is None})
+        for start in range(0, len(missing), GRAPHQL_BATCH_SIZE):
+            end = start + GRAPHQL_BATCH_SIZE
+            batch = missing[start:end]
+            try:
+                data = github_client().graphql(build_default_branch_query(batch)).get("data")
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"func prefetch: Failed to look up default branches: {e}")
+                return
+            default_branches = {}
+            for index, full_name in enumerate(batch):
+                repository = (data or {}).get(f"r{index}")
+                if repository and repository.get("defaultBranchRef"):
+                    default_branches[full_name] = repository["defaultBranchRef"]["name"]
+            self.store(default_branches)
+
+    def resolve(
+        self, github_repo_name: str, github_repo_owner: str = DEFAULT_REPO_OWNER
+    ) -> Optional[str]:
+        """Return the default branch of a repository, or None if it cannot be found."""
+        full_name = f"{github_repo_owner}/{github_repo_name}"
+        default_branch = self.cached(full_name)
+        if default_branch is not None:
+            return default_branch
+        try:
+            res = github_client().get(f"{GITHUB_API_URL}/repos/{full_name}", headers=HEADERS)
+        except requests.RequestException as e:
+            logger.warning(f"func resolve: Failed to look up repository `{full_name}`: {e}")
+            return None
+        if res.status_code != 200:
+            return None
+        default_branch = res.json()["default_branch"]
+        self.store({full_name: default_branch})
+        return default_branch
+
+
+def build_default_branch_query(full_names: List[str]) -> str:
+    """Return a GraphQL query for the default branch of each repository, aliased r0, r1, ..."""
+    fields = []
+    for index, full_name in enumerate(full_names):
+        owner, name = full_name.split("/")
+        fields.append(
+            f"r{index}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+            "{ defaultBranchRef { name } }"
+        )
+    return "query { " + " ".join(fields) + " }"
+
+
+_default_branch_resolver = None
+_default_branch_resolver_lock = threading.Lock()
+
+
+def get_default_branch_resolver() -> DefaultBranchResolver:
+    """Return the DefaultBranchResolver shared by this script.
+
+    Its cache file can be set through the DEFAULT_BRANCH_CACHE_FILE environment variable.
+    """
+    global _default_branch_resolver
+    with _default_branch_resolver_lock:
+        if _default_branch_resolver is None:
+            _default_branch_resolver = DefaultBranchResolver(
+                os.environ.get(DEFAULT_BRANCH_CACHE_ENV_NAME, DEFAULT_BRANCH_CACHE_FILE)
+            )
+        return _default_branch_resolver
+
+
 def get_latest_commit_sha(
     github_repo_name: str, github_repo_owner: str = DEFAULT_REPO_OWNER
 ) -> str:
-    """Loop through possible main branch names. Returns the first commit sha found."""
+    """Return the latest commit sha of the default branch of a repository.
+
+    The default branch is looked up through the shared DefaultBranchResolver.  If it cannot be
+    found, or has no commit, loop through possible main branch names.  Returns the first commit
+    sha found.
+    """
     latest_sha = ""
-    for main_branch_name in MAIN_BRANCH_NAMES:
+    default_branch = get_default_branch_resolver().resolve(github_repo_name, github_repo_owner)
+    branch_names = [default_branch] if default_branch else []
+    branch_names += [name for name in MAIN_BRANCH_NAMES if name != default_branch]
+    for main_branch_name in branch_names:
         get_ref_api = f"{GITHUB_API_URL}/repos/{github_repo_owner}/{github_repo_name}/git/ref/heads/{main_branch_name}"
-        res = requests.get(get_ref_api, headers=HEADERS)
+        res = github_client().get(get_ref_api, headers=HEADERS)
         if res.status_code == 200:
             body = res.json()
             latest_sha = body["object"]["sha"]
@@ -120,54 +316,325 @@ def get_latest_commit_sha(
 
 def create_git_branch(
     github_repo_name: str, new_branch_name: str, github_repo_owner: str = DEFAULT_REPO_OWNER
-) -> None:
+) -> str:
     """It creates the git branch using github api.
 
     This function should NEVER raise an exception.
-    Success and error results are communicated through the logger.
+    Success and error results are communicated through the logger, and the returned outcome:
+    one of CREATED, EXISTS or FAILED.
     """
-    latest_sha = get_latest_commit_sha(github_repo_name, github_repo_owner=github_repo_owner)
+    try:
+        latest_sha = get_latest_commit_sha(github_repo_name, github_repo_owner=github_repo_owner)
+    except requests.RequestException as e:
+        logger.error(
+            f"func create_git_branch: Failed to get latest sha for repository named {github_repo_name}: {e}"
+        )
+        return FAILED
     if not latest_sha:
         logger.error(
             f"func create_git_branch: Failed to get latest sha from branch main or master for repository named {github_repo_name}. Branch {new_branch_name} is not created. Please check if the repository name is correct."
         )
-        return
-    create_ref_api = f"{GITHUB_API_URL}/repos/{DEFAULT_REPO_OWNER}/{github_repo_name}/git/refs"
+        return FAILED
+    create_ref_api = f"{GITHUB_API_URL}/repos/{github_repo_owner}/{github_repo_name}/git/refs"
     payload = {"ref": f"refs/heads/{new_branch_name}", "sha": latest_sha}
-    r = requests.post(
-        create_ref_api,
-        data=json.dumps(payload),
-        headers={
-            **HEADERS,
-            "Authorization": f"Token {os.environ.get(GITHUB_TOKEN_NAME)}",
-        },
-    )
+    try:
+        r = github_client().post(create_ref_api, data=json.dumps(payload), headers=HEADERS)
+    except requests.RequestException as e:
+        logger.error(
+            f"func create_git_branch: Failed to create branch `{new_branch_name}` in repository `{github_repo_name}`: {e}"
+        )
+        return FAILED
     if r.status_code == 201:
         logger.info(
             f"func create_git_branch: Branch `{new_branch_name}` is successfully created for repository `{github_repo_name}`"
         )
+        return CREATED
     elif r.status_code == 422:
         logger.info(
             f"func create_git_branch: Branch `{new_branch_name}` already exists in repository `{github_repo_name}`"
         )
+        return EXISTS
     else:
         logger.info(
             f"func create_git_branch: Something went wrong. Failed to create branch `{new_branch_name}` in repository `{github_repo_name}`. Check if authorization token is provided"
         )
+        return FAILED
+
 
+@dataclass
+class BranchCreationResult:
+    """The outcome of creating a branch in one repository.
+
+    Attributes:
+        github_repo_name: The repository the branch was created in
+        branch_name: The name of the branch
+        charms: The charms that needed this branch
+        outcome: One of CREATED, EXISTS or FAILED
+    """
+
+    github_repo_name: str
+    branch_name: str
+    charms: List[str]
+    outcome: str
+
+
+def get_branches_to_create(charms_info: dict) -> Dict[tuple, List[str]]:
+    """Return the branches needed by the charms, deduplicated across charms sharing a repository.
+
+    Takes the output of parse_yamls as input, returns a dictionary
+    { ("<github_repo_name>", "<branch_name>"): ["<charm_name>", ...] }
+    in the order the charms were first seen.
+    """
+    branches = {}
+    for charm, info in charms_info.items():
+        key = (info["github_repo_name"], f"track/{info['version']}")
+        branches.setdefault(key, []).append(charm)
+    return branches
 
-def branch_creation_automation(release_path: str) -> None:
+
+def create_git_branches(
+    branches: Dict[tuple, List[str]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    backend: str = REST_BACKEND,
+) -> List[BranchCreationResult]:
+    """Create many branches at once, returning their results in the order they were given.
+
+    Takes the output of get_branches_to_create as input.  With the REST backend, up to
+    `concurrency` branches are created at the same time, each in its own worker thread.  With the
+    GraphQL backend, branches are created through create_git_branches_graphql, and only those it
+    could not create are then created through REST.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+    if backend not in (REST_BACKEND, GRAPHQL_BACKEND):
+        raise ValueError(f"Unknown branch creation backend `{backend}`")
+
+    outcomes = {}
+    if backend == GRAPHQL_BACKEND:
+        outcomes = create_git_branches_graphql(list(branches))
+    remaining = [key for key in branches if key not in outcomes]
+    if remaining and backend == GRAPHQL_BACKEND:
+        logger.info(f"Falling back to the REST API to create branches {remaining}")
+
+    get_default_branch_resolver().prefetch(
+        f"{DEFAULT_REPO_OWNER}/{github_repo_name}" for github_repo_name, _ in remaining
+    )
+
+    def create(key):
+        github_repo_name, branch_name = key
+        logger.info(f"Start creating branch `{branch_name}` for charms {branches[key]}")
+        return create_git_branch(github_repo_name, branch_name)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes.update(zip(remaining, executor.map(create, remaining)))
+
+    return [BranchCreationResult(key[0], key[1], branches[key], outcomes[key]) for key in branches]
+
+
+def build_branch_heads_query(keys: List[tuple]) -> str:
+    """Return a GraphQL query for what is needed to create each (github_repo_name, branch_name).
+
+    For each of them, aliased r0, r1, ..., the query gets the id of the repository, its default
+    branch and the commit at its head, and whether the branch already exists.
+    """
+    fields = []
+    for index, (github_repo_name, branch_name) in enumerate(keys):
+        fields.append(
+            f"r{index}: repository(owner: {json.dumps(DEFAULT_REPO_OWNER)}, "
+            f"name: {json.dumps(github_repo_name)}) "
+            "{ id defaultBranchRef { name target { oid } } "
+            f"ref(qualifiedName: {json.dumps('refs/heads/' + branch_name)}) {{ name }} }}"
+        )
+    return "query { " + " ".join(fields) + " }"
+
+
+def build_create_refs_mutation(refs: Dict[int, tuple]) -> str:
+    """Return a GraphQL mutation creating refs, given as {index: (repository_id, ref, oid)}.
+
+    Each createRef is aliased m<index>.
+    """
+    fields = []
+    for index, (repository_id, ref, oid) in refs.items():
+        fields.append(
+            f"m{index}: createRef(input: {{repositoryId: {json.dumps(repository_id)}, "
+            f"name: {json.dumps(ref)}, oid: {json.dumps(oid)}}}) {{ ref {{ name }} }}"
+        )
+    return "mutation { " + " ".join(fields) + " }"
+
+
+def create_git_branches_graphql(keys: List[tuple]) -> Dict[tuple, str]:
+    """Create branches through the GraphQL API, in batches of GRAPHQL_BATCH_SIZE.
+
+    Each batch costs two requests: one query for the head commit of the default branch of each
+    repository, and one mutation creating all the missing branches.  Takes a list of
+    (github_repo_name, branch_name) as input, returns a dictionary of
+    { (github_repo_name, branch_name): CREATED or EXISTS }
+    Branches that could not be created, for example because their repository could not be found
+    or the whole request failed, are left out so that they can be retried through REST.
+    This function should NEVER raise an exception.
+    """
+    outcomes = {}
+    for start in range(0, len(keys), GRAPHQL_BATCH_SIZE):
+        end = start + GRAPHQL_BATCH_SIZE
+        outcomes.update(_create_git_branches_graphql_batch(keys[start:end]))
+    return outcomes
+
+
+def _plan_graphql_refs(keys: List[tuple], data: dict) -> Tuple[Dict[tuple, str], Dict[int, tuple]]:
+    """Return which branches already exist and which refs to create, from a branch heads query.
+
+    Also caches the default branches found in the shared DefaultBranchResolver.
+    """
+    outcomes = {}
+    refs_to_create = {}
+    default_branches = {}
+    for index, (github_repo_name, branch_name) in enumerate(keys):
+        repository = data.get(f"r{index}")
+        if not repository or not repository.get("defaultBranchRef"):
+            continue
+        default_branch = repository["defaultBranchRef"]
+        default_branches[f"{DEFAULT_REPO_OWNER}/{github_repo_name}"] = default_branch["name"]
+        if repository.get("ref"):
+            logger.info(
+                f"func create_git_branches_graphql: Branch `{branch_name}` already exists in repository `{github_repo_name}`"
+            )
+            outcomes[(github_repo_name, branch_name)] = EXISTS
+            continue
+        refs_to_create[index] = (
+            repository["id"],
+            f"refs/heads/{branch_name}",
+            default_branch["target"]["oid"],
+        )
+    get_default_branch_resolver().store(default_branches)
+    return outcomes, refs_to_create
+
+
+def _create_git_branches_graphql_batch(keys: List[tuple]) -> Dict[tuple, str]:
+    """Create a batch of branches through the GraphQL API, see create_git_branches_graphql."""
+    try:
+        data = github_client().graphql(build_branch_heads_query(keys)).get("data") or {}
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"func create_git_branches_graphql: Failed to look up repositories: {e}")
+        return {}
+
+    outcomes, refs_to_create = _plan_graphql_refs(keys, data)
+    if not refs_to_create:
+        return outcomes
+
+    try:
+        data = github_client().graphql(build_create_refs_mutation(refs_to_create)).get("data")
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"func create_git_branches_graphql: Failed to create branches: {e}")
+        return outcomes
+    for index in refs_to_create:
+        created = (data or {}).get(f"m{index}")
+        if created and created.get("ref"):
+            github_repo_name, branch_name = keys[index]
+            logger.info(
+                f"func create_git_branches_graphql: Branch `{branch_name}` is successfully created for repository `{github_repo_name}`"
+            )
+            outcomes[keys[index]] = CREATED
+    return outcomes
+
+
+def format_branch_creation_report(results: List[BranchCreationResult]) -> str:
+    """Return a plain text table of the outcome of each branch creation."""
+    header = ("REPOSITORY", "BRANCH", "OUTCOME", "CHARMS")
+    rows = [
+        (result.github_repo_name, result.branch_name, result.outcome, ",".join(result.charms))
+        for result in results
+    ]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    lines = [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in [header] + rows
+    ]
+    counts = {outcome: 0 for outcome in (CREATED, EXISTS, FAILED)}
+    for result in results:
+        counts[result.outcome] += 1
+    lines.append(", ".join(f"{count} {outcome}" for outcome, count in counts.items()))
+    return "\n".join(lines)
+
+
+def create_branches_for_charms(
+    charms_info: dict,
+    description: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    backend: str = REST_BACKEND,
+) -> List[BranchCreationResult]:
+    """Create the branches of charms, given in the format returned by parse_yamls.
+
+    Creates the branches `concurrency` repositories at a time, and returns the result of each
+    branch creation.  Charms sharing a repository and track only cause one branch creation.
+    `backend` selects the API used to create branches, see create_git_branches.  The report
+    logged at the end is titled with `description`.
+    """
+    if not charms_info:
+        return []
+    results = create_git_branches(
+        get_branches_to_create(charms_info), concurrency=concurrency, backend=backend
+    )
+    logger.info(
+        f"Branch creation report for {description}:\n" + format_branch_creation_report(results)
+    )
+    return results
+
+
+def branch_creation_automation(
+    release_path: str, concurrency: int = DEFAULT_CONCURRENCY, backend: str = REST_BACKEND
+) -> List[BranchCreationResult]:
     """Release directory path relative to the root of this repo as input
 
     e.g. "releases/1.4"
+    Creates the branches of every charm of the release, see create_branches_for_charms.
     """
     charms_info = parse_yamls(release_path)
-    for charm in charms_info:
-        logger.info(f"Start creating branch for charm `{charm}`")
-        create_git_branch(
-            charms_info[charm]["github_repo_name"],
-            f"track/{charms_info[charm]['version']}",
+    return create_branches_for_charms(
+        charms_info, f"`{release_path}`", concurrency=concurrency, backend=backend
+    )
+
+
+def get_changed_charms(base: str, head: str, repo_path: str = REPO_ROOT) -> Dict[str, dict]:
+    """Return the charms whose release changed between the base and head revisions.
+
+    Only the release bundle files changed between the two revisions are read, and their parsed
+    content is compared, so that edits that do not change any charm's channel (comments,
+    reordering, other fields) do not cause any branch creation.  Returns a dictionary of
+    { "<release_dir>": { "<charm_name>": {"version": str, "github_repo_name": str }}}
+    with the charms that are new, or whose track or repository changed, in each release directory.
+    """
+    result = {}
+    for path in iter_changed_release_files(base, head, repo_path):
+        new_content = read_file_at(head, path, repo_path)
+        if new_content is None:
+            # The bundle file was deleted
+            continue
+        old_content = read_file_at(base, path, repo_path)
+        old_charms = trim_bundle_dict(load_yaml(old_content)) if old_content else {}
+        new_charms = trim_bundle_dict(load_yaml(new_content))
+        changed = {
+            charm: info for charm, info in new_charms.items() if old_charms.get(charm) != info
+        }
+        logger.info(f"Charms changed in `{path}` between {base} and {head}: {changed}")
+        release_dir = f"{RELEASE_DIR_NAME}/{path.split('/')[1]}"
+        result.setdefault(release_dir, {}).update(changed)
+    return result
+
+
+def branch_creation_for_changes(
+    revision_range: str, concurrency: int = DEFAULT_CONCURRENCY, backend: str = REST_BACKEND
+) -> List[BranchCreationResult]:
+    """Create the branches of the charms whose release changed in a "<base>..<head>" range."""
+    base, head = revision_range.split("..")
+    results = []
+    for release_dir, charms_info in get_changed_charms(base, head).items():
+        results += create_branches_for_charms(
+            charms_info,
+            f"`{release_dir}` in {revision_range}",
+            concurrency=concurrency,
+            backend=backend,
         )
+    return results
 
 
 if __name__ == "__main__":
@@ -176,13 +643,15 @@ if __name__ == "__main__":
             f"Failed to find env var `{GITHUB_TOKEN_NAME}`. Unable to create branches without it."
         )
         sys.exit()
+    concurrency = int(os.environ.get(CONCURRENCY_ENV_NAME, DEFAULT_CONCURRENCY))
+    backend = os.environ.get(BACKEND_ENV_NAME, REST_BACKEND)
     if len(sys.argv) == 1:
-        git_diff = get_git_diff()
-        release_changes = get_modified_releases_dirs(git_diff)
-        for release_path in release_changes:
-            branch_creation_automation(release_path)
-    # for manually triggered runs
+        revision_range = os.environ.get(RANGE_ENV_NAME, DEFAULT_RANGE)
+        branch_creation_for_changes(revision_range, concurrency=concurrency, backend=backend)
+    # for manually triggered runs, on a revision range or a release directory
+    elif len(sys.argv) == 2 and ".." in sys.argv[1]:
+        branch_creation_for_changes(sys.argv[1], concurrency=concurrency, backend=backend)
     elif len(sys.argv) == 2:
-        branch_creation_automation(sys.argv[1])
+        branch_creation_automation(sys.argv[1], concurrency=concurrency, backend=backend)
     else:
         logger.error("Specified too many arguments. Script exited.")
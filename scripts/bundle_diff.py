@@ -0,0 +1,174 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""A structural diff of Juju bundles, shared by the scripts comparing bundles."""
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, Mapping, Set, Tuple
+
+# Fields of an application that are maps, compared key by key
+MAP_FIELDS = ("options", "resources", "storage", "bindings", "annotations")
+# A value that is not set, to tell it apart from a value set to None
+MISSING = "<missing>"
+
+Relation = FrozenSet[str]
+
+
+@dataclass
+class ApplicationChange:
+    """The changes to an application present in both bundles.
+
+    Attributes:
+        name: The name of the application
+        changes: The changed fields, as {field: (old, new)}.  Keys of map fields such as options
+                 are given as "<field>.<key>", and values that are not set are MISSING.
+    """
+
+    name: str
+    changes: Dict[str, Tuple[Any, Any]] = field(default_factory=dict)
+
+    @property
+    def channel(self) -> Tuple[Any, Any]:
+        """The (old, new) channel, or None if the channel did not change"""
+        return self.changes.get("channel")
+
+    def map_changes(self, map_field: str) -> Dict[str, Tuple[Any, Any]]:
+        """The changes to the keys of a map field, like options, as {key: (old, new)}"""
+        return {
+            name.split(".", 1)[1]: values
+            for name, values in self.changes.items()
+            if name.startswith(f"{map_field}.")
+        }
+
+
+@dataclass
+class BundleDiff:
+    """The differences between two bundles.  Empty, and falsy, when the bundles are the same."""
+
+    added_applications: Dict[str, Mapping] = field(default_factory=dict)
+    removed_applications: Dict[str, Mapping] = field(default_factory=dict)
+    changed_applications: Dict[str, ApplicationChange] = field(default_factory=dict)
+    added_relations: Set[Relation] = field(default_factory=set)
+    removed_relations: Set[Relation] = field(default_factory=set)
+    # Changes to the other top level fields of the bundle, as {field: (old, new)}
+    changes: Dict[str, Tuple[Any, Any]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        """Whether the bundles differ at all"""
+        return any(
+            [
+                self.added_applications,
+                self.removed_applications,
+                self.changed_applications,
+                self.added_relations,
+                self.removed_relations,
+                self.changes,
+            ]
+        )
+
+    @property
+    def channel_changes(self) -> Dict[str, Tuple[Any, Any]]:
+        """The applications whose channel changed, as {name: (old, new)}"""
+        return {
+            name: change.channel
+            for name, change in self.changed_applications.items()
+            if change.channel is not None
+        }
+
+    @property
+    def config_changes(self) -> Dict[str, Dict[str, Tuple[Any, Any]]]:
+        """The applications whose options changed, as {name: {option: (old, new)}}"""
+        result = {}
+        for name, change in self.changed_applications.items():
+            options = change.map_changes("options")
+            if options:
+                result[name] = options
+        return result
+
+
+def application_hash(application: Mapping) -> str:
+    """Returns a hash of the content of an application, independent of the order of its keys"""
+    content = json.dumps(application, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def normalize_relations(relations: Iterable) -> Set[Relation]:
+    """Returns relations as a set of unordered pairs of endpoints.
+
+    Bundles can also relate an endpoint to a list of endpoints, as in [a, [b, c]], which is the
+    same as the relations [a, b] and [a, c].
+
+    Raises:
+        ValueError: if a relation is not a pair of endpoints or lists of endpoints
+    """
+    result = set()
+    for relation in relations or []:
+        if not isinstance(relation, (list, tuple)) or len(relation) != 2:
+            raise ValueError(f"Invalid relation {relation!r}, expected a pair of endpoints")
+        first, second = (_endpoints(relation, side) for side in relation)
+        result.update(frozenset([a, b]) for a in first for b in second)
+    return result
+
+
+def _endpoints(relation, side) -> Tuple[str, ...]:
+    """Returns the endpoints of one side of a relation, given as an endpoint or list of them"""
+    endpoints = (side,) if isinstance(side, str) else side
+    if not isinstance(endpoints, (list, tuple)) or not all(
+        isinstance(endpoint, str) for endpoint in endpoints
+    ):
+        raise ValueError(f"Invalid relation {relation!r}, expected endpoints as strings")
+    return tuple(endpoints)
+
+
+def diff_application(name: str, old: Mapping, new: Mapping) -> ApplicationChange:
+    """Returns the changes between two versions of an application"""
+    change = ApplicationChange(name)
+    for key in sorted(set(old) | set(new), key=str):
+        old_value, new_value = old.get(key, MISSING), new.get(key, MISSING)
+        if old_value == new_value:
+            continue
+        if key in MAP_FIELDS and isinstance(old_value, Mapping) and isinstance(new_value, Mapping):
+            for map_key in sorted(set(old_value) | set(new_value), key=str):
+                values = (old_value.get(map_key, MISSING), new_value.get(map_key, MISSING))
+                if values[0] != values[1]:
+                    change.changes[f"{key}.{map_key}"] = values
+        else:
+            change.changes[key] = (old_value, new_value)
+    return change
+
+
+def diff_bundles(old: Mapping, new: Mapping) -> BundleDiff:
+    """Returns the differences between two bundles, given as their parsed yaml.
+
+    Applications are matched by name and first compared by their application_hash, so that only
+    the applications that differ are compared field by field.  Relations are compared as
+    unordered pairs, so the order of relations and of their endpoints does not matter.
+    """
+    result = BundleDiff()
+    old_applications = old.get("applications") or {}
+    new_applications = new.get("applications") or {}
+    for name, application in new_applications.items():
+        if name not in old_applications:
+            result.added_applications[name] = application
+        elif application_hash(old_applications[name]) != application_hash(application):
+            change = diff_application(name, old_applications[name], application)
+            # Equal values can still hash differently, like 1 and 1.0
+            if change.changes:
+                result.changed_applications[name] = change
+    for name, application in old_applications.items():
+        if name not in new_applications:
+            result.removed_applications[name] = application
+
+    old_relations = normalize_relations(old.get("relations"))
+    new_relations = normalize_relations(new.get("relations"))
+    result.added_relations = new_relations - old_relations
+    result.removed_relations = old_relations - new_relations
+
+    for key in set(old) | set(new):
+        if key in ("applications", "relations"):
+            continue
+        old_value, new_value = old.get(key, MISSING), new.get(key, MISSING)
+        if old_value != new_value:
+            result.changes[key] = (old_value, new_value)
+    return result
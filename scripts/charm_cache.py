@@ -0,0 +1,106 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""An on-disk cache of charm metadata, shared by the scripts and the CI jobs running them."""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+CACHE_FILE_ENV_NAME = "CHARM_CACHE_FILE"
+DEFAULT_CACHE_FILE = os.path.join(
+    os.path.expanduser("~"), ".cache", "kubeflow-ci", "channel_maps.json"
+)
+# How long, in seconds, a cached channel map is trusted before being fetched again
+DEFAULT_TTL = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelMapCache:
+    """Caches the channel map of charms in a file, with the time each was fetched at.
+
+    The cache file is a JSON object of
+    { "<charm_name>": {"channel_map": dict, "fetched_at": float }}
+    Entries are trusted for `ttl` seconds.  Writes hold an exclusive lock on `<cache_file>.lock`,
+    merge with what other processes wrote since the file was read, and atomically replace the
+    file, so that parallel jobs can share one cache file.  If no cache file is given, channel
+    maps are only cached in memory.
+    """
+
+    def __init__(self, cache_file: Optional[str] = None, ttl: float = DEFAULT_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache = self._load()
+
+    def _load(self) -> dict:
+        """Return the content of the cache file, or an empty cache if it cannot be read"""
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable charm cache `{self.cache_file}`: {e}")
+            return {}
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold an exclusive lock on the cache file, across processes"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        with open(f"{self.cache_file}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self, entries: dict):
+        """Merge entries with the cache file, keeping the newest of each, and write it back"""
+        with self._file_lock():
+            cache = self._load()
+            for charm, entry in entries.items():
+                if charm not in cache or cache[charm]["fetched_at"] <= entry["fetched_at"]:
+                    cache[charm] = entry
+            temporary_file = f"{self.cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_file, "w") as file:
+                json.dump(cache, file, indent=2, sort_keys=True, default=str)
+            os.replace(temporary_file, self.cache_file)
+        return cache
+
+    def get(self, charm: str) -> Optional[dict]:
+        """Return the cached channel map of a charm, if it has not expired"""
+        with self._lock:
+            entry = self._cache.get(charm)
+        if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        return entry["channel_map"]
+
+    def store(self, channel_maps: Dict[str, dict]):
+        """Cache the channel maps of charms, given as { "<charm_name>": dict }"""
+        if not channel_maps:
+            return
+        now = time.time()
+        entries = {
+            charm: {"channel_map": channel_map, "fetched_at": now}
+            for charm, channel_map in channel_maps.items()
+        }
+        with self._lock:
+            if self.cache_file is None:
+                self._cache.update(entries)
+            else:
+                self._cache = self._save(entries)
+
+
+def get_channel_map_cache(
+    cache_file: Optional[str] = None, ttl: float = DEFAULT_TTL
+) -> ChannelMapCache:
+    """Return a channel map cache in cache_file, by default from the CHARM_CACHE_FILE env var"""
+    return ChannelMapCache(
+        cache_file or os.environ.get(CACHE_FILE_ENV_NAME, DEFAULT_CACHE_FILE), ttl=ttl
+    )
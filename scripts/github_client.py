@@ -0,0 +1,252 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Shared client for the Github REST API, used by the scripts in this repo.
+
+The client keeps a pooled HTTP session, so that requests reuse keep-alive connections instead of
+opening a new one each time.  GET responses are cached along with their ETag, and requested again
+conditionally: Github answers 304 Not Modified when nothing changed, which does not count against
+the rate limit.  The rate limit reported by Github is tracked, and requests are slowed down before
+it runs out rather than failing once it has.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GITHUB_API_URL = "https://api.github.com"
+
+logger = logging.getLogger(__name__)
+
+
+class GithubClient:
+    """A pooled, caching and rate limit aware client for the Github REST API.
+
+    A client is safe to share between threads.
+
+    Args:
+        token: The Github token to authenticate with.  Requests are unauthenticated if omitted.
+        api_url: The url of the Github API
+        pool_size: The maximum number of connections kept open to the Github API
+        rate_limit_reserve: Once the remaining rate limit drops to this many requests, wait for it
+                            to reset before sending any more
+        pace_below: Once the remaining rate limit drops below this many requests, spread the
+                    remaining requests evenly until the rate limit resets
+        sleep: Function used to wait, in seconds.  Overridden in tests.
+
+    Attributes:
+        requests_sent: The number of requests sent
+        not_modified: The number of conditional requests answered with 304 Not Modified
+        rate_limit_remaining: The remaining rate limit last reported by Github, if any
+        rate_limit_reset: When the rate limit resets, as a unix timestamp, if known
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        api_url: str = GITHUB_API_URL,
+        pool_size: int = 10,
+        rate_limit_reserve: int = 50,
+        pace_below: int = 500,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.token = token
+        self.api_url = api_url.rstrip("/")
+        self.pool_size = pool_size
+        self.rate_limit_reserve = rate_limit_reserve
+        self.pace_below = pace_below
+        self._sleep = sleep
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        if token:
+            self.session.headers["Authorization"] = f"Token {token}"
+
+        self.requests_sent = 0
+        self.not_modified = 0
+        self.rate_limit_remaining: Optional[int] = None
+        self.rate_limit_reset: Optional[float] = None
+
+        self._lock = threading.Lock()
+        self._etag_cache: Dict[Tuple[str, str], Tuple[str, requests.Response]] = {}
+        self._workflows: Dict[Tuple[str, str], tuple] = {}
+        self._github = None
+
+    def url(self, path: str) -> str:
+        """Returns the full url of an API path, leaving full urls untouched"""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.api_url}/{path.lstrip('/')}"
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Sends a request to the Github API, throttling it if the rate limit is running low.
+
+        Args:
+            method: The HTTP method
+            path: The API path, such as "/repos/owner/repo", or a full url
+            kwargs: Passed on to requests.Session.request
+
+        Returns:
+            The requests.Response, whatever its status code
+        """
+        self.throttle()
+        response = self.session.request(method, self.url(path), **kwargs)
+        self._record(response)
+        return response
+
+    def get(self, path: str, params: Optional[dict] = None, **kwargs) -> requests.Response:
+        """Sends a GET request, answered from the cache if Github says it is not modified.
+
+        Responses with an ETag are cached.  If we already have a cached response for the same
+        url and params, the request is sent with If-None-Match, and the cached response is
+        returned if Github answers 304 Not Modified.
+
+        Args:
+            path: The API path, such as "/repos/owner/repo", or a full url
+            params: The query parameters of the request
+            kwargs: Passed on to requests.Session.request
+        """
+        url = self.url(path)
+        key = (url, repr(sorted((params or {}).items())))
+        with self._lock:
+            cached = self._etag_cache.get(key)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
+
+        response = self.request("GET", url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            with self._lock:
+                self.not_modified += 1
+            return cached[1]
+
+        etag = response.headers.get("ETag")
+        if etag and response.status_code == 200:
+            with self._lock:
+                self._etag_cache[key] = (etag, response)
+        return response
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """Sends a POST request to the Github API"""
+        return self.request("POST", path, **kwargs)
+
+    def graphql(self, query: str, variables: Optional[dict] = None) -> dict:
+        """Sends a query to the Github GraphQL API, returning the decoded response.
+
+        Github answers GraphQL queries with 200 even when some of the fields could not be
+        resolved, so callers should check the "errors" of the response as well as its "data".
+
+        Raises:
+            requests.HTTPError: if the request itself failed
+        """
+        response = self.post("/graphql", json={"query": query, "variables": variables or {}})
+        response.raise_for_status()
+        return response.json()
+
+    def _record(self, response: requests.Response):
+        """Records the rate limit reported in the headers of a response"""
+        with self._lock:
+            self.requests_sent += 1
+            remaining = response.headers.get("X-RateLimit-Remaining")
+            reset = response.headers.get("X-RateLimit-Reset")
+            if remaining is not None:
+                self.rate_limit_remaining = int(remaining)
+            if reset is not None:
+                self.rate_limit_reset = float(reset)
+
+    def throttle(self):
+        """Waits before the next request if the remaining rate limit is running low.
+
+        At or below rate_limit_reserve remaining requests, this waits until the rate limit resets.
+        Below pace_below, it waits long enough that the remaining requests are spread evenly until
+        the rate limit resets.
+        """
+        with self._lock:
+            remaining, reset = self.rate_limit_remaining, self.rate_limit_reset
+        if remaining is None or reset is None or remaining >= self.pace_below:
+            return
+
+        until_reset = reset - time.time()
+        if until_reset <= 0:
+            return
+        if remaining <= self.rate_limit_reserve:
+            logger.warning(
+                f"Only {remaining} Github API requests left, waiting {until_reset:.0f}s for the "
+                f"rate limit to reset"
+            )
+            delay = until_reset
+        else:
+            delay = until_reset / (remaining - self.rate_limit_reserve)
+        self._sleep(delay)
+
+    @property
+    def github(self):
+        """A PyGithub client authenticated with the same token, created on first use"""
+        # Imported here so that scripts that do not use PyGithub do not need it installed
+        from github import Github
+
+        with self._lock:
+            if self._github is None:
+                self._github = Github(
+                    login_or_token=self.token,
+                    base_url=self.api_url,
+                    pool_size=self.pool_size,
+                )
+            return self._github
+
+    def get_workflow(self, repository: str, workflow_name: str):
+        """Returns a github.Workflow.Workflow, revalidating the cached one with its ETag.
+
+        Unlike going through Github.get_repo(...).get_workflow(...), this costs a single request,
+        and none against the rate limit if the workflow did not change since we last fetched it.
+
+        Args:
+            repository: The repository the workflow lives in, in the format "owner/repo"
+            workflow_name: The name of the workflow, typically the filename of the workflow
+
+        Raises:
+            github.GithubException: if Github does not return the workflow
+        """
+        import github
+
+        response = self.get(f"/repos/{repository}/actions/workflows/{workflow_name}")
+        if response.status_code != 200:
+            exception_class = (
+                github.UnknownObjectException
+                if response.status_code == 404
+                else github.GithubException
+            )
+            raise exception_class(response.status_code, response.json(), dict(response.headers))
+
+        key = (repository, workflow_name)
+        with self._lock:
+            cached = self._workflows.get(key)
+        if cached is not None and cached[0] is response:
+            return cached[1]
+
+        workflow = self.github.create_from_raw_data(
+            github.Workflow.Workflow, response.json(), dict(response.headers)
+        )
+        with self._lock:
+            self._workflows[key] = (response, workflow)
+        return workflow
+
+
+_clients: Dict[Tuple[Optional[str], str], GithubClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token: Optional[str] = None, api_url: str = GITHUB_API_URL) -> GithubClient:
+    """Returns the GithubClient shared by everything using the same token and API url"""
+    with _clients_lock:
+        key = (token, api_url)
+        if key not in _clients:
+            _clients[key] = GithubClient(token=token, api_url=api_url)
+        return _clients[key]
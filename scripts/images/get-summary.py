@@ -6,9 +6,14 @@
 """Script to process Trivy vulnerability scans reports and produce summary."""
 
 import argparse
-import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+from summary_cache import DEFAULT_CACHE_NAME, SummaryCache, default_cache_file
+from trivy_report import SEVERITIES, JSONStream
+from vulnerability_index import InvalidIndexError, build_index, connect_index, image_summaries
 
 
 def get_reports_files_list(report_path: str) -> List[str]:
@@ -56,28 +61,95 @@ def get_oci_image_name(report_json: dict) -> str:
     return report_json[oci_image_key]
 
 
-def flatten_vulnerabilities(report_json) -> List[dict]:
-    """Return a list of vulnerabilities that contain severity and class."""
-    if "Results" not in report_json:
-        # no scan results found, skip this report
-        return []
+def count_result_vulnerabilities(stream: JSONStream) -> Tuple[str, Dict[str, int]]:
+    """Read a `Results` entry of a report, returning its class and its count of each severity"""
+    clss, counts = None, dict.fromkeys(SEVERITIES, 0)
+    for key in stream.members():
+        if key == "Class":
+            clss = stream.value()
+        elif key == "Vulnerabilities" and stream.peek() == "[":
+            for _ in stream.items():
+                counts[stream.value()["Severity"]] += 1
+        else:
+            stream.skip()
+    return clss, counts
 
-    vuln_list = []
-    for result in report_json["Results"]:
-        if not result.get("Vulnerabilities", 0):
-            # no vulnerabilities found, skip this report
-            continue
 
-        # class is either os-pkgs or lang-pkgs
-        for vuln in result["Vulnerabilities"]:
-            vuln_list.append({"class": result["Class"], "severity": vuln["Severity"]})
+def summarize_report(file) -> Tuple[str, str, Dict[str, Dict[str, int]]]:
+    """Stream a Trivy report, returning its image, base OS and count of each severity per class.
+
+    The counts are returned as {"all": counts, "os-pkgs": counts, "lang-pkgs": counts}, where
+    counts are {severity: int}.  Vulnerabilities are counted as they are read, so memory does
+    not grow with the size of the report.
+    """
+    report = {}
+    summary = {clss: dict.fromkeys(SEVERITIES, 0) for clss in ["all", "os-pkgs", "lang-pkgs"]}
+    stream = JSONStream(file)
+    for key in stream.members():
+        if key == "Results" and stream.peek() == "[":
+            for _ in stream.items():
+                clss, counts = count_result_vulnerabilities(stream)
+                for severity, count in counts.items():
+                    summary["all"][severity] += count
+                    if clss in summary:
+                        summary[clss][severity] += count
+        elif key in ("ArtifactName", "Metadata"):
+            report[key] = stream.value()
+        else:
+            stream.skip()
+    report.setdefault("Metadata", {})
+    return get_oci_image_name(report), get_base_os(report), summary
+
+
+def summarize_report_file(file: Path) -> Tuple[str, str, Tuple[int, ...]]:
+    """Return the image, base OS and counts of a report file, in the order of the CSV columns.
+
+    The counts are CRITICAL, HIGH, MEDIUM and LOW for all packages, then each of those for
+    os-pkgs and lang-pkgs.
+    """
+    with open(file, "r") as json_file:
+        oci_image, base_os, summary = summarize_report(json_file)
+    counts = [summary["all"][severity] for severity in SEVERITIES[:4]]
+    for severity in SEVERITIES[:4]:
+        counts += [summary["os-pkgs"][severity], summary["lang-pkgs"][severity]]
+    return oci_image, base_os, tuple(counts)
+
+
+def summarize_reports(
+    files: List[Path], jobs: int = 1, cache: Optional[SummaryCache] = None
+) -> List[Tuple[str, str, Tuple[int, ...]]]:
+    """Summarize report files, in a pool of `jobs` processes if more than 1, sorted by row.
+
+    With a cache, only the reports that are not cached, or changed since, are parsed.
+    """
+    summaries = []
+    if cache is not None:
+        cached = [(file, cache.get(file)) for file in files]
+        summaries = [summary for _, summary in cached if summary is not None]
+        files = [file for file, summary in cached if summary is None]
+
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(files) // (jobs * 4))
+            parsed = list(executor.map(summarize_report_file, files, chunksize=chunksize))
+    else:
+        parsed = [summarize_report_file(file) for file in files]
+    summaries += parsed
 
-    return vuln_list
+    if cache is not None:
+        for file, summary in zip(files, parsed):
+            cache.store(file, summary)
+    return sorted(summaries)
 
 
-def main(report_path, print_header):
-    file_list = get_reports_files_list(report_path)
+def main(report_path, print_header, jobs=1, index=None, cache_file=None):
+    """Print the summary CSV of the reports at report_path.
 
+    With an index, the reports are first indexed there, see vulnerability_index.py, and the
+    summary is read back from it.  Without a report_path, the summary is read from the existing
+    index.  Otherwise, with a cache_file, the summaries of unchanged reports are read from it,
+    see summary_cache.py.
+    """
     header_roq = [
         "IMAGE",
         "BASE",
@@ -94,55 +166,60 @@ def main(report_path, print_header):
         "LOW-OS",
         "LOW-LANG",
     ]
+    # Opened first, so that a missing index fails before anything is printed
+    connection = connect_index(index) if index and not report_path else None
     if print_header:
         print(",".join(header_roq))
 
-    for file in file_list:
+    json_files = []
+    for file in get_reports_files_list(report_path) if report_path else []:
+        if file.name == DEFAULT_CACHE_NAME or (
+            cache_file and file.resolve() == Path(cache_file).resolve()
+        ):
+            continue
         if file.suffix != ".json":
-            raise ValueError("File is not .json %s" % file)
-
-        with open(file, "r") as json_file:
-            report_json = json.load(json_file)
-
-        oci_image = get_oci_image_name(report_json)
-        base_os = get_base_os(report_json)
-
-        # calculate total number of CVEs per category
-        lang_pkgs = {"CRITICAL": 0, "HIGH": 0, "MEDIUM": 0, "LOW": 0, "UNKNOWN": 0}
-        os_pkgs = {"CRITICAL": 0, "HIGH": 0, "MEDIUM": 0, "LOW": 0, "UNKNOWN": 0}
-        all_pkgs = {"CRITICAL": 0, "HIGH": 0, "MEDIUM": 0, "LOW": 0, "UNKNOWN": 0}
-
-        for vulnerability in flatten_vulnerabilities(report_json):
-            clss = vulnerability["class"]
-            sev = vulnerability["severity"]
-
-            all_pkgs[sev] += 1
-            if clss == "os-pkgs":
-                os_pkgs[sev] += 1
-            if clss == "lang-pkgs":
-                lang_pkgs[sev] += 1
-
-        base_info = "%s,%s" % (oci_image, base_os)
-        all_pkgs_info = "%s,%s,%s,%s" % (
-            all_pkgs["CRITICAL"],
-            all_pkgs["HIGH"],
-            all_pkgs["MEDIUM"],
-            all_pkgs["LOW"],
-        )
-        crit_info = "%s,%s" % (os_pkgs["CRITICAL"], lang_pkgs["CRITICAL"])
-        high_info = "%s,%s" % (os_pkgs["HIGH"], lang_pkgs["HIGH"])
-        medium_info = "%s,%s" % (os_pkgs["MEDIUM"], lang_pkgs["MEDIUM"])
-        low_info = "%s,%s" % (os_pkgs["LOW"], lang_pkgs["LOW"])
-
-        print(
-            "%s,%s,%s,%s,%s,%s"
-            % (base_info, all_pkgs_info, crit_info, high_info, medium_info, low_info)
-        )
+            print("WARNING: Skipping file that is not .json %s" % file, file=sys.stderr)
+            continue
+        json_files.append(file)
+
+    if index:
+        connection = connection or build_index(json_files, index)
+        summaries = image_summaries(connection)
+        connection.close()
+    elif cache_file:
+        cache = SummaryCache(cache_file)
+        summaries = summarize_reports(json_files, jobs, cache)
+        cache.save(json_files)
+    else:
+        summaries = summarize_reports(json_files, jobs)
+    for oci_image, base_os, counts in summaries:
+        print(",".join([oci_image, base_os] + [str(count) for count in counts]))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--report-path")
     parser.add_argument("--print-header", action="store_true")
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of processes to parse reports with"
+    )
+    parser.add_argument(
+        "--index", help="SQLite vulnerability index to build from the reports, or to read from"
+    )
+    parser.add_argument(
+        "--cache-file",
+        help=f"Cache of the report summaries, by default {DEFAULT_CACHE_NAME} next to the reports",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Parse every report, without reading the cache"
+    )
     args = parser.parse_args()
-    main(args.report_path, args.print_header)
+    if not (args.report_path or args.index):
+        parser.error("--report-path or --index is required")
+    cache_file = None
+    if args.report_path and not args.no_cache:
+        cache_file = args.cache_file or default_cache_file(args.report_path)
+    try:
+        main(args.report_path, args.print_header, args.jobs, args.index, cache_file)
+    except InvalidIndexError as e:
+        parser.error(str(e))
@@ -0,0 +1,119 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A sidecar cache of the summaries of Trivy reports, so only new or changed reports are parsed."""
+
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_CACHE_NAME = ".summary-cache.json"
+# Bumped whenever the format of the cached summaries changes, to ignore older caches
+CACHE_VERSION = 1
+HASH_READ_SIZE = 1024 * 1024
+
+Summary = Tuple[str, str, Tuple[int, ...]]
+
+
+def file_hash(file: Path) -> str:
+    """Return the sha256 of the content of a file"""
+    digest = hashlib.sha256()
+    with open(file, "rb") as binary_file:
+        for chunk in iter(lambda: binary_file.read(HASH_READ_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_cache_file(report_path: str) -> Path:
+    """Return the sidecar cache file of a directory of reports, or of a single report"""
+    path = Path(report_path)
+    return (path if path.is_dir() else path.parent) / DEFAULT_CACHE_NAME
+
+
+class SummaryCache:
+    """Caches the summary of each report file, with the mtime, size and hash of its content.
+
+    The cache file is a JSON object of
+    {"version": int, "reports": {"<file name>": {"mtime": float, "size": int, "sha256": str,
+                                                  "summary": [image, base, [counts]]}}}
+    A report whose mtime and size are unchanged is not read at all.  If either changed, the
+    report is hashed, and only parsed again if its content did change, so reports copied or
+    touched by the scan jobs are not parsed again.
+    """
+
+    def __init__(self, cache_file: Path):
+        self.cache_file = Path(cache_file)
+        self._entries = self._load()
+        self._updated = {}
+
+    def _load(self) -> Dict[str, dict]:
+        """Return the entries of the cache file, or no entries if it cannot be read"""
+        if not self.cache_file.exists():
+            return {}
+        try:
+            with open(self.cache_file, "r") as file:
+                cache = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Ignoring unreadable cache {self.cache_file}: {e}", file=sys.stderr)
+            return {}
+        if cache.get("version") != CACHE_VERSION:
+            return {}
+        return cache["reports"]
+
+    def get(self, file: Path) -> Optional[Summary]:
+        """Return the cached summary of a report file, if its content did not change"""
+        entry = self._entries.get(file.name)
+        if entry is None:
+            return None
+        stat = file.stat()
+        if (entry["mtime"], entry["size"]) != (stat.st_mtime, stat.st_size):
+            if entry["size"] != stat.st_size or entry["sha256"] != file_hash(file):
+                return None
+            entry = dict(entry, mtime=stat.st_mtime)
+            self._updated[file.name] = entry
+        image, base, counts = entry["summary"]
+        return image, base, tuple(counts)
+
+    def store(self, file: Path, summary: Summary):
+        """Cache the summary of a report file, as of its current content"""
+        stat = file.stat()
+        self._updated[file.name] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "sha256": file_hash(file),
+            "summary": summary,
+        }
+
+    def save(self, files: Iterable[Path]):
+        """Write the entries of files back to the cache file, dropping those of removed reports.
+
+        The entries of reports that were not summarized this time but are still next to them,
+        for example when summarizing a single report, are kept.  The cache is only an
+        optimization, so if it cannot be written, for example to a read-only directory of
+        reports, a warning is printed and the summaries are not cached.
+        """
+        files = list(files)
+        names = {file.name for file in files}
+        directories = {file.parent for file in files} or {self.cache_file.parent}
+        entries = {**self._entries, **self._updated}
+        reports = {
+            name: entry
+            for name, entry in entries.items()
+            if name in names or any((directory / name).exists() for directory in directories)
+        }
+        if reports == self._entries:
+            return
+        temporary_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+        try:
+            with open(temporary_file, "w") as file:
+                json.dump({"version": CACHE_VERSION, "reports": reports}, file, sort_keys=True)
+            os.replace(temporary_file, self.cache_file)
+        except OSError as e:
+            print(f"WARNING: Not caching the summaries in {self.cache_file}: {e}", file=sys.stderr)
+            if temporary_file.exists():
+                temporary_file.unlink()
+            return
+        self._entries, self._updated = reports, {}
@@ -0,0 +1,236 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Tests for get-summary.py"""
+
+import importlib.util
+import io
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import trivy_report
+
+SCRIPT = Path(__file__).parent / "get-summary.py"
+spec = importlib.util.spec_from_file_location("get_summary", SCRIPT)
+get_summary = importlib.util.module_from_spec(spec)
+# Registered so that the process pool can pickle its functions
+sys.modules["get_summary"] = get_summary
+spec.loader.exec_module(get_summary)
+
+
+def vulnerability(index: int, severity: str) -> dict:
+    return {
+        "VulnerabilityID": f"CVE-2023-{index}",
+        "PkgName": f"package-{index}",
+        "InstalledVersion": "1.0.0",
+        "Severity": severity,
+        "Title": 'Some "quoted" title with unicode é and [brackets] {braces}',
+        "CVSS": {"nvd": {"V3Score": 7.5, "V3Vector": "CVSS:3.1/AV:N"}},
+        "References": [f"https://example.com/{index}/{n}" for n in range(3)],
+    }
+
+
+REPORT = {
+    "SchemaVersion": 2,
+    "ArtifactName": "charmedkubeflow/some-image:1.0",
+    "ArtifactType": "container_image",
+    "Metadata": {"OS": {"Family": "ubuntu", "Name": "22.04"}, "ImageID": "sha256:abc"},
+    "Results": [
+        {
+            "Target": "ubuntu 22.04",
+            "Class": "os-pkgs",
+            "Type": "ubuntu",
+            "Packages": [{"Name": "libc", "Version": "2.35"}],
+            "Vulnerabilities": [
+                vulnerability(1, "CRITICAL"),
+                vulnerability(2, "HIGH"),
+                vulnerability(3, "LOW"),
+                vulnerability(4, "UNKNOWN"),
+            ],
+        },
+        {"Target": "app/requirements.txt", "Class": "lang-pkgs", "Vulnerabilities": None},
+        {
+            "Target": "app/go.sum",
+            "Vulnerabilities": [vulnerability(5, "HIGH"), vulnerability(6, "MEDIUM")],
+            # Class after Vulnerabilities still counts them as lang-pkgs
+            "Class": "lang-pkgs",
+        },
+        {"Target": "secrets", "Class": "secret", "Vulnerabilities": [vulnerability(7, "HIGH")]},
+    ],
+}
+
+
+# The counts of REPORT: vulnerabilities of other classes, like secrets, only count in "all"
+EXPECTED_SUMMARY = {
+    "all": {"CRITICAL": 1, "HIGH": 3, "MEDIUM": 1, "LOW": 1, "UNKNOWN": 1},
+    "os-pkgs": {"CRITICAL": 1, "HIGH": 1, "MEDIUM": 0, "LOW": 1, "UNKNOWN": 1},
+    "lang-pkgs": {"CRITICAL": 0, "HIGH": 1, "MEDIUM": 1, "LOW": 0, "UNKNOWN": 0},
+}
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 64 * 1024])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_summarize_report(read_size, indent, monkeypatch):
+    monkeypatch.setattr(trivy_report, "READ_SIZE", read_size)
+    content = json.dumps(REPORT, indent=indent, ensure_ascii=False)
+
+    result = get_summary.summarize_report(io.StringIO(content))
+
+    assert result == ("charmedkubeflow/some-image:1.0", "ubuntu:22.04", EXPECTED_SUMMARY)
+
+
+def walk(stream: trivy_report.JSONStream):
+    """Read the next value of a stream one member and item at a time"""
+    if stream.peek() == "{":
+        return {key: walk(stream) for key in stream.members()}
+    if stream.peek() == "[":
+        return [walk(stream) for _ in stream.items()]
+    return stream.value()
+
+
+@pytest.mark.parametrize("read_size", range(1, 17))
+@pytest.mark.parametrize(
+    "content",
+    ['{"a": 12.5, "b": 1}', "[1e5]", "[-2.5e10]", '{"V3Score": 7.5, "n": [-0.25E+2, 3]}'],
+)
+def test_json_stream_reads_numbers_split_across_reads(read_size, content):
+    stream = trivy_report.JSONStream(io.StringIO(content), read_size)
+    assert walk(stream) == json.loads(content)
+
+
+def test_summarize_report_without_results():
+    report = {"ArtifactName": "some-image", "Metadata": {}}
+    image, base, summary = get_summary.summarize_report(io.StringIO(json.dumps(report)))
+    assert (image, base) == ("some-image", "N/A")
+    assert sum(summary["all"].values()) == 0
+
+
+def test_summarize_report_rejects_truncated_reports():
+    with pytest.raises(ValueError):
+        get_summary.summarize_report(io.StringIO(json.dumps(REPORT)[:-50]))
+
+
+def test_main_output(tmp_path, capsys):
+    (tmp_path / "report.json").write_text(json.dumps(REPORT))
+    get_summary.main(str(tmp_path), print_header=False)
+    assert capsys.readouterr().out == (
+        "charmedkubeflow/some-image:1.0,ubuntu:22.04,1,3,1,1,1,0,1,1,0,1,1,0\n"
+    )
+
+
+def write_large_report(path: Path, size: int):
+    """Writes a report of about size bytes, written as it is generated"""
+    severities = ["CRITICAL", "HIGH", "MEDIUM", "LOW"]
+    with open(path, "w") as file:
+        file.write('{"ArtifactName": "large-image", "Metadata": {}, "Results": [')
+        file.write('{"Class": "lang-pkgs", "Vulnerabilities": [')
+        index = 0
+        while file.tell() < size:
+            if index:
+                file.write(",")
+            file.write(json.dumps(vulnerability(index, severities[index % 4])))
+            index += 1
+        file.write("]}]}")
+    return index
+
+
+MEASURE = """
+import importlib.util, json, resource, sys, time
+spec = importlib.util.spec_from_file_location("get_summary", sys.argv[1])
+get_summary = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(get_summary)
+
+start = time.monotonic()
+with open(sys.argv[2]) as file:
+    if sys.argv[3] == "stream":
+        counts = get_summary.summarize_report(file)[2]["all"]
+    else:
+        # Loading the whole report, as get-summary.py did before streaming it
+        counts = {}
+        for result in json.load(file)["Results"]:
+            for vulnerability in result.get("Vulnerabilities") or []:
+                counts[vulnerability["Severity"]] = counts.get(vulnerability["Severity"], 0) + 1
+elapsed = time.monotonic() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"elapsed": elapsed, "rss": rss, "high": counts["HIGH"]}))
+"""
+
+
+@pytest.mark.benchmark
+def test_benchmark_large_report(tmp_path):
+    """Compares loading and streaming a 50 MB report, in time and peak RSS"""
+    path = tmp_path / "large.json"
+    n_vulnerabilities = write_large_report(path, 50 * 1024 * 1024)
+
+    results = {}
+    for mode in ["load", "stream"]:
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE, str(SCRIPT), str(path), mode],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(output)
+
+    print(
+        f"{n_vulnerabilities} vulnerabilities: "
+        + ", ".join(
+            f"{mode} {result['elapsed']:.2f}s and {result['rss'] // 1024}MiB peak RSS"
+            for mode, result in results.items()
+        )
+    )
+    assert results["stream"]["high"] == results["load"]["high"]
+    assert results["stream"]["rss"] < results["load"]["rss"] / 2
+
+
+def write_reports(path: Path, n_reports: int):
+    """Writes reports of images named in the reverse order of their file names"""
+    path.mkdir()
+    for index in range(n_reports):
+        report = dict(REPORT, ArtifactName=f"image-{n_reports - index:03}")
+        report["Results"] = REPORT["Results"][: index % 4 + 1]
+        (path / f"report-{index:03}.json").write_text(json.dumps(report))
+
+
+def test_main_sorts_rows_by_image_and_skips_other_files(tmp_path, capsys):
+    write_reports(tmp_path / "reports", 5)
+    (tmp_path / "reports" / "scan.log").write_text("not a report")
+
+    get_summary.main(str(tmp_path / "reports"), print_header=True)
+
+    captured = capsys.readouterr()
+    rows = captured.out.splitlines()
+    assert rows[0].startswith("IMAGE,BASE,")
+    assert [row.split(",")[0] for row in rows[1:]] == [f"image-{n:03}" for n in range(1, 6)]
+    assert "Skipping file that is not .json" in captured.err
+
+
+def test_jobs_give_the_same_output(tmp_path, capsys):
+    write_reports(tmp_path / "reports", 12)
+    get_summary.main(str(tmp_path / "reports"), print_header=False, jobs=1)
+    serial = capsys.readouterr().out
+    get_summary.main(str(tmp_path / "reports"), print_header=False, jobs=3)
+    assert capsys.readouterr().out == serial
+
+
+@pytest.mark.benchmark
+def test_benchmark_jobs(tmp_path):
+    """Compares summarizing 16 reports of 5 MB with 1 and 4 processes"""
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    for index in range(16):
+        write_large_report(reports / f"report-{index:02}.json", 5 * 1024 * 1024)
+    files = sorted(reports.iterdir())
+
+    elapsed = {}
+    for jobs in [1, 4]:
+        start = time.monotonic()
+        summaries = get_summary.summarize_reports(files, jobs)
+        elapsed[jobs] = time.monotonic() - start
+        assert len(summaries) == 16
+
+    print(f"16 reports of 5 MB: 1 job {elapsed[1]:.2f}s, 4 jobs {elapsed[4]:.2f}s")
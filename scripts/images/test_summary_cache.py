@@ -0,0 +1,161 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Tests for summary_cache.py"""
+
+import json
+import os
+import time
+
+import pytest
+import summary_cache
+from test_get_summary import REPORT, get_summary, write_large_report, write_reports
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """The names of the report files parsed by get_summary"""
+    files = []
+    summarize_report_file = get_summary.summarize_report_file
+
+    def summarize(file):
+        files.append(file.name)
+        return summarize_report_file(file)
+
+    monkeypatch.setattr(get_summary, "summarize_report_file", summarize)
+    return files
+
+
+def run(reports, capsys):
+    cache_file = summary_cache.default_cache_file(str(reports))
+    get_summary.main(str(reports), print_header=False, cache_file=cache_file)
+    return capsys.readouterr().out
+
+
+def test_unchanged_reports_are_not_parsed_again(tmp_path, capsys, parsed):
+    write_reports(tmp_path / "reports", 5)
+    uncached = run(tmp_path / "reports", capsys)
+    assert len(parsed) == 5
+    assert (tmp_path / "reports" / summary_cache.DEFAULT_CACHE_NAME).exists()
+
+    parsed.clear()
+    assert run(tmp_path / "reports", capsys) == uncached
+    assert parsed == []
+    get_summary.main(str(tmp_path / "reports"), print_header=False)
+    assert capsys.readouterr().out == uncached
+
+
+def test_new_and_changed_reports_are_parsed(tmp_path, capsys, parsed):
+    reports = tmp_path / "reports"
+    write_reports(reports, 3)
+    run(reports, capsys)
+    parsed.clear()
+
+    (reports / "report-001.json").write_text(json.dumps(dict(REPORT, ArtifactName="changed")))
+    (reports / "report-new.json").write_text(json.dumps(dict(REPORT, ArtifactName="new")))
+    output = run(reports, capsys)
+
+    assert sorted(parsed) == ["report-001.json", "report-new.json"]
+    assert [row.split(",")[0] for row in output.splitlines()] == [
+        "changed",
+        "image-001",
+        "image-003",
+        "new",
+    ]
+
+
+def test_touched_reports_are_hashed_but_not_parsed(tmp_path, capsys, parsed):
+    reports = tmp_path / "reports"
+    write_reports(reports, 2)
+    run(reports, capsys)
+    parsed.clear()
+
+    later = time.time() + 60
+    os.utime(reports / "report-000.json", (later, later))
+    run(reports, capsys)
+    assert parsed == []
+
+    cache = json.loads((reports / summary_cache.DEFAULT_CACHE_NAME).read_text())
+    assert cache["reports"]["report-000.json"]["mtime"] == later
+
+
+def test_removed_reports_are_dropped_from_the_cache(tmp_path, capsys):
+    reports = tmp_path / "reports"
+    write_reports(reports, 3)
+    run(reports, capsys)
+    (reports / "report-002.json").unlink()
+    run(reports, capsys)
+
+    cache = json.loads((reports / summary_cache.DEFAULT_CACHE_NAME).read_text())
+    assert sorted(cache["reports"]) == ["report-000.json", "report-001.json"]
+
+
+def test_reports_are_summarized_when_the_cache_cannot_be_written(tmp_path, capsys, monkeypatch):
+    reports = tmp_path / "reports"
+    write_reports(reports, 2)
+
+    def replace(source, destination):
+        raise PermissionError(13, "Permission denied", str(destination))
+
+    # As for a read-only directory of reports, which cannot be tested as root
+    monkeypatch.setattr(summary_cache.os, "replace", replace)
+    cache_file = summary_cache.default_cache_file(str(reports))
+    get_summary.main(str(reports), print_header=False, cache_file=cache_file)
+
+    output = capsys.readouterr()
+    assert len(output.out.splitlines()) == 2
+    assert "WARNING: Not caching the summaries" in output.err
+    assert sorted(file.name for file in reports.iterdir()) == [
+        "report-000.json",
+        "report-001.json",
+    ]
+
+
+def test_summarizing_a_single_report_keeps_the_others_cached(tmp_path, capsys, parsed):
+    reports = tmp_path / "reports"
+    write_reports(reports, 3)
+    run(reports, capsys)
+
+    cache_file = summary_cache.default_cache_file(str(reports / "report-001.json"))
+    get_summary.main(str(reports / "report-001.json"), print_header=False, cache_file=cache_file)
+    cache = json.loads(cache_file.read_text())
+    assert sorted(cache["reports"]) == ["report-000.json", "report-001.json", "report-002.json"]
+
+    parsed.clear()
+    run(reports, capsys)
+    assert parsed == []
+
+
+@pytest.mark.parametrize("content", ["{not json", json.dumps({"version": 0, "reports": {}})])
+def test_unreadable_or_outdated_caches_are_ignored(tmp_path, capsys, parsed, content):
+    reports = tmp_path / "reports"
+    write_reports(reports, 2)
+    (reports / summary_cache.DEFAULT_CACHE_NAME).write_text(content)
+
+    assert len(run(reports, capsys).splitlines()) == 2
+    assert len(parsed) == 2
+
+
+@pytest.mark.benchmark
+def test_benchmark_cache(tmp_path, capsys):
+    """Compares summarizing 200 reports of 256 KB without a cache, and with 5 of them changed"""
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    for index in range(200):
+        write_large_report(reports / f"report-{index:03}.json", 256 * 1024)
+
+    start = time.monotonic()
+    uncached = run(reports, capsys)
+    cold = time.monotonic() - start
+
+    for index in range(5):
+        write_large_report(reports / f"report-{index:03}.json", 300 * 1024)
+    start = time.monotonic()
+    cached = run(reports, capsys)
+    warm = time.monotonic() - start
+
+    with capsys.disabled():
+        print(f"\n200 reports of 256 KB: uncached {cold:.2f}s, 5 changed {warm:.2f}s")
+    get_summary.main(str(reports), print_header=False)
+    assert cached == capsys.readouterr().out != uncached
+    assert warm < cold / 5
@@ -0,0 +1,318 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Tests for vulnerability_index.py"""
+
+import io
+import json
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import vulnerability_index
+from test_get_summary import REPORT, get_summary, vulnerability, write_reports
+
+
+def write_report(path: Path, name: str, results: list) -> Path:
+    report = {"ArtifactName": name, "Metadata": {"OS": {"Family": "ubuntu", "Name": "22.04"}}}
+    path.write_text(json.dumps(dict(report, Results=results)))
+    return path
+
+
+@pytest.fixture
+def index(tmp_path):
+    """An index of three images sharing some vulnerabilities"""
+    shared = vulnerability(1, "HIGH")
+    files = [
+        write_report(
+            tmp_path / "a.json",
+            "image-a",
+            [
+                {"Class": "os-pkgs", "Vulnerabilities": [shared, vulnerability(2, "LOW")]},
+                # The same vulnerability of the same package, found in a second target
+                {"Class": "lang-pkgs", "Vulnerabilities": [shared]},
+            ],
+        ),
+        write_report(
+            tmp_path / "b.json",
+            "image-b",
+            [{"Class": "os-pkgs", "Vulnerabilities": [shared, vulnerability(3, "CRITICAL")]}],
+        ),
+        write_report(
+            tmp_path / "c.json",
+            "image-c",
+            [
+                {
+                    "Class": "lang-pkgs",
+                    "Vulnerabilities": [
+                        # Reported with a different severity by another data source
+                        dict(shared, Severity="CRITICAL"),
+                        dict(vulnerability(2, "LOW"), PkgName="other-package"),
+                    ],
+                }
+            ],
+        ),
+    ]
+    connection = vulnerability_index.build_index(files, str(tmp_path / "index.db"))
+    yield connection
+    connection.close()
+
+
+def test_read_report_findings_buffers_until_the_class():
+    report, findings = vulnerability_index.read_report_findings(io.StringIO(json.dumps(REPORT)))
+
+    assert report["ArtifactName"] == "charmedkubeflow/some-image:1.0"
+    assert ("CVE-2023-5", "package-5", "1.0.0", "", "HIGH", "lang-pkgs") in findings
+    assert len(findings) == 7
+
+
+def test_findings_are_deduplicated_per_image(index):
+    rows = index.execute(
+        "SELECT COUNT(*) FROM findings WHERE vulnerability_id = 'CVE-2023-1'"
+    ).fetchone()
+    assert rows[0] == 3
+
+
+def test_top_vulnerabilities(index):
+    assert vulnerability_index.top_vulnerabilities(index, limit=2) == [
+        ("CVE-2023-1", "CRITICAL", 3),
+        ("CVE-2023-2", "LOW", 2),
+    ]
+
+
+def test_count_distinct_vulnerabilities(index):
+    assert vulnerability_index.count_distinct_vulnerabilities(index) == 3
+    assert vulnerability_index.count_distinct_vulnerabilities(index, "CRITICAL") == 2
+    assert vulnerability_index.count_distinct_vulnerabilities(index, "MEDIUM") == 0
+
+
+def test_image_summaries_keep_the_counts_of_the_reports(index):
+    summaries = vulnerability_index.image_summaries(index)
+    # Counted as reported, so CVE-2023-1 counts for both targets of image-a
+    assert summaries[0] == ("image-a", "ubuntu:22.04", (0, 2, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0))
+
+
+def test_build_index_replaces_an_existing_index(index, tmp_path):
+    files = [write_report(tmp_path / "d.json", "image-d", [])]
+    connection = vulnerability_index.build_index(files, str(tmp_path / "index.db"))
+    assert vulnerability_index.count_distinct_vulnerabilities(connection) == 0
+    assert vulnerability_index.image_summaries(connection)[0][0] == "image-d"
+
+
+def test_main_output_from_the_index(tmp_path, capsys):
+    write_reports(tmp_path / "reports", 6)
+    (tmp_path / "reports" / "large.json").write_text(json.dumps(REPORT))
+    get_summary.main(str(tmp_path / "reports"), print_header=True)
+    expected = capsys.readouterr().out
+
+    index = str(tmp_path / "index.db")
+    get_summary.main(str(tmp_path / "reports"), print_header=True, index=index)
+    assert capsys.readouterr().out == expected
+    get_summary.main(None, print_header=True, index=index)
+    assert capsys.readouterr().out == expected
+
+
+def test_missing_index_is_not_created(tmp_path, capsys):
+    index = tmp_path / "missing.db"
+    with pytest.raises(vulnerability_index.InvalidIndexError, match="No index at"):
+        get_summary.main(None, print_header=True, index=str(index))
+    assert capsys.readouterr().out == ""
+    assert not index.exists()
+
+
+@pytest.mark.parametrize("command", [["top"], ["distinct"]])
+@pytest.mark.parametrize("content", [None, b"not a database", b""])
+def test_commands_reject_invalid_indexes(tmp_path, capsys, monkeypatch, command, content):
+    index = tmp_path / "index.db"
+    if content is not None:
+        index.write_bytes(content)
+    monkeypatch.setattr(sys, "argv", ["vulnerability_index.py", *command, "--index", str(index)])
+
+    with pytest.raises(SystemExit) as exit_info:
+        vulnerability_index.main()
+
+    assert exit_info.value.code == 2
+    assert str(index) in capsys.readouterr().err
+    assert index.exists() == (content is not None)
+
+
+def test_indexes_are_queried_read_only(index, tmp_path):
+    connection = vulnerability_index.connect_index(str(tmp_path / "index.db"))
+    assert vulnerability_index.count_distinct_vulnerabilities(connection) == 3
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        connection.execute("DELETE FROM findings")
+    connection.close()
+
+
+@pytest.mark.benchmark
+def test_benchmark_queries(tmp_path):
+    """Compares answering the top and distinct queries from the index and from the reports"""
+    rng = random.Random(0)
+    severities = ["CRITICAL", "HIGH", "MEDIUM", "LOW"]
+    reports = tmp_path / "reports"
+    reports.mkdir()
+    for image in range(100):
+        results = [
+            {
+                "Class": "os-pkgs",
+                "Vulnerabilities": [
+                    vulnerability(index, severities[index % 4])
+                    for index in rng.sample(range(5000), 500)
+                ],
+            }
+        ]
+        write_report(reports / f"report-{image:03}.json", f"image-{image:03}", results)
+    files = sorted(reports.iterdir())
+
+    start = time.monotonic()
+    images = {}
+    for file in files:
+        with open(file) as json_file:
+            _, findings = vulnerability_index.read_report_findings(json_file)
+        for finding in findings:
+            images.setdefault(finding[0], set()).add(file)
+    top_scanning = sorted(images, key=lambda cve: (-len(images[cve]), cve))[:10]
+    scanning = time.monotonic() - start
+
+    start = time.monotonic()
+    connection = vulnerability_index.build_index(files, str(tmp_path / "index.db"))
+    building = time.monotonic() - start
+
+    start = time.monotonic()
+    top = vulnerability_index.top_vulnerabilities(connection, limit=10)
+    distinct = vulnerability_index.count_distinct_vulnerabilities(connection)
+    querying = time.monotonic() - start
+    connection.close()
+
+    print(
+        f"100 reports, 50000 findings: scanning the reports {scanning:.3f}s, "
+        f"building the index {building:.3f}s, querying it {querying * 1000:.2f}ms"
+    )
+    assert [row[0] for row in top] == top_scanning
+    assert distinct == len(images)
+    assert querying < scanning
+
+
+@pytest.mark.parametrize(
+    "name, repository",
+    [
+        ("charmedkubeflow/some-image:1.0", "charmedkubeflow/some-image"),
+        ("some-image", "some-image"),
+        ("localhost:5000/some-image", "localhost:5000/some-image"),
+        ("localhost:5000/some-image:1.0", "localhost:5000/some-image"),
+        ("some-image:1.0@sha256:abc", "some-image"),
+    ],
+)
+def test_image_repository(name, repository):
+    assert vulnerability_index.image_repository(name) == repository
+
+
+def write_release(path: Path, images: dict) -> Path:
+    """Writes a report per image, given as {name: [(class, vulnerability id, severity)]}"""
+    path.mkdir()
+    for index, (name, vulnerabilities) in enumerate(images.items()):
+        results = [
+            {"Class": clss, "Vulnerabilities": [dict(vulnerability(n, severity), PkgName=clss)]}
+            for clss, n, severity in vulnerabilities
+        ]
+        write_report(path / f"report-{index}.json", name, results)
+    return path
+
+
+def test_diff_releases(tmp_path, capsys, monkeypatch):
+    old = write_release(
+        tmp_path / "old",
+        {
+            "some-image:1.0": [("os-pkgs", 1, "HIGH"), ("os-pkgs", 2, "HIGH")],
+            "removed-image:1.0": [("lang-pkgs", 3, "LOW")],
+        },
+    )
+    new = write_release(
+        tmp_path / "new",
+        {
+            "some-image:2.0": [
+                ("os-pkgs", 1, "HIGH"),
+                ("os-pkgs", 4, "HIGH"),
+                ("os-pkgs", 4, "HIGH"),
+                ("lang-pkgs", 5, "MEDIUM"),
+            ],
+            "added-image:2.0": [("lang-pkgs", 3, "LOW")],
+        },
+    )
+    # The new release is compared from its index, and the old one from its reports
+    index = str(tmp_path / "new.db")
+    vulnerability_index.build_index(vulnerability_index.report_files(str(new)), index).close()
+    monkeypatch.setattr(sys, "argv", ["vulnerability_index.py", "diff", str(old), index])
+
+    vulnerability_index.main()
+
+    assert capsys.readouterr().out.splitlines() == [
+        "IMAGE,CLASS,SEVERITY,NEW,FIXED,UNCHANGED",
+        "added-image,lang-pkgs,LOW,1,0,0",
+        "removed-image,lang-pkgs,LOW,0,1,0",
+        "some-image,lang-pkgs,MEDIUM,1,0,0",
+        "some-image,os-pkgs,HIGH,1,1,1",
+    ]
+
+
+def test_diff_counts_changed_severities_once():
+    old = {("some-image", "os-pkgs"): {"LOW": {"CVE-1"}, "HIGH": {"CVE-2"}}}
+    new = {("some-image", "os-pkgs"): {"CRITICAL": {"CVE-1"}}}
+    assert vulnerability_index.diff_vulnerabilities(old, new) == [
+        ("some-image", "os-pkgs", "CRITICAL", 0, 0, 1),
+        ("some-image", "os-pkgs", "HIGH", 0, 1, 0),
+    ]
+
+
+def test_image_vulnerabilities_keep_the_highest_severity(index):
+    vulnerabilities = vulnerability_index.image_vulnerabilities(index)
+    assert vulnerabilities[("image-a", "os-pkgs")] == {
+        "HIGH": {"CVE-2023-1"},
+        "LOW": {"CVE-2023-2"},
+    }
+    assert vulnerabilities[("image-c", "lang-pkgs")]["CRITICAL"] == {"CVE-2023-1"}
+
+
+def write_release_index(path: Path, n_images: int, n_vulnerabilities: int, seed: int):
+    """Writes an index of images each with n_vulnerabilities random vulnerabilities"""
+    rng = random.Random(seed)
+    severities = ["CRITICAL", "HIGH", "MEDIUM", "LOW"]
+    connection = vulnerability_index.build_index([], str(path))
+    with connection:
+        for image in range(n_images):
+            image_id = connection.execute(
+                "INSERT INTO images (report, name, repository, base) VALUES (?, ?, ?, 'N/A')",
+                (f"report-{image}.json", f"image-{image}:{seed}", f"image-{image}"),
+            ).lastrowid
+            connection.executemany(
+                "INSERT INTO findings VALUES (?, ?, 'package', '1.0', '', ?, ?)",
+                [
+                    (image_id, f"CVE-{n}", severities[n % 4], ["os-pkgs", "lang-pkgs"][n // 4 % 2])
+                    for n in rng.sample(range(n_vulnerabilities * 2), n_vulnerabilities)
+                ],
+            )
+        vulnerability_index.aggregate_findings(connection)
+    connection.close()
+
+
+@pytest.mark.benchmark
+def test_benchmark_diff(tmp_path):
+    """Times the diff of two indexed releases of 300 images with 2000 vulnerabilities each"""
+    write_release_index(tmp_path / "old.db", 300, 2000, seed=1)
+    write_release_index(tmp_path / "new.db", 300, 2000, seed=2)
+
+    start = time.monotonic()
+    old = vulnerability_index.image_vulnerabilities(sqlite3.connect(tmp_path / "old.db"))
+    new = vulnerability_index.image_vulnerabilities(sqlite3.connect(tmp_path / "new.db"))
+    loading = time.monotonic() - start
+    start = time.monotonic()
+    rows = vulnerability_index.diff_vulnerabilities(old, new)
+    diffing = time.monotonic() - start
+
+    print(f"300 images x 2000 vulnerabilities: loading {loading:.2f}s, diffing {diffing:.2f}s")
+    assert len(rows) == 300 * 2 * 4
+    assert sum(row[3] + row[5] for row in rows) == 300 * 2000
+    assert loading + diffing < 1.0
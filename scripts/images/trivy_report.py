@@ -0,0 +1,124 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Incremental reading of Trivy vulnerability scan reports."""
+
+import json
+from typing import Iterator, Optional
+
+# How many characters of a report to read at a time when streaming it
+READ_SIZE = 64 * 1024
+SEVERITIES = ["CRITICAL", "HIGH", "MEDIUM", "LOW", "UNKNOWN"]
+# The characters a JSON number is made of
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+
+class JSONStream:
+    """Incremental reader of a JSON document from a file.
+
+    Only as much of the file as the value being read is held in memory: containers are walked
+    one member at a time, and the values inside them are decoded whole with the C decoder, one at
+    a time, then dropped.
+    """
+
+    def __init__(self, file, read_size: Optional[int] = None):
+        self._file = file
+        self._read_size = read_size or READ_SIZE
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Read more of the file into the buffer, dropping what was consumed"""
+        if self._eof:
+            return False
+        chunk = self._file.read(max(self._read_size, len(self._buffer) - self._pos))
+        if not chunk:
+            self._eof = True
+            return False
+        consumed = self._pos
+        self._buffer = self._buffer[consumed:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next character that is not whitespace, without consuming it"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\n\r":
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char: str):
+        """Consume the next character, which must be char"""
+        if self.peek() != char:
+            start = self._pos
+            end = start + 20
+            raise ValueError(f"Expected {char!r} at {self._buffer[start:end]!r}")
+        self._pos += 1
+
+    def value(self):
+        """Decode and return the next value whole"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The value may continue past the buffer
+                if self._fill():
+                    continue
+                raise
+            # A number may also continue past the buffer, which the decoder does not notice
+            # when the buffer ends with its ".", exponent or sign: 12.5 is decoded as 12 from
+            # "12." so the rest of the number is read before decoding it again
+            if self._may_continue(value, end) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _may_continue(self, value, end: int) -> bool:
+        """Return whether a value decoded up to end may be a number continuing past the buffer"""
+        if self._eof or isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return all(char in NUMBER_CHARS for char in self._buffer[end:])
+
+    def items(self) -> Iterator[None]:
+        """Walk the next array, yielding before each of its items, which the caller must read"""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("]")
+            return
+
+    def members(self) -> Iterator[str]:
+        """Walk the next object, yielding each key before its value, which the caller must read"""
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def skip(self):
+        """Skip the next value, walking arrays so that their items are decoded one at a time"""
+        if self.peek() == "[":
+            for _ in self.items():
+                self.value()
+        else:
+            self.value()
@@ -0,0 +1,368 @@
+#!/usr/bin/python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Index of the vulnerabilities of Trivy reports, stored in SQLite for fast queries."""
+
+import argparse
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from summary_cache import DEFAULT_CACHE_NAME
+from trivy_report import SEVERITIES, JSONStream
+
+SCHEMA = """
+CREATE TABLE images (
+    id INTEGER PRIMARY KEY,
+    report TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    -- The name without its tag or digest, to match the images of two releases
+    repository TEXT NOT NULL,
+    base TEXT NOT NULL
+);
+-- One row per vulnerability of a package version in an image
+CREATE TABLE findings (
+    image_id INTEGER NOT NULL REFERENCES images(id),
+    vulnerability_id TEXT NOT NULL,
+    package TEXT NOT NULL,
+    installed_version TEXT NOT NULL,
+    fixed_version TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    class TEXT,
+    PRIMARY KEY (vulnerability_id, package, installed_version, fixed_version, image_id)
+);
+CREATE INDEX findings_image ON findings (image_id);
+-- Aggregates: the vulnerabilities reported for each image, class and severity, as Trivy
+-- reports them (a vulnerability found in two targets of an image counts twice)
+CREATE TABLE image_counts (
+    image_id INTEGER NOT NULL REFERENCES images(id),
+    class TEXT,
+    severity TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+-- Aggregates: each distinct vulnerability, with its highest severity and how many images have it
+CREATE TABLE vulnerabilities (
+    vulnerability_id TEXT PRIMARY KEY,
+    severity TEXT NOT NULL,
+    images INTEGER NOT NULL,
+    packages INTEGER NOT NULL
+);
+CREATE INDEX vulnerabilities_images ON vulnerabilities (images DESC);
+-- Aggregates: the distinct vulnerabilities of each image repository, class and highest
+-- severity, as a newline separated list, so releases are compared from a few rows
+CREATE TABLE repository_vulnerabilities (
+    repository TEXT NOT NULL,
+    class TEXT NOT NULL,
+    severity TEXT NOT NULL,
+    vulnerability_ids TEXT NOT NULL,
+    PRIMARY KEY (repository, class, severity)
+);
+"""
+SEVERITY_RANK = " ".join(
+    f"WHEN '{severity}' THEN {rank}" for rank, severity in enumerate(SEVERITIES)
+)
+# The highest severity of a group of findings is the one with the lowest rank
+HIGHEST_SEVERITY = f"""
+    CASE MIN(CASE severity {SEVERITY_RANK} ELSE {len(SEVERITIES)} END)
+        {" ".join(f"WHEN {rank} THEN '{severity}'" for rank, severity in enumerate(SEVERITIES))}
+        ELSE 'UNKNOWN' END
+"""
+AGGREGATE_VULNERABILITIES = f"""
+INSERT INTO vulnerabilities
+SELECT vulnerability_id, {HIGHEST_SEVERITY}, COUNT(DISTINCT image_id), COUNT(DISTINCT package)
+FROM findings
+GROUP BY vulnerability_id
+"""
+AGGREGATE_REPOSITORY_VULNERABILITIES = f"""
+INSERT INTO repository_vulnerabilities
+SELECT repository, class, severity, group_concat(vulnerability_id, char(10))
+FROM (
+    SELECT images.repository, COALESCE(findings.class, 'N/A') AS class, vulnerability_id,
+        {HIGHEST_SEVERITY} AS severity
+    FROM findings JOIN images ON images.id = findings.image_id
+    GROUP BY images.repository, COALESCE(findings.class, 'N/A'), vulnerability_id
+)
+GROUP BY repository, class, severity
+"""
+
+
+def read_report_findings(file) -> Tuple[dict, List[Tuple]]:
+    """Stream a Trivy report, returning its ArtifactName and Metadata, and its findings.
+
+    Findings are (vulnerability_id, package, installed_version, fixed_version, severity, class)
+    tuples, without the rest of each vulnerability.
+    """
+    report, findings = {}, []
+    stream = JSONStream(file)
+    for key in stream.members():
+        if key == "Results" and stream.peek() == "[":
+            for _ in stream.items():
+                findings += _read_result_findings(stream)
+        elif key in ("ArtifactName", "Metadata"):
+            report[key] = stream.value()
+        else:
+            stream.skip()
+    return report, findings
+
+
+def _read_result_findings(stream: JSONStream) -> List[Tuple]:
+    """Read a `Results` entry of a report, returning its findings"""
+    clss, vulnerabilities = None, []
+    for key in stream.members():
+        if key == "Class":
+            clss = stream.value()
+        elif key == "Vulnerabilities" and stream.peek() == "[":
+            for _ in stream.items():
+                vulnerability = stream.value()
+                vulnerabilities.append(
+                    (
+                        vulnerability["VulnerabilityID"],
+                        vulnerability.get("PkgName", ""),
+                        vulnerability.get("InstalledVersion", ""),
+                        vulnerability.get("FixedVersion", ""),
+                        vulnerability["Severity"],
+                    )
+                )
+        else:
+            stream.skip()
+    return [vulnerability + (clss,) for vulnerability in vulnerabilities]
+
+
+def base_os(report: dict) -> str:
+    """Return the OS base name of a report, like get-summary.py"""
+    os_info = (report.get("Metadata") or {}).get("OS")
+    if not os_info:
+        return "N/A"
+    return "%s:%s" % (os_info["Family"], os_info["Name"])
+
+
+def image_repository(name: str) -> str:
+    """Return the repository of an image name, without its tag or digest"""
+    name = name.split("@", 1)[0]
+    repository, _, tag = name.rpartition(":")
+    # A colon before the last slash separates the port of a registry, not a tag
+    if not repository or "/" in tag:
+        return name
+    return repository
+
+
+def build_index(report_files: List[Path], index_path: str) -> sqlite3.Connection:
+    """Build the index of report files at index_path, replacing any previous index there"""
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    connection = sqlite3.connect(index_path)
+    with connection:
+        connection.executescript(SCHEMA)
+        for file in report_files:
+            with open(file, "r") as json_file:
+                report, findings = read_report_findings(json_file)
+            if "ArtifactName" not in report:
+                raise ValueError(f"No 'ArtifactName' key was found on the report {file}")
+            name = report["ArtifactName"]
+            image_id = connection.execute(
+                "INSERT INTO images (report, name, repository, base) VALUES (?, ?, ?, ?)",
+                (str(file), name, image_repository(name), base_os(report)),
+            ).lastrowid
+            connection.executemany(
+                "INSERT OR IGNORE INTO findings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(image_id,) + finding for finding in findings],
+            )
+            counts = {}
+            for finding in findings:
+                key = (finding[5], finding[4])
+                counts[key] = counts.get(key, 0) + 1
+            connection.executemany(
+                "INSERT INTO image_counts VALUES (?, ?, ?, ?)",
+                [(image_id, clss, severity, count) for (clss, severity), count in counts.items()],
+            )
+        aggregate_findings(connection)
+    return connection
+
+
+def aggregate_findings(connection: sqlite3.Connection):
+    """Compute the aggregates of the vulnerabilities of all findings, replacing previous ones"""
+    connection.execute("DELETE FROM vulnerabilities")
+    connection.execute("DELETE FROM repository_vulnerabilities")
+    connection.execute(AGGREGATE_VULNERABILITIES)
+    connection.execute(AGGREGATE_REPOSITORY_VULNERABILITIES)
+
+
+def top_vulnerabilities(connection: sqlite3.Connection, limit: int = 10) -> List[Tuple]:
+    """Return the vulnerabilities affecting the most images, as (id, severity, images) tuples"""
+    return connection.execute(
+        "SELECT vulnerability_id, severity, images FROM vulnerabilities "
+        "ORDER BY images DESC, vulnerability_id LIMIT ?",
+        (limit,),
+    ).fetchall()
+
+
+def count_distinct_vulnerabilities(
+    connection: sqlite3.Connection, severity: Optional[str] = None
+) -> int:
+    """Return how many distinct vulnerabilities the images have, optionally of one severity"""
+    if severity is None:
+        return connection.execute("SELECT COUNT(*) FROM vulnerabilities").fetchone()[0]
+    return connection.execute(
+        "SELECT COUNT(*) FROM vulnerabilities WHERE severity = ?", (severity,)
+    ).fetchone()[0]
+
+
+def image_summaries(connection: sqlite3.Connection) -> List[Tuple[str, str, Tuple[int, ...]]]:
+    """Return the (image, base, counts) of each image, like get-summary.py's summarize_reports"""
+    counts = {}
+    for image_id, clss, severity, count in connection.execute("SELECT * FROM image_counts"):
+        image_counts = counts.setdefault(image_id, {})
+        for key in [("all", severity), (clss, severity)]:
+            image_counts[key] = image_counts.get(key, 0) + count
+
+    summaries = []
+    for image_id, name, base in connection.execute("SELECT id, name, base FROM images"):
+        image_counts = counts.get(image_id, {})
+        row = [image_counts.get(("all", severity), 0) for severity in SEVERITIES[:4]]
+        for severity in SEVERITIES[:4]:
+            row += [image_counts.get((clss, severity), 0) for clss in ["os-pkgs", "lang-pkgs"]]
+        summaries.append((name, base, tuple(row)))
+    return sorted(summaries)
+
+
+def report_files(report_path: str) -> List[Path]:
+    """Return the Trivy reports of a directory, without the cache of get-summary.py"""
+    return sorted(
+        file for file in Path(report_path).glob("*.json") if file.name != DEFAULT_CACHE_NAME
+    )
+
+
+class InvalidIndexError(Exception):
+    """Raised when opening an index that does not exist or was not built by build_index"""
+
+
+def connect_index(path: str) -> sqlite3.Connection:
+    """Open an existing index read-only.
+
+    sqlite3.connect would create an empty database at a wrong path, failing later on the missing
+    tables, so the index must exist and have been built by build_index.
+    """
+    if not os.path.isfile(path):
+        raise InvalidIndexError(f"No index at {path}, build it first")
+    connection = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master")}
+    except sqlite3.DatabaseError as e:
+        connection.close()
+        raise InvalidIndexError(f"{path} is not an index: {e}") from e
+    if not {"images", "findings", "repository_vulnerabilities"} <= tables:
+        connection.close()
+        raise InvalidIndexError(f"{path} is not an index of Trivy reports")
+    return connection
+
+
+def open_index(path: str) -> sqlite3.Connection:
+    """Open the index at path, or index the reports in memory if path is a directory of them"""
+    if os.path.isdir(path):
+        return build_index(report_files(path), ":memory:")
+    return connect_index(path)
+
+
+def image_vulnerabilities(
+    connection: sqlite3.Connection,
+) -> Dict[Tuple[str, str], Dict[str, Set[str]]]:
+    """Return the vulnerabilities of each image repository and class, by highest severity.
+
+    Returned as {(repository, class): {severity: {vulnerability_id}}}.
+    """
+    result = {}
+    rows = connection.execute("SELECT * FROM repository_vulnerabilities")
+    for repository, clss, severity, vulnerability_ids in rows:
+        result.setdefault((repository, clss), {})[severity] = set(vulnerability_ids.split("\n"))
+    return result
+
+
+def diff_vulnerabilities(
+    old: Dict[Tuple[str, str], Dict[str, Set[str]]],
+    new: Dict[Tuple[str, str], Dict[str, Set[str]]],
+) -> List[Tuple[str, str, str, int, int, int]]:
+    """Compare the image_vulnerabilities of two releases, matching images by repository.
+
+    Returns (repository, class, severity, new, fixed, unchanged) counts of vulnerability IDs.
+    New and unchanged vulnerabilities are counted at their severity in the new release, and
+    fixed ones at their severity in the old release.
+    """
+    rows = []
+    for key in old.keys() | new.keys():
+        old_severities, new_severities = old.get(key, {}), new.get(key, {})
+        old_ids = set().union(*old_severities.values())
+        new_ids = set().union(*new_severities.values())
+        for severity in old_severities.keys() | new_severities.keys():
+            new_severity_ids = new_severities.get(severity, set())
+            counts = (
+                len(new_severity_ids - old_ids),
+                len(old_severities.get(severity, set()) - new_ids),
+                len(new_severity_ids & old_ids),
+            )
+            if any(counts):
+                rows.append(key + (severity,) + counts)
+    return sorted(rows)
+
+
+def print_diff(old_path: str, new_path: str):
+    """Print the diff of two releases, each given as an index or a directory of reports"""
+    with closing(open_index(old_path)) as old, closing(open_index(new_path)) as new:
+        rows = diff_vulnerabilities(image_vulnerabilities(old), image_vulnerabilities(new))
+    print("IMAGE,CLASS,SEVERITY,NEW,FIXED,UNCHANGED")
+    for row in rows:
+        print(",".join(str(value) for value in row))
+
+
+def main():
+    """Build, query or compare indexes from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    index = argparse.ArgumentParser(add_help=False)
+    index.add_argument("--index", required=True, help="Path of the SQLite index")
+    build = subparsers.add_parser(
+        "build", parents=[index], help="Index a directory of Trivy reports"
+    )
+    build.add_argument("--report-path", required=True)
+    top = subparsers.add_parser(
+        "top", parents=[index], help="List the vulnerabilities affecting the most images"
+    )
+    top.add_argument("--limit", type=int, default=10)
+    distinct = subparsers.add_parser(
+        "distinct", parents=[index], help="Count the distinct vulnerabilities"
+    )
+    distinct.add_argument("--severity", choices=SEVERITIES)
+    diff = subparsers.add_parser(
+        "diff", help="Count the new, fixed and unchanged vulnerabilities of each image"
+    )
+    diff.add_argument("old", help="Index, or directory of reports, of the old release")
+    diff.add_argument("new", help="Index, or directory of reports, of the new release")
+    args = parser.parse_args()
+
+    try:
+        run_command(args)
+    except InvalidIndexError as e:
+        parser.error(str(e))
+
+
+def run_command(args: argparse.Namespace):
+    """Run the command parsed by main"""
+    if args.command == "build":
+        files = report_files(args.report_path)
+        build_index(files, args.index).close()
+        print(f"Indexed {len(files)} reports in {args.index}")
+    elif args.command == "diff":
+        print_diff(args.old, args.new)
+    elif args.command == "top":
+        with closing(connect_index(args.index)) as connection:
+            for vulnerability_id, severity, images in top_vulnerabilities(connection, args.limit):
+                print(f"{vulnerability_id},{severity},{images}")
+    else:
+        with closing(connect_index(args.index)) as connection:
+            print(count_distinct_vulnerabilities(connection, args.severity))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,162 @@
 import argparse
+import json
+import re
 import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import List, Optional
 
 import yaml
 
+# The Charmhub client and the charm cache are shared with the other scripts of this repo
+SCRIPTS_PATH = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(SCRIPTS_PATH), str(SCRIPTS_PATH / "request_missing_tracks")]
+
+from charm_cache import DEFAULT_TTL, ChannelMapCache, get_channel_map_cache  # noqa: E402
+from charmhub import CharmhubBackend  # noqa: E402
+from juju import InfoBackend, JujuFailedError  # noqa: E402
+
+# How many `charmcraft promote` to run at the same time, and how often to retry each
+DEFAULT_JOBS = 4
+DEFAULT_RETRIES = 3
+# Seconds to wait before the first retry, doubling for each retry after it
+DEFAULT_BACKOFF = 2.0
+DEFAULT_RESULTS_FILE = "promote-results.json"
+# Failures of `charmcraft promote` that are worth retrying, matched case-insensitively: HTTP
+# status codes only when given as a status, so that revisions or names holding these digits are
+# not mistaken for them, and the network errors requests and urllib3 report
+TRANSIENT_ERRORS = re.compile(
+    "|".join(
+        [
+            r"\b(?:status(?: code)?|http(?:/[\d.]+)?)[: ]+(?:429|50[234])\b",
+            r"\btoo many requests\b",
+            r"\bbad gateway\b",
+            r"\bservice (?:temporarily )?unavailable\b",
+            r"\bgateway time-?out\b",
+            r"\b(?:read|connect|connection) timed out\b",
+            r"\bconnect timeout\b",
+            r"\bconnection (?:reset|refused|aborted)\b",
+            r"\bmax retries exceeded\b",
+            r"\btemporary failure in name resolution\b",
+        ]
+    ),
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class PromotionResult:
+    """The outcome of promoting a charm from one channel to another"""
+
+    charm: str
+    source_channel: str
+    destination_channel: str
+    applications: List[str] = field(default_factory=list)
+    status: str = "pending"
+    attempts: int = 0
+    error: str = ""
+    source_revisions: List[int] = field(default_factory=list)
+    destination_revisions: List[int] = field(default_factory=list)
+
+
+def full_channel_name(channel):
+    """Return the name of a channel with its track, like `latest/stable` for `stable`"""
+    return channel if "/" in channel else f"latest/{channel}"
+
+
+class CharmhubRevisions:
+    """The revisions released in each channel of charms, read from Charmhub.
+
+    Channel maps are read through the Charmhub backend of request_missing_tracks, `jobs` charms
+    at a time, and kept in a ChannelMapCache shared with the other scripts of this repo, so
+    runs within the cache's TTL do not read them again, unless fetched `fresh`.  Charmhub lists a channel once per base
+    and architecture, so a channel can hold several revisions.
+
+    Args:
+        backend: Where to read channel maps from, by default Charmhub
+        cache: Where to cache channel maps, by default only in memory
+        jobs: How many channel maps to read at the same time
+        refresh: Read every channel map again, ignoring what is cached
+    """
+
+    def __init__(
+        self,
+        backend: Optional[InfoBackend] = None,
+        cache: Optional[ChannelMapCache] = None,
+        jobs: int = DEFAULT_JOBS,
+        refresh: bool = False,
+    ):
+        self.backend = backend or CharmhubBackend(pool_size=jobs)
+        self.cache = cache or ChannelMapCache()
+        self.jobs = jobs
+        self.refresh = refresh
+        self._channel_maps = {}
+        # The charms whose channel map was read from the cache rather than from Charmhub
+        self._cached = set()
+
+    def _fetch_charm(self, charm):
+        """Return the channel map of a charm, or None if it cannot be read"""
+        try:
+            return self.backend.info(charm)["channel-map"]
+        except (JujuFailedError, ValueError, KeyError) as e:
+            print(f"Failed to read the revisions of {charm}: {e}", file=sys.stderr)
+            return None
+
+    def fetch(self, charms, fresh=False):
+        """Fetch the channel map of charms not fetched yet, from the cache when fresh.
+
+        With `fresh`, the channel maps of charms read from the cache are read from Charmhub
+        again, as they can be up to the cache's TTL old.
+        """
+        missing = sorted(
+            {
+                charm
+                for charm in charms
+                if charm not in self._channel_maps or (fresh and charm in self._cached)
+            }
+        )
+        if not (self.refresh or fresh):
+            for charm in missing:
+                channel_map = self.cache.get(charm)
+                if channel_map is not None:
+                    self._channel_maps[charm] = channel_map
+                    self._cached.add(charm)
+            missing = [charm for charm in missing if charm not in self._channel_maps]
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            fetched = dict(zip(missing, executor.map(self._fetch_charm, missing)))
+        self._channel_maps.update(fetched)
+        self._cached.difference_update(fetched)
+        self.cache.store(
+            {charm: channel_map for charm, channel_map in fetched.items() if channel_map}
+        )
+
+    def revisions(self, charm, channel):
+        """Return the revisions released in a channel of a charm, or None if unknown"""
+        channel_map = self._channel_maps.get(charm)
+        if channel_map is None:
+            return None
+        entry = channel_map.get(full_channel_name(channel))
+        if entry is None:
+            return set()
+        # Channel maps from `juju info` only have the highest revision of each channel
+        return set(entry.get("revisions") or [entry["revision"]])
+
+    def record_promotion(self, promotion):
+        """Update the cached channel map of a promoted charm: its destination now has its source"""
+        channel_map = self._channel_maps.get(promotion.charm)
+        source = full_channel_name(promotion.source_channel)
+        if channel_map is None or source not in channel_map:
+            return
+        destination = full_channel_name(promotion.destination_channel)
+        track, _, risk = destination.rpartition("/")
+        channel_map = dict(channel_map)
+        channel_map[destination] = dict(channel_map[source], track=track, risk=risk)
+        self._channel_maps[promotion.charm] = channel_map
+        self.cache.store({promotion.charm: channel_map})
+
 
 def load_yaml(file_path):
     """Load YAML data from a file."""
@@ -30,40 +184,114 @@ def generate_promote_manifest(source_yaml, dest_yaml):
     return promote_data
 
 
-def promote_charms(promote_manifest, dry_run=False):
-    applications = promote_manifest.get("applications", {})
-
-    if dry_run:
-        print("Executing in dry run mode.")
+def plan_promotions(promote_manifest, revisions=None):
+    """Group the applications of a manifest by the (charm, source, destination) to promote.
 
-    errors = []
-    for key, values in applications.items():
+    Applications deploying the same charm between the same channels only need one promotion.
+    With a revision source, like CharmhubRevisions, promotions whose source and destination
+    channels already hold the same revisions are marked "in-sync", so that they are skipped.
+    As cached revisions can miss a release to the source channel, the charms that look in sync
+    are fetched fresh and checked again before they are skipped.
+    """
+    promotions = {}
+    for key, values in promote_manifest.get("applications", {}).items():
         charm = values.get("charm")
         source_channel = values.get("source-channel")
         destination_channel = values.get("destination-channel")
+        if not (source_channel and destination_channel):
+            continue
+        promotion = promotions.setdefault(
+            (charm, source_channel, destination_channel),
+            PromotionResult(charm, source_channel, destination_channel),
+        )
+        promotion.applications.append(key)
+
+    if revisions is not None:
+        revisions.fetch(charm for charm, _, _ in promotions)
+        for promotion in promotions.values():
+            check_in_sync(promotion, revisions)
+        in_sync = {p.charm for p in promotions.values() if p.status == "in-sync"}
+        if in_sync:
+            revisions.fetch(in_sync, fresh=True)
+            for promotion in promotions.values():
+                promotion.status = "pending"
+                check_in_sync(promotion, revisions)
+    return list(promotions.values())
+
+
+def check_in_sync(promotion, revisions):
+    """Mark a promotion "in-sync" if its destination already holds its source's revisions"""
+    source = revisions.revisions(promotion.charm, promotion.source_channel)
+    destination = revisions.revisions(promotion.charm, promotion.destination_channel)
+    if source is None or destination is None:
+        # Unknown revisions, so promote to be safe
+        return
+    promotion.source_revisions = sorted(source)
+    promotion.destination_revisions = sorted(destination)
+    if source and source == destination:
+        promotion.status = "in-sync"
+
+
+def print_plan_summary(promotions):
+    """Print what will be promoted and what is already in sync"""
+    in_sync = [p for p in promotions if p.status == "in-sync"]
+    to_promote = [p for p in promotions if p.status != "in-sync"]
+    print(f"Plan: {len(to_promote)} to promote, {len(in_sync)} already in sync")
+    for promotion in in_sync:
+        print(
+            f"  in sync: {promotion.charm} {promotion.source_channel} and "
+            f"{promotion.destination_channel} at revisions {promotion.source_revisions}"
+        )
+    for promotion in to_promote:
+        print(
+            f"  promote: {promotion.charm} {promotion.source_channel} "
+            f"{promotion.source_revisions or '?'} to {promotion.destination_channel} "
+            f"{promotion.destination_revisions or '?'}"
+        )
+
+
+def is_transient(output):
+    """Whether the output of a failed `charmcraft promote` points to a transient failure"""
+    return TRANSIENT_ERRORS.search(output) is not None
 
-        if source_channel and destination_channel:
-            print(f"Promoting {key} from {source_channel} to {destination_channel}")
-            if not dry_run:
-                try:
-                    subprocess.run(
-                        [
-                            "charmcraft",
-                            "promote",
-                            "--name",
-                            charm,
-                            "--from-channel",
-                            source_channel,
-                            "--to-channel",
-                            destination_channel,
-                            "--yes",
-                        ],
-                        check=True,
-                    )
-                except subprocess.CalledProcessError as e:
-                    print(f"Error promoting {key}: {e}")
-                    errors.append({key: e})
 
+def promote_charm(promotion, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, sleep=time.sleep):
+    """Run `charmcraft promote` for a promotion, retrying transient failures with backoff."""
+    command = [
+        "charmcraft",
+        "promote",
+        "--name",
+        promotion.charm,
+        "--from-channel",
+        promotion.source_channel,
+        "--to-channel",
+        promotion.destination_channel,
+        "--yes",
+    ]
+    for attempt in range(retries + 1):
+        promotion.attempts = attempt + 1
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode == 0:
+            promotion.status, promotion.error = "promoted", ""
+            return promotion
+        promotion.status = "failed"
+        promotion.error = (process.stderr or process.stdout).strip()
+        if attempt == retries or not is_transient(process.stderr + process.stdout):
+            break
+        delay = backoff * 2**attempt
+        print(f"Retrying {promotion.charm} in {delay}s: {promotion.error}")
+        sleep(delay)
+    return promotion
+
+
+def print_errors(promotions):
+    """Print the error of each application whose promotion failed"""
+    errors = [
+        {application: promotion.error}
+        for promotion in promotions
+        if promotion.status == "failed"
+        for application in promotion.applications
+    ]
     if errors:
         print("\n##############################################\n")
         print("Execution completed with the following errors:")
@@ -71,6 +299,53 @@ def promote_charms(promote_manifest, dry_run=False):
         print("\n##############################################\n")
 
 
+def promote_charms(
+    promote_manifest,
+    dry_run=False,
+    jobs=DEFAULT_JOBS,
+    retries=DEFAULT_RETRIES,
+    backoff=DEFAULT_BACKOFF,
+    results_file=None,
+    revisions=None,
+):
+    """Promote the charms of a manifest, `jobs` at a time, and return the result of each.
+
+    Each (charm, source, destination) is promoted once, however many applications deploy it.
+    With a revision source, promotions already in sync are skipped, see plan_promotions, and
+    successful promotions are recorded in it, so that a later run skips them.  The results are
+    written as JSON to results_file, if given.
+    """
+    promotions = plan_promotions(promote_manifest, revisions)
+    if revisions is not None:
+        print_plan_summary(promotions)
+    pending = [promotion for promotion in promotions if promotion.status == "pending"]
+
+    if dry_run:
+        print("Executing in dry run mode.")
+
+    for promotion in pending:
+        print(
+            f"Promoting {', '.join(promotion.applications)} from {promotion.source_channel} "
+            f"to {promotion.destination_channel}"
+        )
+        if dry_run:
+            promotion.status = "dry-run"
+
+    if not dry_run:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(lambda p: promote_charm(p, retries, backoff), pending))
+        if revisions is not None:
+            for promotion in pending:
+                if promotion.status == "promoted":
+                    revisions.record_promotion(promotion)
+
+    print_errors(promotions)
+    if results_file:
+        with open(results_file, "w") as f:
+            json.dump([asdict(promotion) for promotion in promotions], f, indent=2)
+    return promotions
+
+
 def main():
     parser = argparse.ArgumentParser(description="Promote charms between channels.")
     parser.add_argument(
@@ -86,6 +361,43 @@ def main():
         action="store_true",
         help="Simulate the promotion without actually executing it",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help="How many charms to promote at the same time",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="How many times to retry a promotion failing with a transient error",
+    )
+    parser.add_argument(
+        "--results-file",
+        default=DEFAULT_RESULTS_FILE,
+        help="Path of the JSON file to write the result of each promotion to",
+    )
+    parser.add_argument(
+        "--no-revision-check",
+        action="store_true",
+        help="Promote every charm, without skipping those already in sync on Charmhub",
+    )
+    parser.add_argument(
+        "--cache-file",
+        help="Cache of the channel maps of charms.  Defaults to $CHARM_CACHE_FILE",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_TTL,
+        help="Seconds a cached channel map is trusted for",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Read the revisions of every charm from Charmhub again, refreshing the cache",
+    )
 
     args = parser.parse_args()
 
@@ -93,7 +405,21 @@ def main():
     dest_yaml = load_yaml(args.destination_bundle)
 
     promote_manifest = generate_promote_manifest(source_yaml, dest_yaml)
-    promote_charms(promote_manifest, args.dry_run)
+    revisions = None
+    if not args.no_revision_check:
+        revisions = CharmhubRevisions(
+            cache=get_channel_map_cache(args.cache_file, ttl=args.cache_ttl),
+            jobs=args.jobs,
+            refresh=args.refresh,
+        )
+    promote_charms(
+        promote_manifest,
+        args.dry_run,
+        jobs=args.jobs,
+        retries=args.retries,
+        results_file=args.results_file,
+        revisions=revisions,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+import importlib.util
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    "promote_charms", Path(__file__).parent / "promote-charms.py"
+)
+promote = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(promote)
+
+# Importable once promote-charms.py has put the shared modules on the path
+from charm_cache import ChannelMapCache  # noqa: E402
+from charmhub import CharmhubBackend  # noqa: E402
+from charmhub_stub import CharmhubStub  # noqa: E402
+
+FAKE_CHARMCRAFT = """#!/usr/bin/env python3
+import os
+import sys
+import time
+
+charm = sys.argv[sys.argv.index("--name") + 1]
+state = os.path.join("{state}", charm)
+attempts = int(open(state).read()) + 1 if os.path.exists(state) else 1
+open(state, "w").write(str(attempts))
+with open(os.path.join("{state}", "calls"), "a") as calls:
+    calls.write(charm + "\\n")
+
+time.sleep({latency})
+if charm.startswith("broken"):
+    sys.stderr.write("Error: permission denied for charm " + charm + "\\n")
+    sys.exit(1)
+if charm.startswith("flaky") and attempts <= {failures}:
+    sys.stderr.write("Error: 503 Service Temporarily Unavailable\\n")
+    sys.exit(1)
+print("Promoted " + charm)
+"""
+
+
+@pytest.fixture()
+def fake_charmcraft(tmp_path, monkeypatch):
+    """Puts a fake `charmcraft` on the PATH.
+
+    It takes `latency` seconds per call.  Charms named flaky* fail `failures` times with a
+    transient error before succeeding, and charms named broken* always fail.  Returns the path
+    of a file listing the charm of each call.
+    """
+
+    def install(latency: float = 0.0, failures: int = 0):
+        state = tmp_path / "state"
+        state.mkdir()
+        charmcraft = tmp_path / "charmcraft"
+        charmcraft.write_text(
+            FAKE_CHARMCRAFT.format(state=state, latency=latency, failures=failures)
+        )
+        charmcraft.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+        return state / "calls"
+
+    return install
+
+
+def manifest(*charms):
+    return {
+        "applications": {
+            f"{charm}-app{index}": {
+                "charm": charm,
+                "source-channel": "1.10/candidate",
+                "destination-channel": "1.10/stable",
+            }
+            for index, charm in enumerate(charms)
+        }
+    }
+
+
+def test_plan_promotions_deduplicates():
+    promotions = promote.plan_promotions(manifest("argo", "argo", "dex"))
+    assert [(p.charm, p.applications) for p in promotions] == [
+        ("argo", ["argo-app0", "argo-app1"]),
+        ("dex", ["dex-app2"]),
+    ]
+
+
+def test_promote_charms_retries_transient_failures(fake_charmcraft, tmp_path):
+    calls = fake_charmcraft(failures=2)
+    results_file = tmp_path / "results.json"
+
+    promotions = promote.promote_charms(
+        manifest("argo", "argo", "flaky-dex", "broken-katib"),
+        jobs=3,
+        backoff=0,
+        results_file=str(results_file),
+    )
+
+    results = {p.charm: (p.status, p.attempts) for p in promotions}
+    assert results == {
+        "argo": ("promoted", 1),
+        "flaky-dex": ("promoted", 3),
+        # Not a transient failure, so not retried
+        "broken-katib": ("failed", 1),
+    }
+    assert sorted(calls.read_text().split()) == ["argo"] + ["broken-katib"] + ["flaky-dex"] * 3
+    written = json.loads(results_file.read_text())
+    assert written[0]["applications"] == ["argo-app0", "argo-app1"]
+    assert "permission denied" in written[2]["error"]
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        "Error: 503 Service Temporarily Unavailable",
+        "Store returned HTTP/1.1 502 Bad Gateway",
+        "requests.exceptions.ReadTimeout: Read timed out. (read timeout=30)",
+        "Max retries exceeded with url: /v1/charm (Caused by ConnectionResetError)",
+        "Unexpected status code: 429",
+    ],
+)
+def test_is_transient(output):
+    assert promote.is_transient(output)
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        "Error: revision 5029 is not released in 1.10/candidate",
+        "Error: revision 503 of argo is not released",
+        "Invalid connection config in charmcraft.yaml",
+        "Name timeout-operator is not registered",
+        "Error: permission denied for charm broken-429",
+    ],
+)
+def test_is_transient_ignores_permanent_errors(output):
+    assert not promote.is_transient(output)
+
+
+def test_permanent_error_with_a_status_like_number_is_not_retried(fake_charmcraft):
+    fake_charmcraft()
+    delays = []
+    # Its error mentions 503, like the transient errors of flaky charms
+    promotion = promote.plan_promotions(manifest("broken-503"))[0]
+
+    promote.promote_charm(promotion, retries=3, backoff=1, sleep=delays.append)
+
+    assert (promotion.status, promotion.attempts) == ("failed", 1)
+    assert delays == []
+
+
+def test_promote_charms_gives_up_after_retries(fake_charmcraft):
+    fake_charmcraft(failures=10)
+    delays = []
+    promotion = promote.plan_promotions(manifest("flaky-dex"))[0]
+
+    promote.promote_charm(promotion, retries=3, backoff=1, sleep=delays.append)
+
+    assert (promotion.status, promotion.attempts) == ("failed", 4)
+    assert delays == [1, 2, 4]
+    assert "503" in promotion.error
+
+
+def test_dry_run_does_not_promote(fake_charmcraft):
+    calls = fake_charmcraft()
+    promotions = promote.promote_charms(manifest("argo"), dry_run=True)
+    assert promotions[0].status == "dry-run"
+    assert not calls.exists()
+
+
+@pytest.mark.benchmark
+def test_benchmark_parallel_promotion(fake_charmcraft):
+    """Compares serial and parallel promotion of 12 charms taking 0.2s each"""
+    fake_charmcraft(latency=0.2)
+    charms = [f"charm{index}" for index in range(12)]
+
+    start = time.monotonic()
+    promote.promote_charms(manifest(*charms), jobs=1)
+    serial_elapsed = time.monotonic() - start
+
+    start = time.monotonic()
+    promotions = promote.promote_charms(manifest(*charms), jobs=6)
+    parallel_elapsed = time.monotonic() - start
+
+    print(f"12 charms: serial {serial_elapsed:.3f}s, parallel {parallel_elapsed:.3f}s")
+    assert all(p.status == "promoted" for p in promotions)
+    assert parallel_elapsed < serial_elapsed / 2
+
+
+class StubRevisions:
+    """A revision source answering from {charm: {channel: {revision}}}, counting fetches"""
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.fetched = []
+
+    def fetch(self, charms, fresh=False):
+        self.fetched.append((sorted(charms), fresh))
+
+    def revisions(self, charm, channel):
+        if charm not in self.channels:
+            return None
+        return self.channels[charm].get(channel, set())
+
+    def record_promotion(self, promotion):
+        channels = self.channels.get(promotion.charm, {})
+        if promotion.source_channel in channels:
+            channels[promotion.destination_channel] = channels[promotion.source_channel]
+
+
+def test_plan_promotions_skips_charms_in_sync():
+    revisions = StubRevisions(
+        {
+            "argo": {"1.10/candidate": {5}, "1.10/stable": {5}},
+            "dex": {"1.10/candidate": {7, 8}, "1.10/stable": {7}},
+            "katib": {"1.10/candidate": {3}},
+        }
+    )
+
+    promotions = promote.plan_promotions(
+        manifest("argo", "argo", "dex", "katib", "minio"), revisions
+    )
+
+    assert {p.charm: p.status for p in promotions} == {
+        "argo": "in-sync",
+        "dex": "pending",
+        # Nothing in the destination yet
+        "katib": "pending",
+        # Unknown to the revision source, so promoted to be safe
+        "minio": "pending",
+    }
+    # Every charm is fetched in one batch, and those in sync are fetched fresh before skipping
+    assert revisions.fetched == [(["argo", "dex", "katib", "minio"], False), (["argo"], True)]
+
+
+def test_promote_charms_only_promotes_charms_out_of_sync(fake_charmcraft, tmp_path, capsys):
+    calls = fake_charmcraft()
+    revisions = StubRevisions(
+        {
+            "argo": {"1.10/candidate": {5}, "1.10/stable": {5}},
+            "dex": {"1.10/candidate": {8}, "1.10/stable": {7}},
+        }
+    )
+    results_file = tmp_path / "results.json"
+
+    promote.promote_charms(
+        manifest("argo", "dex"), revisions=revisions, results_file=str(results_file)
+    )
+
+    assert calls.read_text().split() == ["dex"]
+    assert "Plan: 1 to promote, 1 already in sync" in capsys.readouterr().out
+    results = {
+        result["charm"]: result["status"] for result in json.loads(results_file.read_text())
+    }
+    assert results == {"argo": "in-sync", "dex": "promoted"}
+
+
+@pytest.fixture()
+def charmhub_stub():
+    with CharmhubStub({"argo": ["1.10", "latest"], "dex": ["1.10"]}) as stub:
+        yield stub
+
+
+def test_charmhub_revisions(charmhub_stub, tmp_path):
+    cache = ChannelMapCache(str(tmp_path / "cache.json"))
+    revisions = promote.CharmhubRevisions(CharmhubBackend(charmhub_stub.url), cache)
+    revisions.fetch(["argo", "missing", "argo"])
+    revisions.fetch(["argo"])
+
+    assert len(charmhub_stub.requests) == 2
+    # The stub releases each channel for two architectures
+    assert revisions.revisions("argo", "1.10/stable") == {1}
+    assert revisions.revisions("argo", "edge") == {12}
+    assert revisions.revisions("argo", "1.10/candidate") == set()
+    assert revisions.revisions("missing", "1.10/stable") is None
+
+    # A later run reads the channel maps from the cache file, not from Charmhub
+    cached = promote.CharmhubRevisions(
+        CharmhubBackend(charmhub_stub.url), ChannelMapCache(cache.cache_file)
+    )
+    cached.fetch(["argo"])
+    assert len(charmhub_stub.requests) == 2
+    assert cached.revisions("argo", "1.10/stable") == {1}
+    # Unless asked for fresh channel maps, which are only read once
+    cached.fetch(["argo"], fresh=True)
+    cached.fetch(["argo"], fresh=True)
+    assert len(charmhub_stub.requests) == 3
+    refreshed = promote.CharmhubRevisions(
+        CharmhubBackend(charmhub_stub.url), ChannelMapCache(cache.cache_file), refresh=True
+    )
+    refreshed.fetch(["argo"])
+    assert len(charmhub_stub.requests) == 4
+
+
+def test_charmhub_revisions_failures_go_to_stderr(charmhub_stub, capsys):
+    revisions = promote.CharmhubRevisions(CharmhubBackend(charmhub_stub.url))
+    revisions.fetch(["missing"])
+
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "Failed to read the revisions of missing" in captured.err
+
+
+def test_promotions_are_recorded_in_the_cache(charmhub_stub, fake_charmcraft, tmp_path):
+    fake_charmcraft()
+    cache_file = str(tmp_path / "cache.json")
+    promotion_manifest = manifest("dex")
+    promotion_manifest["applications"]["dex-app0"]["source-channel"] = "1.10/edge"
+
+    revisions = promote.CharmhubRevisions(
+        CharmhubBackend(charmhub_stub.url), ChannelMapCache(cache_file)
+    )
+    promotions = promote.promote_charms(promotion_manifest, revisions=revisions)
+    assert promotions[0].status == "promoted"
+
+    # The cache knows stable now holds the edge revision
+    cached = promote.CharmhubRevisions(
+        CharmhubBackend(charmhub_stub.url), ChannelMapCache(cache_file)
+    )
+    cached.fetch(["dex"])
+    assert cached.revisions("dex", "1.10/stable") == cached.revisions("dex", "1.10/edge")
+    assert len(charmhub_stub.requests) == 1
+
+
+def test_cached_in_sync_charms_are_checked_again(charmhub_stub, fake_charmcraft, tmp_path):
+    calls = fake_charmcraft()
+    cache_file = str(tmp_path / "cache.json")
+    promotion_manifest = manifest("dex")
+    promotion_manifest["applications"]["dex-app0"]["source-channel"] = "1.10/edge"
+    revisions = promote.CharmhubRevisions(
+        CharmhubBackend(charmhub_stub.url), ChannelMapCache(cache_file)
+    )
+    revisions.fetch(["dex"])
+    # Cached as in sync, as after a promotion, before a new revision was released to edge
+    revisions.record_promotion(promote.PromotionResult("dex", "1.10/edge", "1.10/stable"))
+
+    revisions = promote.CharmhubRevisions(
+        CharmhubBackend(charmhub_stub.url), ChannelMapCache(cache_file)
+    )
+    promotions = promote.promote_charms(promotion_manifest, revisions=revisions)
+
+    assert promotions[0].status == "promoted"
+    assert calls.read_text().split() == ["dex"]
+    assert len(charmhub_stub.requests) == 2
+
+
+@pytest.mark.benchmark
+def test_benchmark_weekly_promotion(fake_charmcraft):
+    """Promotes 20 charms taking 0.1s each, 18 of which are already in sync"""
+    fake_charmcraft(latency=0.1)
+    charms = [f"charm{index}" for index in range(20)]
+    revisions = StubRevisions(
+        {
+            charm: {"1.10/candidate": {index}, "1.10/stable": {index if index >= 2 else -1}}
+            for index, charm in enumerate(charms)
+        }
+    )
+
+    start = time.monotonic()
+    promote.promote_charms(manifest(*charms))
+    all_elapsed = time.monotonic() - start
+
+    start = time.monotonic()
+    promotions = promote.promote_charms(manifest(*charms), revisions=revisions)
+    planned_elapsed = time.monotonic() - start
+
+    print(
+        f"20 charms, 18 in sync: without plan {all_elapsed:.3f}s, with plan {planned_elapsed:.3f}s"
+    )
+    assert sum(p.status == "promoted" for p in promotions) == 2
+    assert planned_elapsed < all_elapsed / 2
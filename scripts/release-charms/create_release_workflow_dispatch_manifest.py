@@ -30,7 +30,9 @@ def main(
         "expected is a standard bundle YAML file, where any charm that is in-scope for generating"
         "a release should also have the _github_repo_name key.  Additionally, if the charm is from"
         "a multi-charm repo, it should also include a _path_in_github_repo of the relative path"
-        "to that charm in the repo, for example 'charms/my-charm'",
+        "to that charm in the repo, for example 'charms/my-charm'.  A charm can also list the "
+        "applications that must be released before it in _release_depends_on, and set an integer "
+        "_release_priority to be released ahead of other charms that are ready at the same time",
     ),
     output_file: str = typer.Option(
         default="dispatch_manifest.yaml",
@@ -65,8 +67,11 @@ def main(
         logger.info(
             f"Application {source_application_name} causing release of charm {source_application['charm']} from {dispatch['inputs']['origin-channel']}->{dispatch['inputs']['destination-channel']}"
         )
+        dispatch["id"] = source_application_name
+        add_release_ordering(dispatch, source_application)
         release_dispatches.append(dispatch)
 
+    drop_unreleased_dependencies(release_dispatches)
     write_output(release_dispatches, output_file)
 
 
@@ -191,6 +196,35 @@ def build_release_dispatch_dict(
     return dispatch
 
 
+def add_release_ordering(dispatch: dict, source_application):
+    """Adds the depends_on and priority keys to a dispatch, from the source application"""
+    depends_on = source_application.get("_release_depends_on")
+    if depends_on:
+        dispatch["depends_on"] = list(depends_on)
+    if "_release_priority" in source_application:
+        dispatch["priority"] = int(source_application["_release_priority"])
+
+
+def drop_unreleased_dependencies(dispatches):
+    """Removes dependencies on applications that are not released by any of the dispatches
+
+    An application that does not need releasing does not hold up the applications depending on it.
+    """
+    released = {dispatch["id"] for dispatch in dispatches}
+    for dispatch in dispatches:
+        if "depends_on" not in dispatch:
+            continue
+        unreleased = [name for name in dispatch["depends_on"] if name not in released]
+        if unreleased:
+            logger.info(
+                f"Application {dispatch['id']} depends on {unreleased}, which are not being "
+                f"released.  Ignoring those dependencies."
+            )
+        dispatch["depends_on"] = [name for name in dispatch["depends_on"] if name in released]
+        if not dispatch["depends_on"]:
+            del dispatch["depends_on"]
+
+
 def write_output(dispatches, output_file: str):
     """Writes the release dispatches to the output file"""
     with open(output_file, "w") as f:
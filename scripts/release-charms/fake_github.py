@@ -0,0 +1,128 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Fake Github objects that simulate workflow runs taking time to complete, for use in tests"""
+
+import threading
+import time
+from datetime import datetime
+
+
+class FakeWorkflowRun:
+    """A fake github.WorkflowRun that completes once its latency has elapsed."""
+
+    def __init__(
+        self,
+        workflow,
+        run_id: int,
+        latency: float,
+        conclusion: str = "success",
+        display_title: str = None,
+    ):
+        self.workflow = workflow
+        self.id = run_id
+        self.created_at = datetime.utcnow()
+        self.display_title = display_title or workflow.name
+        self.html_url = f"{workflow.url}/runs/{run_id}"
+        self.latency = latency
+        self.final_conclusion = conclusion
+        self._started = time.monotonic()
+        self.completed_at = None
+        self.status = "queued"
+        self.conclusion = None
+        self.refresh()
+
+    def update(self):
+        """Fetches the latest data of the run, which costs one API call"""
+        self.workflow.api_calls += 1
+        self.refresh()
+
+    def refresh(self):
+        """Refreshes the status of the run, completing it once its latency has elapsed"""
+        if self.status == "completed":
+            return
+        if time.monotonic() - self._started >= self.latency:
+            self.status = "completed"
+            self.conclusion = self.final_conclusion
+            self.completed_at = time.monotonic()
+        else:
+            self.status = "in_progress"
+
+
+class FakeWorkflow:
+    """A fake github.Workflow whose dispatches create FakeWorkflowRuns.
+
+    Args:
+        repository: The "owner/repo" name of the repository the workflow lives in
+        name: The name of the workflow
+        latency: How long, in seconds, each run takes to complete
+        conclusion: The conclusion every run of this workflow completes with
+    """
+
+    def __init__(self, repository: str, name: str, latency: float, conclusion: str = "success"):
+        self.repository = repository
+        self.name = name
+        self.url = f"https://github.com/{repository}/actions/workflows/{name}"
+        self.latency = latency
+        self.conclusion = conclusion
+        self.runs = []
+        self.dispatches = []
+        self.api_calls = 0
+        self._lock = threading.Lock()
+
+    def create_dispatch(self, ref, inputs=None):
+        """Records the dispatch and starts a new run.
+
+        The title of the run includes the values of all inputs, as if the workflow's `run-name`
+        used them all.
+        """
+        with self._lock:
+            self.dispatches.append({"ref": ref, "inputs": inputs})
+            run = FakeWorkflowRun(
+                self,
+                len(self.runs) + 1,
+                latency=self.latency,
+                conclusion=self.conclusion,
+                display_title=" ".join(str(value) for value in (inputs or {}).values()),
+            )
+            self.runs.append(run)
+        return True
+
+    def get_runs(self, created: str = None, event: str = None, branch: str = None):
+        """Returns the runs of this workflow, newest first, like the Github API does.
+
+        Listing runs costs one API call.  Runs are filtered like the Github API filters them, with
+        created only supporting the ">=YYYY-MM-DDTHH:MM:SSZ" form.
+        """
+        with self._lock:
+            self.api_calls += 1
+            runs = list(reversed(self.runs))
+        if created is not None:
+            created_since = datetime.strptime(created, ">=%Y-%m-%dT%H:%M:%SZ")
+            runs = [run for run in runs if run.created_at >= created_since]
+        for run in runs:
+            run.refresh()
+        return runs
+
+
+def get_runs_created_since(workflow, created_since, event="workflow_dispatch", branch=None):
+    """Stands in for run_tracker.get_runs_created_since, listing the runs of a FakeWorkflow"""
+    return workflow.get_runs(
+        created=f">={created_since.strftime('%Y-%m-%dT%H:%M:%SZ')}", event=event, branch=branch
+    )
+
+
+class FakeGithub:
+    """A fake Github client holding FakeWorkflows, keyed by repository and workflow name."""
+
+    def __init__(self, workflows):
+        self.workflows = {(workflow.repository, workflow.name): workflow for workflow in workflows}
+
+    def get_workflow(self, repository: str, workflow_name: str) -> FakeWorkflow:
+        """Returns the FakeWorkflow for a repository, like get_workflow_from_repository"""
+        return self.workflows[(repository, workflow_name)]
+
+    @property
+    def runs(self):
+        """Returns all runs of all workflows"""
+        return [run for workflow in self.workflows.values() for run in workflow.runs]
@@ -0,0 +1,142 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Append-only, on-disk journal of the workflow dispatches executed from a dispatch manifest"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Events recorded in the journal for each attempt at executing a dispatch
+DISPATCHED = "dispatched"
+RUN_FOUND = "run_found"
+COMPLETED = "completed"
+
+
+def dispatch_key(dispatch: dict) -> str:
+    """Returns a key identifying a dispatch manifest entry from its repository, workflow, inputs"""
+    identity = {
+        "repository": dispatch["repository"],
+        "workflow_name": dispatch["workflow_name"],
+        "inputs": dispatch.get("inputs") or {},
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class ReleaseJournal:
+    """Append-only journal recording the progress of each dispatch of a dispatch manifest.
+
+    Every event (a dispatch being created, its run being found, the run completing) is appended as
+    one JSON line to the journal file and fsync'd before we move on, so the journal survives the
+    dispatcher being interrupted at any point.  When the journal is opened again, the events are
+    replayed to get the latest state of each dispatch, so that a new execution of the same manifest
+    can skip dispatches that already succeeded and pick up the runs still in progress.
+
+    Each line is a JSON object with at least the keys:
+        key: The dispatch_key of the dispatch manifest entry
+        repository, workflow_name, inputs: The dispatch manifest entry
+        event: One of DISPATCHED, RUN_FOUND or COMPLETED
+        time: When the event was recorded, in UTC
+
+    Args:
+        path: Path to the journal file.  It is created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._history: List[dict] = []
+
+        if os.path.exists(path):
+            self._replay()
+        self._file = open(path, "a")
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            # Terminate a partial line left by an interrupted write, so we do not append to it
+            self._file.write("\n")
+
+    def __enter__(self):
+        """Returns the journal"""
+        return self
+
+    def __exit__(self, *args):
+        """Closes the journal file"""
+        self.close()
+
+    def close(self):
+        """Closes the journal file"""
+        self._file.close()
+
+    def _replay(self):
+        """Loads the latest state of every dispatch from the journal file"""
+        with open(self.path) as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Most likely a partial line written while being interrupted
+                    logger.warning(
+                        f"Ignoring malformed line {line_number} of journal {self.path}: {line!r}"
+                    )
+                    continue
+                self._apply(record)
+
+    def _ends_with_newline(self) -> bool:
+        """Returns True if the journal file ends with a newline"""
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _apply(self, record: dict):
+        """Folds a record into the latest state of its dispatch"""
+        self._history.append(record)
+        if record["event"] == DISPATCHED:
+            # A new attempt at this dispatch, so forget about any previous one
+            self._entries[record["key"]] = dict(record)
+        else:
+            self._entries.setdefault(record["key"], {}).update(record)
+
+    def record(self, dispatch: dict, event: str, **fields):
+        """Appends an event about a dispatch to the journal, durably.
+
+        Args:
+            dispatch: The dispatch manifest entry the event is about
+            event: One of DISPATCHED, RUN_FOUND or COMPLETED
+            fields: Any other details to record, such as run_id, status or conclusion.  Values
+                    must be JSON serializable, except for datetimes which are stored in ISO format.
+        """
+        record = {
+            "key": dispatch_key(dispatch),
+            "repository": dispatch["repository"],
+            "workflow_name": dispatch["workflow_name"],
+            "inputs": dispatch.get("inputs") or {},
+            "event": event,
+            "time": datetime.utcnow().isoformat(),
+        }
+        for name, value in fields.items():
+            record[name] = value.isoformat() if isinstance(value, datetime) else value
+
+        with self._lock:
+            self._file.write(json.dumps(record, sort_keys=True) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._apply(record)
+
+    def get(self, dispatch: dict) -> Optional[dict]:
+        """Returns the latest state of a dispatch's most recent attempt, or None if never seen"""
+        with self._lock:
+            entry = self._entries.get(dispatch_key(dispatch))
+            return dict(entry) if entry is not None else None
+
+    def history(self) -> List[dict]:
+        """Returns every record in the journal, oldest first"""
+        with self._lock:
+            return list(self._history)
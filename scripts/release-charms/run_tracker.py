@@ -0,0 +1,393 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Tracks many in-flight workflow runs with a single, shared poller"""
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Union
+
+import github
+from github import WorkflowRun
+from github.PaginatedList import PaginatedList
+
+logger = logging.getLogger(__name__)
+
+
+def get_runs_created_since(
+    workflow: github.Workflow.Workflow,
+    created_since: datetime,
+    event: str = "workflow_dispatch",
+    branch: Optional[str] = None,
+) -> PaginatedList:
+    """Returns the runs of a workflow created since a timestamp, newest first.
+
+    The filtering is done by the Github API, so only the runs we are interested in are listed
+    rather than every historical run of the workflow.  The returned PaginatedList is lazy: pages
+    are requested as they are iterated over.
+
+    Args:
+        workflow: The workflow to list runs from
+        created_since: Only runs created at or after this timestamp, in UTC, are returned
+        event: Only runs triggered by this event are returned
+        branch: If set, only runs on this branch are returned
+    """
+    parameters = {
+        "created": f">={created_since.strftime('%Y-%m-%dT%H:%M:%SZ')}",
+        "event": event,
+    }
+    if branch is not None:
+        parameters["branch"] = branch
+
+    # Workflow.get_runs does not accept the `created` filter in the version of PyGithub we use,
+    # so we build the same PaginatedList it would return ourselves
+    return PaginatedList(
+        WorkflowRun.WorkflowRun,
+        workflow._requester,
+        f"{workflow.url}/runs",
+        parameters,
+        list_item="workflow_runs",
+    )
+
+
+def run_matches_dispatch(
+    run: WorkflowRun.WorkflowRun, dispatch_token: Optional[str], run_id: Optional[int] = None
+) -> bool:
+    """Returns True if the run may have been created by the dispatch identified by dispatch_token.
+
+    Github does not tell us which run a dispatch created, so dispatches can pass a unique token as
+    an input that the workflow includes in its `run-name`, which becomes the run's display title.
+    If dispatch_token is None, every run matches.  If run_id is set, because we already know which
+    run our dispatch created, only that run matches.
+    """
+    if run_id is not None:
+        return run.id == run_id
+    return dispatch_token is None or dispatch_token in (run.display_title or "")
+
+
+class TrackedRun:
+    """A workflow run waited on through a RunTracker.
+
+    Attributes:
+        workflow: The workflow the run belongs to
+        execution_time: Timestamp immediately before the run was dispatched, in UTC
+        dispatch_token: If set, the token included in the title of the run we are looking for
+        run_id: If set, the id of the run we are looking for
+        on_run_found: If set, called with the run once it is found
+        run: The github.WorkflowRun once it has been found, else None
+        api_calls: The number of Github API calls issued to check on this run.  A call shared by
+                   several runs of the same workflow counts once for each of them.
+    """
+
+    def __init__(
+        self,
+        workflow: github.Workflow.Workflow,
+        execution_time: datetime,
+        dispatch_token: Optional[str] = None,
+        run_id: Optional[int] = None,
+        on_run_found: Optional[Callable[[WorkflowRun.WorkflowRun], None]] = None,
+    ):
+        self.workflow = workflow
+        self.execution_time = execution_time
+        self.dispatch_token = dispatch_token
+        self.run_id = run_id
+        self.on_run_found = on_run_found
+        self.run = None
+        self.api_calls = 0
+        self.found_at = None
+        self._completed = threading.Event()
+
+    @property
+    def completed(self) -> bool:
+        """Returns True if the run has been found and has completed"""
+        return self._completed.is_set()
+
+    def wait(self, timeout: Optional[Union[int, float]] = None) -> bool:
+        """Blocks until the run has completed or timeout seconds have passed.
+
+        Returns:
+            True if the run completed, or False if the wait timed out
+        """
+        return self._completed.wait(timeout)
+
+
+class _TrackedWorkflow:
+    """The runs tracked for a single workflow, which are all checked on by one API call."""
+
+    def __init__(self, workflow: github.Workflow.Workflow, wait_between_checks: float):
+        self.workflow = workflow
+        self.tracked_runs = []
+        self.wait_between_checks = wait_between_checks
+        self.next_check = time.monotonic() + wait_between_checks
+
+
+class RunTracker:
+    """Waits on many workflow runs at once using a single, shared poller thread.
+
+    Rather than each waiter polling Github for its own run, every run is registered with the
+    tracker, which checks on all the runs of the same workflow with a single list call per tick and
+    then wakes up the waiters whose runs have completed.  Once every run of a workflow has been
+    found and has been in progress for longer than long_running_after, the time between checks of
+    that workflow grows exponentially (with some random jitter) up to max_wait_between_checks.
+
+    Usage:
+        with RunTracker() as tracker:
+            tracked_run = tracker.track(workflow, execution_time)
+            tracked_run.wait(timeout=600)
+
+    Args:
+        wait_between_checks: The time to wait between checks of a workflow, in seconds
+        max_wait_between_checks: The maximum time to wait between checks of a workflow whose runs
+                                 are long-running, in seconds
+        long_running_after: How long a run must have been in progress for before we back off
+                            checking on it, in seconds
+        backoff_factor: The factor by which the time between checks grows on each check of a
+                        workflow whose runs are long-running
+        jitter: The fraction by which the time between checks is randomly varied, so that checks
+                on different workflows do not synchronise
+    """
+
+    def __init__(
+        self,
+        wait_between_checks: float = 1,
+        max_wait_between_checks: float = 60,
+        long_running_after: float = 60,
+        backoff_factor: float = 2,
+        jitter: float = 0.1,
+    ):
+        self.wait_between_checks = wait_between_checks
+        self.max_wait_between_checks = max_wait_between_checks
+        self.long_running_after = long_running_after
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.api_calls = 0
+
+        self._workflows: Dict[str, _TrackedWorkflow] = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __enter__(self):
+        """Starts the poller thread"""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stops the poller thread"""
+        self.stop()
+
+    def start(self):
+        """Starts the poller thread, if it is not already running"""
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._poll, name="run-tracker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the poller thread, waiting for any in-progress check to finish"""
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopped = True
+            self._condition.notify_all()
+            thread, self._thread = self._thread, None
+        thread.join()
+
+    def track(
+        self,
+        workflow: github.Workflow.Workflow,
+        execution_time: datetime,
+        dispatch_token: Optional[str] = None,
+        run_id: Optional[int] = None,
+        on_run_found: Optional[Callable[[WorkflowRun.WorkflowRun], None]] = None,
+    ) -> TrackedRun:
+        """Starts tracking the run of a workflow dispatched just after execution_time.
+
+        Args:
+            workflow: The workflow that was dispatched
+            execution_time: Timestamp immediately before the workflow was dispatched, in UTC.
+                            The tracked run is the first run of the workflow created after this
+                            timestamp that is not already tracked.
+            dispatch_token: If set, only runs whose title includes this token are considered.
+                            See run_matches_dispatch.
+            run_id: If set, only the run with this id is considered, for example to reattach to
+                    a run we found before
+            on_run_found: If set, called with the run once it is found, from the poller thread
+
+        Returns:
+            A TrackedRun that can be waited on until the run completes
+        """
+        tracked_run = TrackedRun(
+            workflow,
+            execution_time,
+            dispatch_token=dispatch_token,
+            run_id=run_id,
+            on_run_found=on_run_found,
+        )
+        with self._condition:
+            tracked_workflow = self._workflows.get(workflow.url)
+            if tracked_workflow is None:
+                tracked_workflow = _TrackedWorkflow(workflow, self.wait_between_checks)
+                self._workflows[workflow.url] = tracked_workflow
+            else:
+                # A new run must be found quickly, so stop backing off
+                tracked_workflow.wait_between_checks = self.wait_between_checks
+                tracked_workflow.next_check = min(
+                    tracked_workflow.next_check, time.monotonic() + self.wait_between_checks
+                )
+            tracked_workflow.tracked_runs.append(tracked_run)
+            self._condition.notify_all()
+        self.start()
+        return tracked_run
+
+    def untrack(self, tracked_run: TrackedRun):
+        """Stops tracking a run, for example once it completed or its waiter timed out"""
+        with self._condition:
+            tracked_workflow = self._workflows.get(tracked_run.workflow.url)
+            if tracked_workflow is None or tracked_run not in tracked_workflow.tracked_runs:
+                return
+            tracked_workflow.tracked_runs.remove(tracked_run)
+            if not tracked_workflow.tracked_runs:
+                del self._workflows[tracked_run.workflow.url]
+
+    def _poll(self):
+        """Checks on each tracked workflow whenever it is due, until stopped"""
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = [
+                    tracked_workflow
+                    for tracked_workflow in self._workflows.values()
+                    if tracked_workflow.next_check <= now
+                ]
+                if not due:
+                    next_check = min(
+                        (
+                            tracked_workflow.next_check
+                            for tracked_workflow in self._workflows.values()
+                        ),
+                        default=None,
+                    )
+                    self._condition.wait(None if next_check is None else next_check - now)
+                    continue
+                snapshots = [
+                    (tracked_workflow, list(tracked_workflow.tracked_runs))
+                    for tracked_workflow in due
+                ]
+
+            # Talk to Github without holding the lock, so waiters can come and go meanwhile
+            for tracked_workflow, tracked_runs in snapshots:
+                try:
+                    self._check(tracked_workflow.workflow, tracked_runs)
+                except github.GithubException as e:
+                    logger.warning(
+                        f"Failed to check on runs of workflow '{tracked_workflow.workflow.name}', "
+                        f"will retry: {e}"
+                    )
+                except Exception:
+                    # Anything else, like a connection error or an unexpected payload, must not
+                    # kill the poller either, or every tracked run would wait out its timeout
+                    logger.exception(
+                        f"Unexpected error checking on runs of workflow "
+                        f"'{tracked_workflow.workflow.name}', will retry"
+                    )
+                with self._condition:
+                    self._finish_check(tracked_workflow, tracked_runs)
+
+    def _finish_check(self, tracked_workflow: _TrackedWorkflow, tracked_runs: List[TrackedRun]):
+        """Drops completed runs, then schedules the next check or drops the finished workflow"""
+        for tracked_run in tracked_runs:
+            if tracked_run.completed and tracked_run in tracked_workflow.tracked_runs:
+                tracked_workflow.tracked_runs.remove(tracked_run)
+        if tracked_workflow.tracked_runs:
+            self._schedule_next_check(tracked_workflow)
+        elif self._workflows.get(tracked_workflow.workflow.url) is tracked_workflow:
+            del self._workflows[tracked_workflow.workflow.url]
+
+    def _check(self, workflow: github.Workflow.Workflow, tracked_runs: List[TrackedRun]):
+        """Refreshes all tracked runs of a workflow from a single list of its recent runs"""
+        created_since = min(tracked_run.execution_time for tracked_run in tracked_runs)
+        runs = sorted(
+            (
+                run
+                for run in get_runs_created_since(workflow, created_since)
+                if run.created_at > created_since
+            ),
+            key=lambda run: run.created_at,
+        )
+        self._count_api_call(tracked_runs)
+        runs_by_id = {run.id: run for run in runs}
+        claimed_run_ids = {
+            tracked_run.run.id for tracked_run in tracked_runs if tracked_run.run is not None
+        }
+
+        # Match runs to waiters in dispatch order, so that each waiter gets the earliest run
+        # created after its dispatch that no one else has claimed
+        for tracked_run in sorted(
+            tracked_runs, key=lambda tracked_run: tracked_run.execution_time
+        ):
+            if tracked_run.run is None:
+                tracked_run.run = next(
+                    (
+                        run
+                        for run in runs
+                        if run.created_at > tracked_run.execution_time
+                        and run.id not in claimed_run_ids
+                        and run_matches_dispatch(
+                            run, tracked_run.dispatch_token, run_id=tracked_run.run_id
+                        )
+                    ),
+                    None,
+                )
+                if tracked_run.run is None:
+                    continue
+                claimed_run_ids.add(tracked_run.run.id)
+                tracked_run.found_at = time.monotonic()
+                logger.info(f"Found workflow run with url: {tracked_run.run.html_url}")
+                if tracked_run.on_run_found is not None:
+                    try:
+                        tracked_run.on_run_found(tracked_run.run)
+                    except Exception:
+                        # Never let a waiter's callback take down the poller shared by everyone
+                        logger.exception("on_run_found callback failed")
+            elif tracked_run.run.id in runs_by_id:
+                tracked_run.run = runs_by_id[tracked_run.run.id]
+            else:
+                # Not in the listing (eg: it fell onto a later page), so fetch it on its own
+                tracked_run.run.update()
+                self._count_api_call([tracked_run])
+
+            if tracked_run.run.status == "completed":
+                tracked_run._completed.set()
+
+    def _count_api_call(self, tracked_runs: List[TrackedRun]):
+        """Records an API call issued on behalf of tracked_runs"""
+        self.api_calls += 1
+        for tracked_run in tracked_runs:
+            tracked_run.api_calls += 1
+
+    def _schedule_next_check(self, tracked_workflow: _TrackedWorkflow):
+        """Sets when a workflow is next checked, backing off if its runs are long-running"""
+        now = time.monotonic()
+        long_running = tracked_workflow.tracked_runs and all(
+            tracked_run.found_at is not None
+            and now - tracked_run.found_at >= self.long_running_after
+            for tracked_run in tracked_workflow.tracked_runs
+        )
+        if long_running:
+            tracked_workflow.wait_between_checks = min(
+                tracked_workflow.wait_between_checks * self.backoff_factor,
+                self.max_wait_between_checks,
+            )
+        else:
+            tracked_workflow.wait_between_checks = self.wait_between_checks
+
+        jitter = random.uniform(-self.jitter, self.jitter)
+        tracked_workflow.next_check = now + tracked_workflow.wait_between_checks * (1 + jitter)
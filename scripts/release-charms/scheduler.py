@@ -0,0 +1,227 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Dependency-aware scheduling of the entries of a workflow dispatch manifest"""
+
+import heapq
+import statistics
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from journal import COMPLETED, DISPATCHED, dispatch_key
+
+# Duration assumed for dispatches we have no history for, in seconds
+DEFAULT_RUN_DURATION = 600
+
+
+class DispatchGraph:
+    """The dependency graph between the entries of a dispatch manifest.
+
+    Manifest entries can optionally have the keys:
+        id: A name for the entry, so that other entries can depend on it
+        depends_on: A list of ids of entries that must succeed before this one is executed
+        priority: An integer.  Among the entries that are ready to execute, those with a higher
+                  priority are executed first.  Defaults to 0.
+
+    Entries without dependencies are independent, and are ready to execute straight away.
+
+    Attributes:
+        dispatches: The manifest entries
+        dependencies: For each entry, the indices of the entries it depends on
+        dependents: For each entry, the indices of the entries that depend on it
+        order: The indices of all entries in a topological order, where ties between entries that
+               could go next are broken by priority and then by manifest order
+
+    Raises:
+        ValueError: if ids are duplicated, an entry depends on an unknown id, or the dependencies
+                    have a cycle
+    """
+
+    def __init__(self, dispatches: List[dict]):
+        self.dispatches = dispatches
+        self.dependencies: List[Set[int]] = [set() for _ in dispatches]
+        self.dependents: List[Set[int]] = [set() for _ in dispatches]
+
+        index_by_id = {}
+        for index, dispatch in enumerate(dispatches):
+            if "id" not in dispatch:
+                continue
+            if dispatch["id"] in index_by_id:
+                raise ValueError(f"Duplicate id '{dispatch['id']}' in dispatch manifest")
+            index_by_id[dispatch["id"]] = index
+
+        for index, dispatch in enumerate(dispatches):
+            for dependency_id in dispatch.get("depends_on") or []:
+                if dependency_id not in index_by_id:
+                    raise ValueError(
+                        f"Dispatch manifest entry {self.describe(index)} depends on unknown id "
+                        f"'{dependency_id}'"
+                    )
+                self.dependencies[index].add(index_by_id[dependency_id])
+                self.dependents[index_by_id[dependency_id]].add(index)
+
+        self.order = self._topological_order()
+
+    def priority(self, index: int) -> int:
+        """Returns the priority of an entry"""
+        return int(self.dispatches[index].get("priority", 0))
+
+    def describe(self, index: int) -> str:
+        """Returns a short human readable description of an entry"""
+        dispatch = self.dispatches[index]
+        if "id" in dispatch:
+            return f"'{dispatch['id']}'"
+        return f"#{index} ({dispatch['repository']})"
+
+    def _topological_order(self) -> List[int]:
+        """Returns the entries in topological order, raising ValueError on cycles"""
+        remaining_dependencies = [len(dependencies) for dependencies in self.dependencies]
+        ready = [
+            (-self.priority(index), index)
+            for index, count in enumerate(remaining_dependencies)
+            if count == 0
+        ]
+        heapq.heapify(ready)
+
+        order = []
+        while ready:
+            _, index = heapq.heappop(ready)
+            order.append(index)
+            for dependent in self.dependents[index]:
+                remaining_dependencies[dependent] -= 1
+                if remaining_dependencies[dependent] == 0:
+                    heapq.heappush(ready, (-self.priority(dependent), dependent))
+
+        if len(order) != len(self.dispatches):
+            in_cycle = sorted(set(range(len(self.dispatches))) - set(order))
+            raise ValueError(
+                "Dispatch manifest dependencies have a cycle between entries "
+                + ", ".join(self.describe(index) for index in in_cycle)
+            )
+        return order
+
+    def critical_path(self, durations: List[float]) -> Tuple[float, List[int]]:
+        """Returns the length and the entries of the longest chain of dependent entries.
+
+        No schedule can complete the manifest faster than its critical path, however many
+        dispatches are executed at once.
+
+        Args:
+            durations: The expected duration of each entry, in seconds
+        """
+        finish = [0.0] * len(self.dispatches)
+        previous: List[Optional[int]] = [None] * len(self.dispatches)
+        for index in self.order:
+            start = 0.0
+            for dependency in self.dependencies[index]:
+                if finish[dependency] > start:
+                    start = finish[dependency]
+                    previous[index] = dependency
+            finish[index] = start + durations[index]
+
+        if not finish:
+            return 0.0, []
+        index = max(range(len(finish)), key=lambda i: finish[i])
+        length = finish[index]
+        path = []
+        while index is not None:
+            path.append(index)
+            index = previous[index]
+        return length, list(reversed(path))
+
+    def estimate_completion(self, durations: List[float], max_concurrency: int) -> float:
+        """Returns how long executing the manifest is expected to take, in seconds.
+
+        This simulates the same policy the dispatcher uses: ready entries are started in order
+        while fewer than max_concurrency are in flight, never two for the same repository at once.
+
+        Args:
+            durations: The expected duration of each entry, in seconds
+            max_concurrency: The maximum number of entries executed at once
+        """
+        now = 0.0
+        pending = list(self.order)
+        finished: Set[int] = set()
+        in_flight: List[Tuple[float, int]] = []
+        busy_repositories: Set[str] = set()
+
+        while pending or in_flight:
+            for index in list(pending):
+                if len(in_flight) >= max_concurrency:
+                    break
+                repository = self.dispatches[index]["repository"]
+                if repository in busy_repositories or not self.dependencies[index] <= finished:
+                    continue
+                pending.remove(index)
+                busy_repositories.add(repository)
+                heapq.heappush(in_flight, (now + durations[index], index))
+
+            now, index = heapq.heappop(in_flight)
+            finished.add(index)
+            busy_repositories.discard(self.dispatches[index]["repository"])
+
+        return now
+
+
+def historical_durations(history: List[dict]) -> Dict[str, float]:
+    """Returns the mean duration of the successful attempts at each dispatch in a journal
+
+    The duration of an attempt is the time from its dispatch to its completion.
+
+    Args:
+        history: The records of a ReleaseJournal, oldest first
+
+    Returns:
+        A dict of {dispatch_key: mean duration in seconds}
+    """
+    dispatched_at = {}
+    durations = defaultdict(list)
+    for record in history:
+        if record["event"] == DISPATCHED:
+            dispatched_at[record["key"]] = datetime.fromisoformat(record["time"])
+        elif record["event"] == COMPLETED and record.get("outcome") == "succeeded":
+            if record["key"] not in dispatched_at:
+                continue
+            duration = datetime.fromisoformat(record["time"]) - dispatched_at.pop(record["key"])
+            durations[record["key"]].append(duration.total_seconds())
+
+    return {key: statistics.mean(values) for key, values in durations.items()}
+
+
+def expected_durations(
+    dispatches: List[dict],
+    history: List[dict],
+    default_duration: float = DEFAULT_RUN_DURATION,
+) -> List[float]:
+    """Returns the expected duration of each dispatch, based on a journal's history.
+
+    Dispatches that succeeded before are expected to take as long as they did on average.  Others
+    are expected to take as long as the median of the previous runs of the same workflow in the
+    same repository, or default_duration if there are none.
+
+    Args:
+        dispatches: The manifest entries
+        history: The records of a ReleaseJournal, oldest first
+        default_duration: The duration to assume when there is no history at all, in seconds
+    """
+    by_key = historical_durations(history)
+
+    by_workflow = defaultdict(list)
+    workflow_of_key = {
+        record["key"]: (record["repository"], record["workflow_name"]) for record in history
+    }
+    for key, duration in by_key.items():
+        by_workflow[workflow_of_key[key]].append(duration)
+
+    durations = []
+    for dispatch in dispatches:
+        key = dispatch_key(dispatch)
+        workflow = (dispatch["repository"], dispatch["workflow_name"])
+        if key in by_key:
+            durations.append(by_key[key])
+        elif by_workflow[workflow]:
+            durations.append(statistics.median(by_workflow[workflow]))
+        else:
+            durations.append(default_duration)
+    return durations
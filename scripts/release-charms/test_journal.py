@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test suite for journal.py"""
+
+import json
+
+from journal import COMPLETED, DISPATCHED, RUN_FOUND, ReleaseJournal, dispatch_key
+
+DISPATCH = {
+    "repository": "canonical/repo-a",
+    "workflow_name": "release.yaml",
+    "inputs": {"origin-channel": "1.6/edge", "destination-channel": "1.6/stable"},
+}
+OTHER_DISPATCH = {
+    "repository": "canonical/repo-a",
+    "workflow_name": "release.yaml",
+    "inputs": {"origin-channel": "1.7/edge", "destination-channel": "1.7/stable"},
+}
+
+
+def test_dispatch_key():
+    """Tests that dispatch keys identify dispatches regardless of input order."""
+    reordered = dict(DISPATCH, inputs=dict(reversed(list(DISPATCH["inputs"].items()))))
+    assert dispatch_key(DISPATCH) == dispatch_key(reordered)
+    assert dispatch_key(DISPATCH) != dispatch_key(OTHER_DISPATCH)
+
+
+def test_record_and_get(tmp_path):
+    """Tests that the latest state of each dispatch is folded from its events."""
+    with ReleaseJournal(tmp_path / "journal.jsonl") as journal:
+        assert journal.get(DISPATCH) is None
+        journal.record(DISPATCH, DISPATCHED, execution_time="2021-01-01T00:00:00")
+        journal.record(DISPATCH, RUN_FOUND, run_id=1, status="in_progress")
+        journal.record(OTHER_DISPATCH, DISPATCHED, execution_time="2021-01-01T00:00:01")
+
+        entry = journal.get(DISPATCH)
+        assert entry["event"] == RUN_FOUND
+        assert entry["run_id"] == 1
+        assert entry["execution_time"] == "2021-01-01T00:00:00"
+        assert journal.get(OTHER_DISPATCH)["event"] == DISPATCHED
+
+
+def test_new_attempt_forgets_previous_one(tmp_path):
+    """Tests that dispatching again starts a new attempt."""
+    with ReleaseJournal(tmp_path / "journal.jsonl") as journal:
+        journal.record(DISPATCH, DISPATCHED, execution_time="2021-01-01T00:00:00")
+        journal.record(DISPATCH, COMPLETED, outcome="failed", run_id=1)
+        journal.record(DISPATCH, DISPATCHED, execution_time="2021-01-02T00:00:00")
+
+        entry = journal.get(DISPATCH)
+        assert entry["event"] == DISPATCHED
+        assert "run_id" not in entry
+        assert "outcome" not in entry
+        assert len(journal.history()) == 3
+
+
+def test_journal_is_replayed_when_reopened(tmp_path):
+    """Tests that a journal picks up where the previous execution left off."""
+    path = tmp_path / "journal.jsonl"
+    with ReleaseJournal(path) as journal:
+        journal.record(DISPATCH, DISPATCHED, execution_time="2021-01-01T00:00:00")
+        journal.record(DISPATCH, COMPLETED, outcome="succeeded", run_id=1)
+
+    with ReleaseJournal(path) as journal:
+        assert journal.get(DISPATCH)["outcome"] == "succeeded"
+        journal.record(OTHER_DISPATCH, DISPATCHED, execution_time="2021-01-01T00:00:01")
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 3
+    assert [json.loads(line)["event"] for line in lines] == [DISPATCHED, COMPLETED, DISPATCHED]
+
+
+def test_partial_line_is_ignored(tmp_path):
+    """Tests that a line partially written when interrupted does not corrupt the journal."""
+    path = tmp_path / "journal.jsonl"
+    with ReleaseJournal(path) as journal:
+        journal.record(DISPATCH, DISPATCHED, execution_time="2021-01-01T00:00:00")
+    with open(path, "a") as f:
+        f.write('{"key": "abc", "eve')
+
+    with ReleaseJournal(path) as journal:
+        assert journal.get(DISPATCH)["event"] == DISPATCHED
+        journal.record(DISPATCH, RUN_FOUND, run_id=1)
+
+    with ReleaseJournal(path) as journal:
+        assert journal.get(DISPATCH)["run_id"] == 1
+        assert len(journal.history()) == 2
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test suite for run_tracker.py"""
+
+import threading
+from datetime import datetime
+
+import fake_github
+import github
+import pytest
+from fake_github import FakeWorkflow
+from run_tracker import RunTracker
+
+
+@pytest.fixture(autouse=True)
+def fake_get_runs_created_since(mocker):
+    """Lists runs from FakeWorkflows rather than the Github API"""
+    mocker.patch("run_tracker.get_runs_created_since", fake_github.get_runs_created_since)
+
+
+def dispatch(workflow):
+    """Dispatches a FakeWorkflow, returning the execution time to track its run with"""
+    execution_time = datetime.utcnow()
+    workflow.create_dispatch(ref="main")
+    return execution_time
+
+
+def test_track_waits_for_completion():
+    """Tests that a tracked run is found, followed to completion and returned."""
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=0.3)
+
+    with RunTracker(wait_between_checks=0.05) as tracker:
+        tracked_run = tracker.track(workflow, dispatch(workflow))
+        assert tracked_run.wait(timeout=5)
+
+    assert tracked_run.completed
+    assert tracked_run.run is workflow.runs[0]
+    assert tracked_run.run.conclusion == "success"
+
+
+def test_track_times_out():
+    """Tests that waiting on a run that does not complete in time returns False."""
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=5)
+
+    with RunTracker(wait_between_checks=0.05) as tracker:
+        tracked_run = tracker.track(workflow, dispatch(workflow))
+        assert not tracked_run.wait(timeout=0.2)
+        tracker.untrack(tracked_run)
+
+    assert not tracked_run.completed
+    assert tracked_run.run is workflow.runs[0]
+
+
+def test_track_ignores_runs_from_before_execution_time():
+    """Tests that runs created before the dispatch are never tracked."""
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=0)
+    workflow.create_dispatch(ref="main")
+
+    with RunTracker(wait_between_checks=0.05) as tracker:
+        tracked_run = tracker.track(workflow, datetime.utcnow())
+        assert not tracked_run.wait(timeout=0.2)
+        tracker.untrack(tracked_run)
+
+    assert tracked_run.run is None
+
+
+def test_track_with_dispatch_token():
+    """Tests that a dispatch token finds our run even if another dispatch raced ours."""
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=0.1)
+    execution_time = datetime.utcnow()
+    # Someone else dispatches the workflow right after us, but their run is created first
+    workflow.create_dispatch(ref="main", inputs={"dispatch-token": "theirs"})
+    workflow.create_dispatch(ref="main", inputs={"dispatch-token": "ours"})
+
+    with RunTracker(wait_between_checks=0.05) as tracker:
+        tracked_run = tracker.track(workflow, execution_time, dispatch_token="ours")
+        assert tracked_run.wait(timeout=5)
+
+    assert tracked_run.run is workflow.runs[1]
+
+
+def test_runs_of_same_workflow_share_api_calls():
+    """Tests that all tracked runs of a workflow are checked with a single call per tick."""
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=0.5)
+
+    with RunTracker(wait_between_checks=0.05) as tracker:
+        tracked_runs = [tracker.track(workflow, dispatch(workflow)) for _ in range(5)]
+        for tracked_run in tracked_runs:
+            assert tracked_run.wait(timeout=5)
+
+    # Each run is matched to a different dispatch
+    assert [tracked_run.run for tracked_run in tracked_runs] == workflow.runs
+    # Every call served every run, so each run was charged for every call
+    assert workflow.api_calls == tracker.api_calls
+    for tracked_run in tracked_runs:
+        assert tracked_run.api_calls == tracker.api_calls
+
+
+def test_backoff_reduces_api_calls_for_long_running_runs():
+    """Tests that checks on long-running runs back off, saving API calls."""
+    latency = 1
+    wait_between_checks = 0.05
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=latency)
+    workflow_without_backoff = FakeWorkflow("canonical/repo-b", "release.yaml", latency=latency)
+
+    with RunTracker(wait_between_checks=wait_between_checks, long_running_after=0.1) as tracker:
+        tracked_run = tracker.track(workflow, dispatch(workflow))
+        assert tracked_run.wait(timeout=5)
+
+    with RunTracker(wait_between_checks=wait_between_checks, long_running_after=60) as tracker:
+        tracked_run_without_backoff = tracker.track(
+            workflow_without_backoff, dispatch(workflow_without_backoff)
+        )
+        assert tracked_run_without_backoff.wait(timeout=5)
+
+    # Without backing off, we check about latency / wait_between_checks times
+    assert tracked_run_without_backoff.api_calls >= 0.8 * latency / wait_between_checks
+    assert tracked_run.api_calls < tracked_run_without_backoff.api_calls / 2
+
+
+def test_api_errors_are_retried(mocker):
+    """Tests that a failed check does not stop the tracker."""
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=0.1)
+    calls = []
+
+    def flaky_get_runs_created_since(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise github.GithubException(500, "Server error", None)
+        return fake_github.get_runs_created_since(*args, **kwargs)
+
+    mocker.patch("run_tracker.get_runs_created_since", flaky_get_runs_created_since)
+    with RunTracker(wait_between_checks=0.05) as tracker:
+        tracked_run = tracker.track(workflow, dispatch(workflow))
+        assert tracked_run.wait(timeout=5)
+
+    assert len(calls) > 1
+
+
+@pytest.mark.parametrize("error", [ConnectionError("Connection reset"), KeyError("workflow_runs")])
+def test_unexpected_errors_are_retried(mocker, caplog, error):
+    """Tests that a check failing with a non Github error does not kill the poller."""
+    workflow = FakeWorkflow("canonical/repo-a", "release.yaml", latency=0.1)
+    calls = []
+
+    def failing_get_runs_created_since(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise error
+        return fake_github.get_runs_created_since(*args, **kwargs)
+
+    mocker.patch("run_tracker.get_runs_created_since", failing_get_runs_created_since)
+    with RunTracker(wait_between_checks=0.05) as tracker:
+        tracked_run = tracker.track(workflow, dispatch(workflow))
+        assert tracked_run.wait(timeout=5)
+
+    assert tracked_run.completed
+    assert "Unexpected error checking on runs" in caplog.text
+
+
+def test_many_workflows_tracked_at_once():
+    """Tests tracking runs of many workflows from many threads at once."""
+    workflows = [
+        FakeWorkflow(f"canonical/repo-{i}", "release.yaml", latency=0.2) for i in range(10)
+    ]
+    tracked_runs = []
+
+    with RunTracker(wait_between_checks=0.05) as tracker:
+
+        def track_and_wait(workflow):
+            tracked_run = tracker.track(workflow, dispatch(workflow))
+            tracked_runs.append(tracked_run)
+            tracked_run.wait(timeout=5)
+            tracker.untrack(tracked_run)
+
+        threads = [threading.Thread(target=track_and_wait, args=(w,)) for w in workflows]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert all(tracked_run.completed for tracked_run in tracked_runs)
+    assert tracker.api_calls == sum(workflow.api_calls for workflow in workflows)
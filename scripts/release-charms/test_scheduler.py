@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test suite for scheduler.py"""
+
+import pytest
+from journal import COMPLETED, DISPATCHED, dispatch_key
+from scheduler import DispatchGraph, expected_durations, historical_durations
+
+
+def build_entry(entry_id, repository=None, depends_on=None, priority=None):
+    """Returns a dispatch manifest entry with an id, and optionally dependencies and priority"""
+    entry = {
+        "id": entry_id,
+        "repository": repository or f"canonical/{entry_id}",
+        "workflow_name": "release.yaml",
+        "inputs": {"origin-channel": "1.6/edge", "destination-channel": "1.6/stable"},
+    }
+    if depends_on is not None:
+        entry["depends_on"] = depends_on
+    if priority is not None:
+        entry["priority"] = priority
+    return entry
+
+
+def test_order_without_dependencies_keeps_manifest_order():
+    """Tests that independent entries keep their manifest order."""
+    dispatches = [build_entry(name) for name in "abc"]
+    # Entries without an id are fine as long as nothing depends on them
+    del dispatches[1]["id"]
+    assert DispatchGraph(dispatches).order == [0, 1, 2]
+
+
+def test_order_respects_dependencies_and_priority():
+    """Tests that entries come after their dependencies, and higher priorities first."""
+    dispatches = [
+        build_entry("a", depends_on=["c"]),
+        build_entry("b"),
+        build_entry("c"),
+        build_entry("d", priority=10),
+    ]
+    graph = DispatchGraph(dispatches)
+
+    assert graph.order == [3, 1, 2, 0]
+    assert graph.dependencies[0] == {2}
+    assert graph.dependents[2] == {0}
+
+
+@pytest.mark.parametrize(
+    "dispatches, match",
+    [
+        ([build_entry("a"), build_entry("a")], "Duplicate id"),
+        ([build_entry("a", depends_on=["missing"])], "unknown id 'missing'"),
+        (
+            [
+                build_entry("a", depends_on=["c"]),
+                build_entry("b", depends_on=["a"]),
+                build_entry("c", depends_on=["b"]),
+                build_entry("d"),
+            ],
+            "cycle between entries 'a', 'b', 'c'$",
+        ),
+    ],
+)
+def test_invalid_graphs(dispatches, match):
+    """Tests that invalid dependencies are rejected."""
+    with pytest.raises(ValueError, match=match):
+        DispatchGraph(dispatches)
+
+
+def test_critical_path_and_estimate_completion():
+    """Tests the critical path and the simulated completion time of a manifest.
+
+    a(10) -> b(10) -> d(5)
+    c(30)
+    e(10), in the same repository as c
+    """
+    dispatches = [
+        build_entry("a"),
+        build_entry("b", depends_on=["a"]),
+        build_entry("c", repository="canonical/shared"),
+        build_entry("d", depends_on=["b"]),
+        build_entry("e", repository="canonical/shared"),
+    ]
+    durations = [10, 10, 30, 5, 10]
+    graph = DispatchGraph(dispatches)
+
+    assert graph.critical_path(durations) == (30, [2])
+    # c and e cannot overlap, so with enough concurrency we are bound by c + e
+    assert graph.estimate_completion(durations, max_concurrency=5) == 40
+    # One at a time, it is the sum of all durations
+    assert graph.estimate_completion(durations, max_concurrency=1) == sum(durations)
+
+    durations[3] = 15
+    assert graph.critical_path(durations) == (35, [0, 1, 3])
+
+
+def test_critical_path_empty_manifest():
+    """Tests that an empty manifest has an empty critical path."""
+    graph = DispatchGraph([])
+    assert graph.critical_path([]) == (0.0, [])
+    assert graph.estimate_completion([], max_concurrency=1) == 0
+
+
+def build_record(dispatch, event, time, **fields):
+    """Returns a journal record for a dispatch"""
+    return dict(
+        key=dispatch_key(dispatch),
+        repository=dispatch["repository"],
+        workflow_name=dispatch["workflow_name"],
+        inputs=dispatch["inputs"],
+        event=event,
+        time=time,
+        **fields,
+    )
+
+
+def test_expected_durations_from_history():
+    """Tests estimating durations from the successful attempts recorded in a journal."""
+    a, b, other_a = (
+        build_entry("a"),
+        build_entry("b"),
+        build_entry("other-a", repository="canonical/a"),
+    )
+    other_a["inputs"] = {"origin-channel": "1.7/edge", "destination-channel": "1.7/stable"}
+    history = [
+        build_record(a, DISPATCHED, "2022-01-01T00:00:00"),
+        build_record(a, COMPLETED, "2022-01-01T00:01:00", outcome="succeeded"),
+        build_record(a, DISPATCHED, "2022-01-02T00:00:00"),
+        build_record(a, COMPLETED, "2022-01-02T00:03:00", outcome="succeeded"),
+        # Failed attempts do not count
+        build_record(b, DISPATCHED, "2022-01-01T00:00:00"),
+        build_record(b, COMPLETED, "2022-01-01T00:00:05", outcome="failed"),
+    ]
+
+    assert historical_durations(history) == {dispatch_key(a): 120}
+    # other-a has no history of its own, but shares a's repository and workflow
+    assert expected_durations([a, b, other_a], history, default_duration=600) == [120, 600, 120]
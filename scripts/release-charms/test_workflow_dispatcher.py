@@ -4,18 +4,32 @@
 
 """Test suite for workflow_dispatcher.py"""
 
+import threading
+import time
 from contextlib import nullcontext
 from datetime import datetime, timedelta
+from functools import partial
 from unittest import mock
 
+import fake_github as fake_github_module
 import pytest
 import workflow_dispatcher
+from fake_github import FakeGithub, FakeWorkflow
+from journal import COMPLETED, DISPATCHED, RUN_FOUND, ReleaseJournal
+from run_tracker import RunTracker
 from workflow_dispatcher import (
+    FAILED,
+    SKIPPED,
+    SUCCEEDED,
+    TIMED_OUT,
     NoRunsFoundError,
     RunFailedError,
     RunTimeoutError,
     TooManyRunsFoundError,
+    dispatch_workflows,
+    execute_dispatch,
     execute_workflow_and_wait,
+    format_results_table,
     get_recent_run,
     wait_for_recent_workflow_run_completion,
 )
@@ -30,11 +44,13 @@ class FakeRun:
         status="completed",
         conclusion="success",
         html_url="http://something.com/",
+        display_title="some workflow run",
     ):
         self.created_at = created_at
         self.status = status
         self.conclusion = conclusion
         self.html_url = html_url
+        self.display_title = display_title
 
     def update(self):
         """Mock update method"""
@@ -57,7 +73,8 @@ WORKFLOW_WITHOUT_RUNS.get_runs.return_value = []
 WORKFLOW_WITHOUT_RUNS.name = "workflow_without_runs"
 WORKFLOW_WITHOUT_RUNS.html_url = "http://stuff.com/workflow_without_runs"
 
-WORKFLOW_RUNS = [FakeRun(created_at=t) for t in RUN_EXECUTION_TIMES]
+# Runs are listed newest first, like the Github API does
+WORKFLOW_RUNS = [FakeRun(created_at=t) for t in reversed(RUN_EXECUTION_TIMES)]
 
 WORKFLOW_WITH_RUNS = mock.Mock()
 WORKFLOW_WITH_RUNS.get_runs.return_value = WORKFLOW_RUNS
@@ -75,7 +92,7 @@ RUN_INCOMPLETE = FakeRun(
     "workflow, execution_time, expected, context_raised",
     (
         # successful execution yielding a single run
-        (WORKFLOW_WITH_RUNS, TIME_YIELDING_LAST_RUN, WORKFLOW_RUNS[-1], nullcontext()),
+        (WORKFLOW_WITH_RUNS, TIME_YIELDING_LAST_RUN, WORKFLOW_RUNS[0], nullcontext()),
         # unsuccessful execution due to too many runs
         (WORKFLOW_WITH_RUNS, TIME_BEFORE_ALL_RUNS, None, pytest.raises(TooManyRunsFoundError)),
         # unsuccessful executions due to no runs found (all filtered out)
@@ -89,13 +106,83 @@ RUN_INCOMPLETE = FakeRun(
         ),
     ),
 )
-def test_get_recent_run(workflow, execution_time, expected, context_raised):
+def test_get_recent_run(workflow, execution_time, expected, context_raised, mocker):
     """Tests get_recent_run."""
+    mocker.patch(
+        "workflow_dispatcher.get_runs_created_since",
+        side_effect=lambda workflow, created_since, **kwargs: workflow.get_runs(),
+    )
     with context_raised:
         run = get_recent_run(workflow, execution_time)
         assert run == expected
 
 
+def test_get_recent_run_filters_server_side(mocker):
+    """Tests that get_recent_run asks the Github API for only the runs it needs."""
+    mock_get_runs_created_since = mocker.patch(
+        "workflow_dispatcher.get_runs_created_since", return_value=WORKFLOW_RUNS
+    )
+
+    get_recent_run(WORKFLOW_WITH_RUNS, TIME_YIELDING_LAST_RUN, branch="main")
+
+    mock_get_runs_created_since.assert_called_once_with(
+        WORKFLOW_WITH_RUNS, TIME_YIELDING_LAST_RUN, branch="main"
+    )
+
+
+def test_get_recent_run_with_dispatch_token(mocker):
+    """Tests that a dispatch token tells our run apart from other recent runs."""
+    execution_time = datetime(2021, 1, 1, 0, 0, 0)
+    our_run = FakeRun(execution_time + timedelta(seconds=2), display_title="Release abc123")
+    other_run = FakeRun(execution_time + timedelta(seconds=3), display_title="Release def456")
+    mocker.patch("workflow_dispatcher.get_runs_created_since", return_value=[other_run, our_run])
+
+    with pytest.raises(TooManyRunsFoundError):
+        get_recent_run(WORKFLOW_WITH_RUNS, execution_time)
+    assert get_recent_run(WORKFLOW_WITH_RUNS, execution_time, dispatch_token="abc123") is our_run
+    with pytest.raises(NoRunsFoundError):
+        get_recent_run(WORKFLOW_WITH_RUNS, execution_time, dispatch_token="ghi789")
+
+
+@pytest.mark.benchmark
+def test_get_recent_run_benchmark_many_historical_runs(mocker):
+    """Benchmarks get_recent_run against a workflow with 10k historical runs.
+
+    get_recent_run must stop reading runs at the first one older than the execution time, rather
+    than reading (and paging through) every historical run like a full filter would.
+    """
+    n_runs = 10000
+    execution_time = datetime(2021, 1, 1, 0, 0, 0)
+    recent_run = FakeRun(execution_time + timedelta(seconds=1))
+    consumed = []
+
+    def get_runs(*args, **kwargs):
+        """Yields the recent run then n_runs historical runs, newest first, counting reads"""
+        consumed.append(recent_run)
+        yield recent_run
+        for i in range(n_runs):
+            run = FakeRun(execution_time - timedelta(minutes=i + 1))
+            consumed.append(run)
+            yield run
+
+    mocker.patch("workflow_dispatcher.get_runs_created_since", side_effect=get_runs)
+    start = time.perf_counter()
+    run = get_recent_run(WORKFLOW_WITH_RUNS, execution_time)
+    streamed_time = time.perf_counter() - start
+
+    assert run is recent_run
+    assert len(consumed) == 2
+
+    start = time.perf_counter()
+    list(filter(lambda run: run.created_at > execution_time, get_runs()))
+    full_filter_time = time.perf_counter() - start
+    print(
+        f"get_recent_run over {n_runs} runs: streamed {streamed_time * 1000:.3f}ms, full "
+        f"filter {full_filter_time * 1000:.3f}ms"
+    )
+    assert streamed_time < full_filter_time
+
+
 def test_wait_for_recent_workflow_run_completion_successful():
     """Tests a successful case of running wait_for_recent_workflow_run_completion."""
     workflow = WORKFLOW_WITHOUT_RUNS
@@ -118,7 +205,13 @@ def test_wait_for_recent_workflow_run_completion_successful():
 
         assert run == expected_run
         assert mock_get_recent_run.call_count == len(release_charms_side_effects)
-        mock_get_recent_run.assert_called_with(workflow=workflow, execution_time=execution_time)
+        mock_get_recent_run.assert_called_with(
+            workflow=workflow,
+            execution_time=execution_time,
+            branch=None,
+            dispatch_token=None,
+            run_id=None,
+        )
 
 
 def test_wait_for_recent_workflow_run_completion_failed_no_run_found():
@@ -227,5 +320,336 @@ def test_execute_workflow_and_wait(
     pass
 
 
+def build_dispatch(repository, charm_name=None):
+    """Returns a dispatch manifest entry for the release.yaml workflow of a repository"""
+    inputs = {"origin-channel": "1.6/edge", "destination-channel": "1.6/stable"}
+    if charm_name:
+        inputs["charm-name"] = charm_name
+    return {"repository": repository, "workflow_name": "release.yaml", "inputs": inputs}
+
+
+@pytest.fixture()
+def fake_github(mocker):
+    """Patches get_workflow_from_repository to return FakeWorkflows from a FakeGithub"""
+    fake_github = FakeGithub(
+        [
+            FakeWorkflow("canonical/repo-a", "release.yaml", latency=0.3),
+            FakeWorkflow("canonical/repo-b", "release.yaml", latency=0.3),
+            FakeWorkflow("canonical/repo-c", "release.yaml", latency=0.3),
+            FakeWorkflow(
+                "canonical/repo-failing", "release.yaml", latency=0.1, conclusion="failure"
+            ),
+        ]
+    )
+    mocker.patch("run_tracker.get_runs_created_since", fake_github_module.get_runs_created_since)
+    mocker.patch(
+        "workflow_dispatcher.get_runs_created_since", fake_github_module.get_runs_created_since
+    )
+    mocker.patch(
+        "workflow_dispatcher.get_workflow_from_repository",
+        side_effect=lambda github_token, repository, workflow_name: fake_github.get_workflow(
+            repository, workflow_name
+        ),
+    )
+    return fake_github
+
+
+def test_dispatch_workflows_runs_concurrently(fake_github, mocker):
+    """Tests that dispatches to different repositories are waited on at the same time."""
+    get_workflow = workflow_dispatcher.get_workflow_from_repository.side_effect
+    # Every dispatch waits for the others to be in progress, which breaks the barrier after its
+    # timeout, failing the dispatches, if they are executed in series
+    barrier = threading.Barrier(3, timeout=5)
+
+    def get_workflow_together(github_token, repository, workflow_name):
+        barrier.wait()
+        return get_workflow(github_token, repository, workflow_name)
+
+    mocker.patch(
+        "workflow_dispatcher.get_workflow_from_repository", side_effect=get_workflow_together
+    )
+    dispatches = [build_dispatch(f"canonical/repo-{name}") for name in "abc"]
+    execute = partial(execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05)
+
+    results = dispatch_workflows(dispatches, execute=execute, max_concurrency=3)
+
+    assert [result.outcome for result in results] == [SUCCEEDED] * 3
+    assert [result.dispatch for result in results] == dispatches
+
+
+def test_dispatch_workflows_serializes_dispatches_to_same_repository(fake_github):
+    """Tests that dispatches to the same repository never overlap and keep manifest order."""
+    dispatches = [
+        build_dispatch("canonical/repo-a", charm_name="charm-1"),
+        build_dispatch("canonical/repo-b"),
+        build_dispatch("canonical/repo-a", charm_name="charm-2"),
+    ]
+    execute = partial(execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05)
+
+    results = dispatch_workflows(dispatches, execute=execute, max_concurrency=3)
+
+    assert [result.outcome for result in results] == [SUCCEEDED] * 3
+    workflow = fake_github.get_workflow("canonical/repo-a", "release.yaml")
+    assert [dispatch["inputs"]["charm-name"] for dispatch in workflow.dispatches] == [
+        "charm-1",
+        "charm-2",
+    ]
+    first_run, second_run = workflow.runs
+    assert second_run._started >= first_run.completed_at
+    assert results[0].run is first_run
+    assert results[2].run is second_run
+
+
+def test_dispatch_workflows_respects_max_concurrency(fake_github):
+    """Tests that at most max_concurrency runs are in flight at once."""
+    dispatches = [build_dispatch(f"canonical/repo-{name}") for name in "abc"]
+    execute = partial(execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05)
+
+    dispatch_workflows(dispatches, execute=execute, max_concurrency=2)
+
+    runs = sorted(fake_github.runs, key=lambda run: run._started)
+    assert len(runs) == 3
+    # The third run can only start once one of the first two has completed
+    assert runs[2]._started >= min(runs[0].completed_at, runs[1].completed_at)
+
+
+def test_dispatch_workflows_collects_failures(fake_github):
+    """Tests that a failed or timed out dispatch does not stop the others."""
+    dispatches = [
+        build_dispatch("canonical/repo-failing"),
+        build_dispatch("canonical/repo-a"),
+    ]
+    execute = partial(execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05)
+
+    results = dispatch_workflows(dispatches, execute=execute, max_concurrency=2)
+    assert [result.outcome for result in results] == [FAILED, SUCCEEDED]
+    assert results[0].run.conclusion == "failure"
+
+    execute = partial(execute_dispatch, github_token="", timeout=0.1, wait_between_checks=0.05)
+    results = dispatch_workflows(dispatches[1:], execute=execute, max_concurrency=2)
+    assert [result.outcome for result in results] == [TIMED_OUT]
+
+
+def test_dispatch_workflows_collects_unexpected_errors(fake_github, tmp_path, mocker):
+    """Tests that an error other than a failed run fails its dispatch only, and is journaled."""
+    get_workflow = workflow_dispatcher.get_workflow_from_repository.side_effect
+
+    def get_workflow_or_fail(github_token, repository, workflow_name):
+        if repository == "canonical/repo-broken":
+            raise ConnectionError("Connection reset by peer")
+        return get_workflow(github_token, repository, workflow_name)
+
+    mocker.patch(
+        "workflow_dispatcher.get_workflow_from_repository", side_effect=get_workflow_or_fail
+    )
+    dispatches = [build_dispatch("canonical/repo-broken"), build_dispatch("canonical/repo-a")]
+
+    with ReleaseJournal(tmp_path / "journal.jsonl") as journal:
+        execute = partial(
+            execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05, journal=journal
+        )
+        results = dispatch_workflows(dispatches, execute=execute, max_concurrency=1)
+        entry = journal.get(dispatches[0])
+
+    assert [result.outcome for result in results] == [FAILED, SUCCEEDED]
+    assert results[0].message == "ConnectionError: Connection reset by peer"
+    assert entry["event"] == COMPLETED
+    assert entry["outcome"] == FAILED
+
+
+def test_dispatch_workflows_with_run_tracker(fake_github):
+    """Tests dispatching many workflows that are all waited on through a shared RunTracker."""
+    dispatches = [build_dispatch(f"canonical/repo-{name}") for name in "abc"]
+    dispatches.append(build_dispatch("canonical/repo-failing"))
+
+    with RunTracker(wait_between_checks=0.05) as run_tracker:
+        execute = partial(execute_dispatch, github_token="", timeout=5, run_tracker=run_tracker)
+        results = dispatch_workflows(dispatches, execute=execute, max_concurrency=4)
+
+    assert [result.outcome for result in results] == [SUCCEEDED] * 3 + [FAILED]
+    assert [result.run for result in results] == fake_github.runs
+
+
+def test_dispatch_workflows_with_run_tracker_timeout(fake_github):
+    """Tests that runs waited on through a RunTracker can time out."""
+    dispatches = [build_dispatch("canonical/repo-a")]
+
+    with RunTracker(wait_between_checks=0.05) as run_tracker:
+        execute = partial(execute_dispatch, github_token="", timeout=0.1, run_tracker=run_tracker)
+        results = dispatch_workflows(dispatches, execute=execute)
+
+    assert [result.outcome for result in results] == [TIMED_OUT]
+    assert results[0].run is fake_github.runs[0]
+
+
+def test_dispatch_workflows_with_dispatch_token(fake_github):
+    """Tests that each dispatch passes a unique token and finds its run through it."""
+    dispatches = [build_dispatch("canonical/repo-a"), build_dispatch("canonical/repo-b")]
+
+    with RunTracker(wait_between_checks=0.05) as run_tracker:
+        execute = partial(
+            execute_dispatch,
+            github_token="",
+            timeout=5,
+            run_tracker=run_tracker,
+            dispatch_token_input="dispatch-token",
+        )
+        results = dispatch_workflows(dispatches, execute=execute, max_concurrency=2)
+
+    assert [result.outcome for result in results] == [SUCCEEDED] * 2
+    tokens = set()
+    for result in results:
+        workflow = fake_github.get_workflow(result.dispatch["repository"], "release.yaml")
+        token = workflow.dispatches[0]["inputs"]["dispatch-token"]
+        assert token in result.run.display_title
+        tokens.add(token)
+    assert len(tokens) == 2
+    # The manifest entries are not modified
+    assert "dispatch-token" not in dispatches[0]["inputs"]
+
+
+def test_journal_skips_succeeded_and_retries_failed_dispatches(fake_github, tmp_path):
+    """Tests that rerunning a manifest with a journal only retries what did not succeed."""
+    dispatches = [build_dispatch("canonical/repo-a"), build_dispatch("canonical/repo-failing")]
+    journal_file = tmp_path / "journal.jsonl"
+
+    with ReleaseJournal(journal_file) as journal:
+        execute = partial(
+            execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05, journal=journal
+        )
+        results = dispatch_workflows(dispatches, execute=execute, max_concurrency=2)
+    assert [result.outcome for result in results] == [SUCCEEDED, FAILED]
+
+    with ReleaseJournal(journal_file) as journal:
+        execute = partial(
+            execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05, journal=journal
+        )
+        results = dispatch_workflows(dispatches, execute=execute, max_concurrency=2)
+    assert [result.outcome for result in results] == [SUCCEEDED, FAILED]
+
+    # The successful dispatch was not executed again, but the failed one was
+    assert len(fake_github.get_workflow("canonical/repo-a", "release.yaml").runs) == 1
+    assert len(fake_github.get_workflow("canonical/repo-failing", "release.yaml").runs) == 2
+    assert results[0].message == "Already succeeded in a previous execution"
+    assert results[0].run_url == fake_github.runs[0].html_url
+
+
+@pytest.mark.parametrize("run_found", (True, False))
+def test_journal_reattaches_to_interrupted_dispatch(fake_github, tmp_path, run_found):
+    """Tests that a dispatch interrupted while waiting on its run is reattached, not redone."""
+    dispatch = build_dispatch("canonical/repo-a")
+    workflow = fake_github.get_workflow("canonical/repo-a", "release.yaml")
+    journal_file = tmp_path / "journal.jsonl"
+
+    # A previous execution dispatched the workflow, then got interrupted
+    with ReleaseJournal(journal_file) as journal:
+        journal.record(dispatch, DISPATCHED, execution_time=datetime.utcnow())
+        workflow.create_dispatch(ref="main", inputs=dispatch["inputs"])
+        if run_found:
+            journal.record(dispatch, RUN_FOUND, run_id=workflow.runs[0].id)
+
+    with ReleaseJournal(journal_file) as journal, RunTracker(wait_between_checks=0.05) as tracker:
+        result = execute_dispatch(
+            dispatch, github_token="", timeout=5, run_tracker=tracker, journal=journal
+        )
+        entry = journal.get(dispatch)
+
+    assert result.outcome == SUCCEEDED
+    assert result.run is workflow.runs[0]
+    assert len(workflow.runs) == 1
+    assert entry["event"] == COMPLETED
+    assert entry["run_id"] == workflow.runs[0].id
+    assert entry["conclusion"] == "success"
+
+
+def test_journal_reattaches_to_timed_out_run(fake_github, tmp_path):
+    """Tests that a run we timed out waiting on is waited on again rather than redispatched."""
+    dispatch = build_dispatch("canonical/repo-a")
+    workflow = fake_github.get_workflow("canonical/repo-a", "release.yaml")
+    journal_file = tmp_path / "journal.jsonl"
+
+    with ReleaseJournal(journal_file) as journal:
+        result = execute_dispatch(
+            dispatch, github_token="", timeout=0.1, wait_between_checks=0.05, journal=journal
+        )
+    assert result.outcome == TIMED_OUT
+
+    with ReleaseJournal(journal_file) as journal:
+        result = execute_dispatch(
+            dispatch, github_token="", timeout=5, wait_between_checks=0.05, journal=journal
+        )
+    assert result.outcome == SUCCEEDED
+    assert len(workflow.runs) == 1
+
+
+def test_dispatch_workflows_respects_dependencies(fake_github):
+    """Tests that dispatches start once their dependencies succeed, highest priority first."""
+    dispatches = [
+        dict(build_dispatch("canonical/repo-a"), id="a", depends_on=["b"]),
+        dict(build_dispatch("canonical/repo-b"), id="b"),
+        dict(build_dispatch("canonical/repo-c"), id="c", priority=1),
+    ]
+    execute = partial(execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05)
+
+    results = dispatch_workflows(dispatches, execute=execute, max_concurrency=1)
+
+    assert [result.outcome for result in results] == [SUCCEEDED] * 3
+    runs = sorted(fake_github.runs, key=lambda run: run._started)
+    assert [run.workflow.repository for run in runs] == [
+        "canonical/repo-c",
+        "canonical/repo-b",
+        "canonical/repo-a",
+    ]
+
+
+def test_dispatch_workflows_skips_dependents_of_failures(fake_github):
+    """Tests that dispatches depending on a failed dispatch, directly or not, are skipped."""
+    dispatches = [
+        dict(build_dispatch("canonical/repo-failing"), id="failing"),
+        dict(build_dispatch("canonical/repo-a"), id="a", depends_on=["failing"]),
+        dict(build_dispatch("canonical/repo-b"), id="b", depends_on=["a"]),
+        dict(build_dispatch("canonical/repo-c"), id="c"),
+    ]
+    execute = partial(execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05)
+
+    results = dispatch_workflows(dispatches, execute=execute, max_concurrency=4)
+
+    assert [result.outcome for result in results] == [FAILED, SKIPPED, SKIPPED, SUCCEEDED]
+    assert results[1].message == "Dependency 'failing' failed"
+    assert results[2].message == "Dependency 'a' skipped"
+    assert fake_github.get_workflow("canonical/repo-a", "release.yaml").dispatches == []
+
+
+def test_dispatch_workflows_invalid_dependencies():
+    """Tests that invalid dependencies are rejected before anything is dispatched."""
+    execute = mock.MagicMock()
+    dispatches = [dict(build_dispatch("canonical/repo-a"), id="a", depends_on=["a"])]
+    with pytest.raises(ValueError, match="cycle"):
+        dispatch_workflows(dispatches, execute=execute)
+    execute.assert_not_called()
+
+
+def test_dispatch_workflows_invalid_max_concurrency():
+    """Tests that max_concurrency must be positive."""
+    with pytest.raises(ValueError):
+        dispatch_workflows([], execute=None, max_concurrency=0)
+
+
+def test_format_results_table(fake_github):
+    """Tests the summary table of dispatch results."""
+    dispatches = [build_dispatch("canonical/repo-failing"), build_dispatch("canonical/repo-a")]
+    execute = partial(execute_dispatch, github_token="", timeout=5, wait_between_checks=0.05)
+    results = dispatch_workflows(dispatches, execute=execute, max_concurrency=2)
+
+    table = format_results_table(results).splitlines()
+
+    assert table[0].split() == ["REPOSITORY", "WORKFLOW", "INPUTS", "OUTCOME", "RUN"]
+    assert table[1].startswith("canonical/repo-failing")
+    assert FAILED in table[1]
+    assert results[0].run.html_url in table[1]
+    assert SUCCEEDED in table[2]
+    assert table[-1] == "1/2 dispatches succeeded"
+
+
 # TODO:
 # * tests don't actually check that we update the run's data while waiting for completion
@@ -6,14 +6,29 @@
 
 import logging
 import os
+import sys
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
 from time import sleep
-from typing import Union
+from typing import Callable, List, Optional, Tuple, Union
 
 import github
 import typer
 import yaml
-from github import Github, Repository, Workflow, WorkflowRun  # noqa: F401  # Workflow is used
+from github import Repository, Workflow, WorkflowRun  # noqa: F401  # Workflow is used
+from journal import COMPLETED, DISPATCHED, RUN_FOUND, ReleaseJournal
+from run_tracker import RunTracker, get_runs_created_since, run_matches_dispatch
+from scheduler import DEFAULT_RUN_DURATION, DispatchGraph, expected_durations
+
+# The Github client is shared with the other scripts of this repo, in the parent directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from github_client import get_client  # noqa: E402
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,7 +41,9 @@ def get_workflow_from_repository(
 ) -> github.Workflow.Workflow:
     """Returns a workflow object from a repository.
 
-    Note that this authenticates by
+    Workflows are looked up through the GithubClient shared by everything using github_token, so
+    that its connections are reused and repeated lookups of the same workflow are answered from
+    its cache.
 
     Args:
         github_token: The github token to use for authentication.  Must have permission to
@@ -38,11 +55,9 @@ def get_workflow_from_repository(
     Returns:
         A github.Workflow object
     """
-    g = Github(login_or_token=github_token)
-    if not isinstance(repository, Repository.Repository):
-        repository = g.get_repo(repository)
-
-    return repository.get_workflow(workflow_name)
+    if isinstance(repository, Repository.Repository):
+        repository = repository.full_name
+    return get_client(github_token).get_workflow(repository, workflow_name)
 
 
 def execute_workflow_and_wait(
@@ -50,6 +65,12 @@ def execute_workflow_and_wait(
     repository: Union[str, github.Repository.Repository],
     workflow_name="release.yaml",
     inputs: dict = None,
+    timeout: Union[int, float] = 60,
+    wait_between_checks: Union[int, float] = 1,
+    run_tracker: Optional[RunTracker] = None,
+    dispatch_token_input: Optional[str] = None,
+    on_dispatched: Optional[Callable[[datetime, Optional[str]], None]] = None,
+    on_run_found: Optional[Callable[[WorkflowRun.WorkflowRun], None]] = None,
 ):
     """Executes a workflow and waits for it to complete.
 
@@ -60,12 +81,29 @@ def execute_workflow_and_wait(
                     a github.Repository object.
         workflow_name: The name of the workflow to execute, typically the filename of the workflow
         inputs: A dictionary of inputs to pass to the workflow
+        timeout: The maximum amount of time to wait for the workflow to complete, in seconds
+        wait_between_checks: The amount of time to wait between checks for the workflow to
+                             complete.  Ignored if run_tracker is set.
+        run_tracker: If set, the run is waited on through this shared RunTracker rather than by
+                     polling for it on our own
+        dispatch_token_input: If set, the name of a workflow input that is passed a unique token
+                              for this dispatch.  The workflow must include this input in its
+                              `run-name`, which lets us tell our run apart from any other run
+                              dispatched at the same time.
+        on_dispatched: If set, called with the execution time and dispatch token (if any) once the
+                       workflow has been dispatched
+        on_run_found: If set, called with the run once the run created by our dispatch is found
     """
     # Name of the file in .github/workflows/ that we will execute.  This can also be the ID of the
     # workflow, but I don't know how to get that apart from first getting the name.
     workflow = get_workflow_from_repository(github_token, repository, workflow_name)
 
     ref = "main"
+    dispatch_token = None
+    if dispatch_token_input is not None:
+        dispatch_token = uuid.uuid4().hex
+        inputs = {**(inputs or {}), dispatch_token_input: dispatch_token}
+
     # Get a timestamp immediately before we execute the workflow, in UTC, for filtering out past
     # runs
     execution_time = datetime.utcnow()
@@ -78,14 +116,77 @@ def execute_workflow_and_wait(
             "Workflow dispatch failed.  This could be due to an incorrect input or workflow name,"
             " or some other error.  By default, PyGithub package used to create the dispatch does"
             " not provide any information about the failure, but you can enable their debug "
-            "logging by running with the flag --github_debug_logging."
+            "logging by running with the flag --github_debug_logging.",
+            run=None,
         )
     logging.info(result)
-    run = wait_for_recent_workflow_run_completion(workflow, execution_time)
+    if on_dispatched is not None:
+        on_dispatched(execution_time, dispatch_token)
+
+    return wait_for_workflow_run(
+        workflow,
+        execution_time,
+        timeout=timeout,
+        wait_between_checks=wait_between_checks,
+        run_tracker=run_tracker,
+        branch=ref,
+        dispatch_token=dispatch_token,
+        on_run_found=on_run_found,
+    )
+
+
+def wait_for_workflow_run(
+    workflow: github.Workflow.Workflow,
+    execution_time: datetime,
+    timeout: Union[int, float] = 60,
+    wait_between_checks: Union[int, float] = 1,
+    run_tracker: Optional[RunTracker] = None,
+    branch: Optional[str] = None,
+    dispatch_token: Optional[str] = None,
+    run_id: Optional[int] = None,
+    on_run_found: Optional[Callable[[WorkflowRun.WorkflowRun], None]] = None,
+) -> WorkflowRun.WorkflowRun:
+    """Waits for the run of a dispatched workflow to complete, raising if it did not succeed.
+
+    Args:
+        workflow: The workflow that was dispatched
+        execution_time: Timestamp immediately before the workflow was dispatched, in UTC
+        timeout: The maximum amount of time to wait for the workflow to complete, in seconds
+        wait_between_checks: The amount of time to wait between checks for the workflow to
+                             complete.  Ignored if run_tracker is set.
+        run_tracker: If set, the run is waited on through this shared RunTracker rather than by
+                     polling for it on our own
+        branch: If set, only runs on this branch are considered.  Ignored if run_tracker is set.
+        dispatch_token: If set, only runs whose title includes this token are considered
+        run_id: If set, only the run with this id is considered.  This is used to reattach to a
+                run we already found before.
+        on_run_found: If set, called with the run once it is found
+    """
+    if run_tracker is not None:
+        run = wait_for_tracked_run_completion(
+            run_tracker,
+            workflow,
+            execution_time,
+            timeout,
+            dispatch_token=dispatch_token,
+            run_id=run_id,
+            on_run_found=on_run_found,
+        )
+    else:
+        run = wait_for_recent_workflow_run_completion(
+            workflow,
+            execution_time,
+            timeout=timeout,
+            wait_between_checks=wait_between_checks,
+            branch=branch,
+            dispatch_token=dispatch_token,
+            run_id=run_id,
+            on_run_found=on_run_found,
+        )
 
     if run.conclusion != "success":
         raise RunFailedError(
-            f"Workflow {workflow_name} failed with conclusion {run.conclusion}", run=run
+            f"Workflow {workflow.name} failed with conclusion {run.conclusion}", run=run
         )
     else:
         return run
@@ -114,7 +215,7 @@ class RunFailedError(Exception):
     This exception can optionally include a github.WorkflowRun object.
     """
 
-    def __init__(self, *args, run: WorkflowRun.WorkflowRun, **kwargs):
+    def __init__(self, *args, run: Optional[WorkflowRun.WorkflowRun], **kwargs):
         super().__init__(*args, **kwargs)
         self.run = run
 
@@ -131,15 +232,33 @@ class RunTimeoutError(Exception):
 
 
 def get_recent_run(
-    workflow: github.Workflow, execution_time: datetime
+    workflow: github.Workflow,
+    execution_time: datetime,
+    branch: Optional[str] = None,
+    dispatch_token: Optional[str] = None,
+    run_id: Optional[int] = None,
 ) -> github.WorkflowRun.WorkflowRun:
     """Returns the run that was executed after execution_time.
 
+    Only the workflow_dispatch runs created since execution_time (and on branch, if set) are
+    requested from the Github API.  They are listed newest first and lazily, page by page, so we
+    stop reading as soon as we reach a run that is older than execution_time.
+
+    If dispatch_token is set, only runs whose title includes the token are considered.  See
+    execute_workflow_and_wait's dispatch_token_input.  If run_id is set, only the run with this
+    id is considered.
+
     Raises if:
     * NoRunsFoundError: There were no runs found since execution time
     * TooManyRunsFoundError: there has been more than one run since execution_time.
     """
-    runs = list(filter(lambda run: run.created_at > execution_time, workflow.get_runs()))
+    runs = []
+    for run in get_runs_created_since(workflow, execution_time, branch=branch):
+        if run.created_at <= execution_time:
+            break
+        if run_matches_dispatch(run, dispatch_token, run_id=run_id):
+            runs.append(run)
+
     if len(runs) == 0:
         raise NoRunsFoundError("No runs found since execution time.")
     elif len(runs) > 1:
@@ -153,6 +272,10 @@ def wait_for_recent_workflow_run_completion(
     execution_time: datetime,
     timeout: Union[int, float] = 60,
     wait_between_checks: Union[int, float] = 1,
+    branch: Optional[str] = None,
+    dispatch_token: Optional[str] = None,
+    run_id: Optional[int] = None,
+    on_run_found: Optional[Callable[[WorkflowRun.WorkflowRun], None]] = None,
 ) -> github.WorkflowRun:
     """Waits for a recent workflow run to complete
 
@@ -168,6 +291,10 @@ def wait_for_recent_workflow_run_completion(
         timeout: The maximum amount of time to wait for the workflow to complete, in seconds
         wait_between_checks: The amount of time to wait between checks for the workflow to
                              complete
+        branch: If set, only runs on this branch are considered
+        dispatch_token: If set, only runs whose title includes this token are considered
+        run_id: If set, only the run with this id is considered
+        on_run_found: If set, called with the run once it is found
 
     Exceptions:
         RunTimeoutException: Raised if the workflow run is not found during the allowed timeout,
@@ -190,8 +317,16 @@ def wait_for_recent_workflow_run_completion(
         # If we haven't found the run yet, look for it.  Else, keep using the same one
         if run is None:
             try:
-                run = get_recent_run(workflow=workflow, execution_time=execution_time)
+                run = get_recent_run(
+                    workflow=workflow,
+                    execution_time=execution_time,
+                    branch=branch,
+                    dispatch_token=dispatch_token,
+                    run_id=run_id,
+                )
                 logger.info(f"Found workflow run with url: {run.html_url}")
+                if on_run_found is not None:
+                    on_run_found(run)
             except NoRunsFoundError:
                 logger.info(
                     f"No runs found yet.  Sleeping {wait_between_checks} seconds and retrying."
@@ -203,6 +338,8 @@ def wait_for_recent_workflow_run_completion(
                     f"Found more than one run since execution_time {execution_time}: got runs "
                     f"{err.runs}"
                 )
+                sleep(wait_between_checks)
+                continue
         else:
             logger.info("Updating workflow run's data")
             run.update()
@@ -224,6 +361,63 @@ def wait_for_recent_workflow_run_completion(
         raise RunTimeoutError(msg, run=run)
 
 
+def wait_for_tracked_run_completion(
+    run_tracker: RunTracker,
+    workflow: github.Workflow,
+    execution_time: datetime,
+    timeout: Union[int, float] = 60,
+    dispatch_token: Optional[str] = None,
+    run_id: Optional[int] = None,
+    on_run_found: Optional[Callable[[WorkflowRun.WorkflowRun], None]] = None,
+) -> github.WorkflowRun:
+    """Waits for a recent workflow run to complete, using a shared RunTracker
+
+    This behaves like wait_for_recent_workflow_run_completion, except that the run is found and
+    checked on by the run_tracker, which batches the checks of all the runs it tracks.
+
+    Args:
+        run_tracker: The RunTracker checking on the run
+        workflow: The workflow from which we want to wait the most recent run
+        execution_time: Timestamp immediately before the workflow run was started, in UTC. This is
+                        used to filter out past runs.
+        timeout: The maximum amount of time to wait for the workflow to complete, in seconds
+        dispatch_token: If set, only runs whose title includes this token are considered
+        run_id: If set, only the run with this id is considered
+        on_run_found: If set, called with the run once it is found, from the tracker's thread
+
+    Exceptions:
+        RunTimeoutException: Raised if the workflow run is not found during the allowed timeout,
+                             or if it is found but not completed.  If the workflow run is found,
+                             it will be included in the `exception.run` attribute.
+
+    Returns:
+        The workflow run that was executed after execution_time.
+    """
+    logger.info(f"Looking for run of workflow '{workflow.name}' at url {workflow.url}")
+    tracked_run = run_tracker.track(
+        workflow,
+        execution_time,
+        dispatch_token=dispatch_token,
+        run_id=run_id,
+        on_run_found=on_run_found,
+    )
+    try:
+        completed = tracked_run.wait(timeout)
+    finally:
+        run_tracker.untrack(tracked_run)
+
+    if completed:
+        return tracked_run.run
+    elif tracked_run.run is None:
+        msg = "Timed out without finding a recent run for workflow"
+        logger.error(msg)
+        raise RunTimeoutError(msg)
+    else:
+        msg = "Timed out waiting for workflow to complete"
+        logger.error(msg)
+        raise RunTimeoutError(msg, run=tracked_run.run)
+
+
 def get_github_token(dry_run: bool, github_pat_environment_variable: str = "GITHUB_PAT"):
     """Returns the Github token to use for authentication."""
     if dry_run:
@@ -239,6 +433,344 @@ def get_github_token(dry_run: bool, github_pat_environment_variable: str = "GITH
     return github_token
 
 
+# Outcomes recorded in a DispatchResult
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+SKIPPED = "skipped"
+
+
+@dataclass
+class DispatchResult:
+    """The outcome of executing one workflow dispatch from a dispatch manifest.
+
+    Attributes:
+        dispatch: The dispatch manifest entry that was executed
+        outcome: One of SUCCEEDED, FAILED, TIMED_OUT or SKIPPED
+        run: The github.WorkflowRun tracked for this dispatch, if one was found
+        message: Details about the outcome, typically the error raised for failed dispatches
+        run_url: The html url of the run, if one was found.  Defaults to the url of run.
+    """
+
+    dispatch: dict
+    outcome: str
+    run: Optional[WorkflowRun.WorkflowRun] = None
+    message: str = ""
+    run_url: Optional[str] = None
+
+    def __post_init__(self):
+        """Defaults run_url to the url of run"""
+        if self.run_url is None and self.run is not None:
+            self.run_url = self.run.html_url
+
+
+def execute_dispatch(
+    dispatch: dict,
+    github_token: str,
+    timeout: Union[int, float] = 60,
+    wait_between_checks: Union[int, float] = 1,
+    run_tracker: Optional[RunTracker] = None,
+    dispatch_token_input: Optional[str] = None,
+    journal: Optional[ReleaseJournal] = None,
+) -> DispatchResult:
+    """Executes a dispatch manifest entry, waits on it, and returns its DispatchResult.
+
+    This never raises for failed or timed out runs.  Those are reported through the outcome of
+    the returned DispatchResult instead, so that one bad dispatch does not stop a batch.
+
+    If a journal is given, the progress of the dispatch is recorded in it, and what was recorded
+    by previous executions is used to resume where they left off:
+    * dispatches that already succeeded are skipped
+    * dispatches whose run was still in progress (or not found yet) are reattached to, by run id
+      if we know it
+    * dispatches that failed, or timed out without us ever finding their run, are executed again
+    """
+    previous = journal.get(dispatch) if journal is not None else None
+    if previous is not None and previous.get("outcome") == SUCCEEDED:
+        logger.info(
+            f"Skipping workflow {dispatch['workflow_name']} in repository "
+            f"{dispatch['repository']}: it already succeeded in a previous execution"
+        )
+        return DispatchResult(
+            dispatch=dispatch,
+            outcome=SUCCEEDED,
+            message="Already succeeded in a previous execution",
+            run_url=previous.get("html_url"),
+        )
+
+    try:
+        run = _execute_or_reattach(
+            dispatch,
+            github_token,
+            previous,
+            journal,
+            timeout=timeout,
+            wait_between_checks=wait_between_checks,
+            run_tracker=run_tracker,
+            dispatch_token_input=dispatch_token_input,
+        )
+        result = DispatchResult(dispatch=dispatch, outcome=SUCCEEDED, run=run)
+    except RunFailedError as e:
+        result = DispatchResult(dispatch=dispatch, outcome=FAILED, run=e.run, message=str(e))
+    except RunTimeoutError as e:
+        result = DispatchResult(dispatch=dispatch, outcome=TIMED_OUT, run=e.run, message=str(e))
+    except github.GithubException as e:
+        result = DispatchResult(dispatch=dispatch, outcome=FAILED, message=str(e))
+    except Exception as e:
+        # Any other error, like a network error or a bug, only fails this dispatch
+        logger.exception(
+            f"Unexpected error executing workflow {dispatch['workflow_name']} in repository "
+            f"{dispatch['repository']}"
+        )
+        result = DispatchResult(
+            dispatch=dispatch, outcome=FAILED, message=f"{type(e).__name__}: {e}"
+        )
+
+    if journal is not None:
+        journal.record(
+            dispatch,
+            COMPLETED,
+            outcome=result.outcome,
+            message=result.message,
+            **_describe_run(result.run),
+        )
+    return result
+
+
+def _can_reattach(previous: Optional[dict]) -> bool:
+    """Returns True if a journaled attempt at a dispatch may still have a run to wait on"""
+    if previous is None or previous.get("outcome") == FAILED:
+        return False
+    if previous["event"] in (DISPATCHED, RUN_FOUND):
+        # We were interrupted while waiting on the run
+        return True
+    # We timed out waiting on it, but the run itself may still be going
+    return previous.get("outcome") == TIMED_OUT and previous.get("run_id") is not None
+
+
+def _describe_run(run: Optional[WorkflowRun.WorkflowRun]) -> dict:
+    """Returns the details of a run that we record in the journal"""
+    if run is None:
+        return {}
+    return {
+        "run_id": run.id,
+        "html_url": run.html_url,
+        "status": run.status,
+        "conclusion": run.conclusion,
+    }
+
+
+def _journal_callbacks(journal: Optional[ReleaseJournal], dispatch: dict) -> Tuple:
+    """Returns on_dispatched and on_run_found callbacks that record events in the journal"""
+    if journal is None:
+        return None, None
+
+    def on_dispatched(execution_time: datetime, dispatch_token: Optional[str]):
+        """Records that we dispatched the workflow"""
+        journal.record(
+            dispatch, DISPATCHED, execution_time=execution_time, dispatch_token=dispatch_token
+        )
+
+    def on_run_found(run: WorkflowRun.WorkflowRun):
+        """Records that we found the run of this dispatch"""
+        journal.record(dispatch, RUN_FOUND, **_describe_run(run))
+
+    return on_dispatched, on_run_found
+
+
+def _execute_or_reattach(
+    dispatch: dict,
+    github_token: str,
+    previous: Optional[dict],
+    journal: Optional[ReleaseJournal],
+    **kwargs,
+) -> WorkflowRun.WorkflowRun:
+    """Executes a dispatch and waits on its run, or reattaches to the run of a previous attempt"""
+    dispatch_token_input = kwargs.pop("dispatch_token_input")
+    on_dispatched, on_run_found = _journal_callbacks(journal, dispatch)
+
+    if _can_reattach(previous):
+        logger.info(
+            f"Reattaching to the run of workflow {dispatch['workflow_name']} in repository "
+            f"{dispatch['repository']} dispatched at {previous['execution_time']}"
+        )
+        workflow = get_workflow_from_repository(
+            github_token, dispatch["repository"], dispatch["workflow_name"]
+        )
+        return wait_for_workflow_run(
+            workflow,
+            datetime.fromisoformat(previous["execution_time"]),
+            dispatch_token=previous.get("dispatch_token"),
+            run_id=previous.get("run_id"),
+            on_run_found=on_run_found,
+            **kwargs,
+        )
+
+    return execute_workflow_and_wait(
+        github_token=github_token,
+        repository=dispatch["repository"],
+        workflow_name=dispatch["workflow_name"],
+        inputs=dispatch["inputs"],
+        dispatch_token_input=dispatch_token_input,
+        on_dispatched=on_dispatched,
+        on_run_found=on_run_found,
+        **kwargs,
+    )
+
+
+def dispatch_workflows(
+    dispatches: List[dict],
+    execute: Callable[[dict], DispatchResult],
+    max_concurrency: int = 1,
+) -> List[DispatchResult]:
+    """Executes many dispatches at once, returning their DispatchResults in manifest order.
+
+    Up to max_concurrency dispatches are executed at the same time, each in its own worker
+    thread.  Dispatches targeting the same repository are never executed at the same time: they
+    run one after the other.  This avoids two runs of the same workflow racing each other, which
+    would also make them indistinguishable when we look for the run created by our dispatch.
+
+    Dispatches can depend on each other through the optional `id` and `depends_on` keys of the
+    manifest (see DispatchGraph).  A dispatch is only executed once all the dispatches it depends
+    on succeeded, and is SKIPPED if any of them did not.  Among the dispatches that are ready,
+    those with a higher `priority` are started first, then those earlier in the manifest.
+
+    Args:
+        dispatches: The dispatch manifest entries to execute
+        execute: Callable that executes a single dispatch, waits for it and returns its
+                 DispatchResult, for example a partial of execute_dispatch
+        max_concurrency: The maximum number of dispatches executed at the same time
+
+    Raises:
+        ValueError: if max_concurrency is less than 1, or the dependencies between dispatches are
+                    invalid
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+    graph = DispatchGraph(dispatches)
+
+    results = [None] * len(dispatches)
+    pending = list(graph.order)
+    busy_repositories = set()
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        while pending or in_flight:
+            # Start every pending dispatch we can, in order, skipping those whose repository
+            # already has a dispatch in flight or whose dependencies have not succeeded yet
+            for index in list(pending):
+                if len(in_flight) >= max_concurrency:
+                    break
+                skipped = _skipped_result(graph, index, results)
+                if skipped is not None:
+                    # A dependency did not succeed, so this dispatch never will be ready
+                    pending.remove(index)
+                    results[index] = skipped
+                    continue
+                repository = dispatches[index]["repository"]
+                if repository in busy_repositories or not _dependencies_done(
+                    graph, index, results
+                ):
+                    continue
+                logger.info(
+                    f"Starting dispatch of workflow {dispatches[index]['workflow_name']} in "
+                    f"repository {repository}"
+                )
+                pending.remove(index)
+                busy_repositories.add(repository)
+                in_flight[executor.submit(execute, dispatches[index])] = index
+
+            if not in_flight:
+                # Everything left was skipped
+                continue
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                busy_repositories.discard(dispatches[index]["repository"])
+                results[index] = future.result()
+                logger.info(
+                    f"Dispatch of workflow {dispatches[index]['workflow_name']} in repository "
+                    f"{dispatches[index]['repository']} {results[index].outcome}"
+                )
+
+    return results
+
+
+def _dependencies_done(graph: DispatchGraph, index: int, results: List[DispatchResult]) -> bool:
+    """Returns True if every dispatch the dispatch at index depends on has a result"""
+    return all(results[dependency] is not None for dependency in graph.dependencies[index])
+
+
+def _skipped_result(
+    graph: DispatchGraph, index: int, results: List[DispatchResult]
+) -> Optional[DispatchResult]:
+    """Returns a SKIPPED DispatchResult if a dependency of the dispatch at index did not succeed"""
+    for dependency in sorted(graph.dependencies[index]):
+        if results[dependency] is not None and results[dependency].outcome != SUCCEEDED:
+            logger.warning(
+                f"Skipping dispatch {graph.describe(index)} because its dependency "
+                f"{graph.describe(dependency)} {results[dependency].outcome}"
+            )
+            return DispatchResult(
+                dispatch=graph.dispatches[index],
+                outcome=SKIPPED,
+                message=f"Dependency {graph.describe(dependency)} "
+                f"{results[dependency].outcome}",
+            )
+    return None
+
+
+def format_results_table(results: List[DispatchResult]) -> str:
+    """Returns a plain text table summarising the outcome of each dispatch"""
+    header = ("REPOSITORY", "WORKFLOW", "INPUTS", "OUTCOME", "RUN")
+    rows = [
+        (
+            result.dispatch["repository"],
+            result.dispatch["workflow_name"],
+            " ".join(f"{key}={value}" for key, value in result.dispatch["inputs"].items()),
+            result.outcome,
+            result.run_url or "-",
+        )
+        for result in results
+    ]
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    lines = ["  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)) for row in rows]
+    lines.insert(0, "  ".join(cell.ljust(width) for cell, width in zip(header, widths)))
+
+    succeeded = sum(result.outcome == SUCCEEDED for result in results)
+    lines.append(f"\n{succeeded}/{len(results)} dispatches succeeded")
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def log_schedule(
+    graph: DispatchGraph,
+    history: List[dict],
+    max_concurrency: int,
+    default_run_duration: float = DEFAULT_RUN_DURATION,
+):
+    """Logs the critical path of a dispatch manifest and how long executing it should take.
+
+    Args:
+        graph: The DispatchGraph of the dispatch manifest
+        history: The records of a ReleaseJournal, used to estimate the duration of each dispatch
+        max_concurrency: The maximum number of dispatches executed at the same time
+        default_run_duration: The duration assumed for dispatches with no history, in seconds
+    """
+    durations = expected_durations(graph.dispatches, history, default_run_duration)
+    length, path = graph.critical_path(durations)
+    logger.info(
+        f"Critical path of {len(path)} dispatches takes an estimated {timedelta(seconds=round(length))}: "
+        + " -> ".join(graph.describe(index) for index in path)
+    )
+    estimate = graph.estimate_completion(durations, max_concurrency)
+    logger.info(
+        f"Executing {len(graph.dispatches)} dispatches with max_concurrency={max_concurrency} "
+        f"should take about {timedelta(seconds=round(estimate))}, completing around "
+        f"{(datetime.now() + timedelta(seconds=estimate)).strftime('%Y-%m-%d %H:%M:%S')}"
+    )
+
+
 def main(
     dispatch_manifest: str = typer.Argument(
         ...,
@@ -263,6 +795,47 @@ def main(
         "Token to use for authentication.  This token required for all execution except"
         "dry runs.",
     ),
+    max_concurrency: int = typer.Option(
+        default=1,
+        min=1,
+        help="The maximum number of workflow dispatches to execute and wait on at the same time."
+        "  Dispatches to the same repository are always executed one at a time, in manifest "
+        "order.",
+    ),
+    timeout: float = typer.Option(
+        default=60,
+        help="The maximum amount of time to wait for each workflow run to complete, in seconds",
+    ),
+    wait_between_checks: float = typer.Option(
+        default=1,
+        help="The amount of time to wait between checks for a workflow run to complete, in "
+        "seconds",
+    ),
+    max_wait_between_checks: float = typer.Option(
+        default=60,
+        help="The maximum amount of time to wait between checks for a long-running workflow run "
+        "to complete, in seconds.  Checks on runs that have been in progress for a while are "
+        "backed off exponentially up to this value.",
+    ),
+    journal_file: Optional[str] = typer.Option(
+        default=None,
+        help="If set, path to a journal file recording the progress of every dispatch.  If the "
+        "dispatcher is executed again with the same journal, dispatches that already succeeded "
+        "are skipped, runs still in progress are waited on rather than dispatched again, and "
+        "only failed dispatches are retried.",
+    ),
+    dispatch_token_input: Optional[str] = typer.Option(
+        default=None,
+        help="If set, the name of a workflow input that each dispatch passes a unique token to."
+        "  The dispatched workflows must declare this input and include it in their `run-name`, "
+        "which lets us find the run created by our dispatch even if someone else dispatched the "
+        "same workflow at the same time.",
+    ),
+    default_run_duration: float = typer.Option(
+        default=DEFAULT_RUN_DURATION,
+        help="The duration, in seconds, assumed for workflow runs that the journal has no "
+        "history for, when estimating how long the release will take",
+    ),
 ):
     r"""Triggers one or more Github workflow dispatch runs
 
@@ -283,7 +856,12 @@ def main(
           inputs:\n
             another-input: "123"\n
 
-    Each dispatch is executed in series and waited on until it completes.
+    Each dispatch is executed and waited on until it completes.  Up to max_concurrency dispatches
+    are executed at once, and a table of the outcome of every dispatch is printed at the end.
+
+    Entries can optionally have an `id`, a list of ids they `depends_on`, and an integer
+    `priority`.  An entry is only executed once every entry it depends on succeeded, and ready
+    entries with a higher priority are executed first.
     """
     if github_debug_logging:
         github.enable_console_debug_logging()
@@ -294,26 +872,59 @@ def main(
 
     with open(dispatch_manifest) as f:
         workflows_to_execute = yaml.safe_load(f)
+    # Validate the dependencies between dispatches before executing any of them
+    graph = DispatchGraph(workflows_to_execute)
 
-    for workflow in workflows_to_execute:
-        if dry_run:
+    if dry_run:
+        history = []
+        if journal_file is not None and os.path.exists(journal_file):
+            with ReleaseJournal(journal_file) as journal:
+                history = journal.history()
+        log_schedule(graph, history, max_concurrency, default_run_duration)
+        for index in graph.order:
+            workflow = workflows_to_execute[index]
             logger.info(
                 f"Dry run: would execute workflow {workflow['workflow_name']} in repository "
                 f"{workflow['repository']} with inputs {workflow['inputs']}"
             )
-        else:
-            try:
-                execute_workflow_and_wait(
-                    github_token=github_token,
-                    repository=workflow["repository"],
-                    workflow_name=workflow["workflow_name"],
-                    inputs=workflow["inputs"],
-                )
-            except RunTimeoutError as e:
-                logger.info(
-                    f"Workflow run for {workflow['workflow_name']} in repository "
-                    f"{workflow['repository']} timed out with message: {e.message}"
-                )
+        return
+
+    # All in-flight runs are checked on by a single shared poller, which batches its calls to the
+    # Github API per workflow rather than polling each run separately
+    with ExitStack() as stack:
+        run_tracker = stack.enter_context(
+            RunTracker(
+                wait_between_checks=wait_between_checks,
+                max_wait_between_checks=max_wait_between_checks,
+            )
+        )
+        journal = None
+        if journal_file is not None:
+            journal = stack.enter_context(ReleaseJournal(journal_file))
+        log_schedule(
+            graph,
+            journal.history() if journal is not None else [],
+            max_concurrency,
+            default_run_duration,
+        )
+
+        results = dispatch_workflows(
+            workflows_to_execute,
+            execute=partial(
+                execute_dispatch,
+                github_token=github_token,
+                timeout=timeout,
+                run_tracker=run_tracker,
+                dispatch_token_input=dispatch_token_input,
+                journal=journal,
+            ),
+            max_concurrency=max_concurrency,
+        )
+    print(format_results_table(results))
+    logger.info(f"Issued {run_tracker.api_calls} Github API calls to check on workflow runs")
+
+    if any(result.outcome != SUCCEEDED for result in results):
+        raise typer.Exit(code=1)
 
 
 if __name__ == "__main__":
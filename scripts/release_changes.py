@@ -0,0 +1,65 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Detection of the release bundle files changed between two git revisions."""
+
+import os
+import subprocess
+import tempfile
+from typing import Iterator, Optional
+
+RELEASE_DIR_NAME = "releases"
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# How many bytes of `git diff-tree` output to read at a time
+READ_SIZE = 64 * 1024
+
+
+def iter_changed_files(base: str, head: str, repo_path: str = REPO_ROOT) -> Iterator[str]:
+    """Yield the path of every file changed between the base and head revisions.
+
+    This compares the trees of base and head, so every change made by any of the commits between
+    them is seen, including those brought in by merge commits.  The output of `git diff-tree` is
+    streamed NUL separated, so paths are yielded as git finds them and may contain any character.
+
+    Raises:
+        subprocess.CalledProcessError: if git fails, for example because a revision is unknown
+    """
+    command = ["git", "diff-tree", "-r", "-z", "--name-only", "--no-commit-id", base, head]
+    # stderr goes to a file rather than a pipe: git would block once it filled a pipe we only
+    # read after stdout, and never close stdout
+    with tempfile.TemporaryFile() as stderr_file:
+        with subprocess.Popen(
+            command, cwd=repo_path, stdout=subprocess.PIPE, stderr=stderr_file
+        ) as process:
+            pending = b""
+            for chunk in iter(lambda: process.stdout.read(READ_SIZE), b""):
+                *paths, pending = (pending + chunk).split(b"\0")
+                for path in paths:
+                    yield os.fsdecode(path)
+            if pending:
+                yield os.fsdecode(pending)
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(
+                process.returncode, command, stderr=stderr_file.read()
+            )
+
+
+def is_release_file(path: str) -> bool:
+    """Return True for the bundle files of a release, which are `releases/<release>/<file>.yaml`"""
+    parts = path.split("/")
+    return len(parts) == 3 and parts[0] == RELEASE_DIR_NAME and parts[2].endswith(".yaml")
+
+
+def iter_changed_release_files(base: str, head: str, repo_path: str = REPO_ROOT) -> Iterator[str]:
+    """Yield the path of every release bundle file changed between the base and head revisions"""
+    return (path for path in iter_changed_files(base, head, repo_path) if is_release_file(path))
+
+
+def read_file_at(revision: str, path: str, repo_path: str = REPO_ROOT) -> Optional[str]:
+    """Return the content of a file at a revision, or None if it does not exist there"""
+    result = subprocess.run(
+        ["git", "show", f"{revision}:{path}"], cwd=repo_path, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout
@@ -3,12 +3,31 @@
 """Helper to work with Juju bundles, preserving comments in the YAML"""
 
 import copy
+import sys
 from pathlib import Path
-from typing import Optional
+from types import MappingProxyType
+from typing import Mapping, Optional
 
-from deepdiff import DeepDiff
+import yaml as pyyaml
 from ruamel.yaml import YAML
 
+# The bundle diff is shared with the other scripts of this repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bundle_diff import BundleDiff, diff_bundles  # noqa: E402
+
+# The libyaml based loader is much faster, but PyYAML is not always built with it
+FAST_LOADER = getattr(pyyaml, "CSafeLoader", pyyaml.SafeLoader)
+
+
+def freeze(value):
+    """Return a read-only copy of nested dicts and lists, as read-only mappings and tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
 
 class Bundle:
     """Juju bundle loader/dumper.
@@ -16,11 +35,18 @@ class Bundle:
     This class uses ruamel.yaml instead of the typical pyyaml in order to preserve all comments,
     the order of the yaml, etc.  This way we can load/dump a yaml with comments without losing them
     or reordering the items.
+
+    Round-trip loading is several times slower than a plain load though, so with `read_only` the
+    bundle is first loaded with PyYAML's libyaml based loader instead, and `applications` is a
+    read-only copy of it, down to the options of each application, with lists as tuples.  The
+    bundle is reloaded in round-trip mode the first time its data is asked for in a mutable
+    form, by to_dict or dump.
     """
 
-    def __init__(self, filename: Optional[str] = None):
+    def __init__(self, filename: Optional[str] = None, read_only: bool = False):
         self._filename = filename
         self._data = None
+        self._round_trip = not read_only
         if self._filename:
             self.load_bundle()
 
@@ -29,9 +55,9 @@ class Bundle:
         newbundle = copy.deepcopy(self)
         return newbundle
 
-    def diff(self, other):
-        """Returns a diff between this and another object, in DeepDiff format"""
-        return DeepDiff(self._data, other._data, ignore_order=True)
+    def diff(self, other) -> BundleDiff:
+        """Returns the differences between this and another bundle, see diff_bundles"""
+        return diff_bundles(self._data or {}, other._data or {})
 
     def dump(self, filename: str):
         """Dumps as yaml to a file"""
@@ -41,18 +67,34 @@ class Bundle:
 
     def load_bundle(self):
         """Loads a YAML file as a bundle"""
-        yaml = YAML(typ="rt")
-        self._data = yaml.load(Path(self._filename).read_text())
+        text = Path(self._filename).read_text()
+        if self._round_trip:
+            yaml = YAML(typ="rt")
+            self._data = yaml.load(text)
+        else:
+            self._data = pyyaml.load(text, Loader=FAST_LOADER)
+
+    @property
+    def read_only(self) -> bool:
+        """Whether the bundle is still loaded in the fast, read-only mode"""
+        return not self._round_trip
 
     def to_dict(self):
-        """Returns bundle as a dictionary"""
+        """Returns bundle as a dictionary, reloading it in round-trip mode if needed"""
+        if not self._round_trip:
+            self._round_trip = True
+            if self._filename:
+                self.load_bundle()
         return self._data
 
     def __eq__(self, other):
         """Compares self to another bundle"""
-        return self._filename == other._filename and self.diff(other) == {}
+        return self._filename == other._filename and not self.diff(other)
 
     @property
-    def applications(self):
-        """Returns the applications in the bundle"""
-        return self._data["applications"]
+    def applications(self) -> Mapping[str, Mapping]:
+        """Returns the applications in the bundle, read-only while the bundle is"""
+        applications = self._data["applications"]
+        if self._round_trip:
+            return applications
+        return freeze(applications)
@@ -0,0 +1,103 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Backend of Juju.info reading charm info straight from the Charmhub API"""
+
+from typing import List
+
+import requests
+from juju import BackendUnavailableError, InfoBackend, JujuFailedError
+from requests.adapters import HTTPAdapter
+
+CHARMHUB_API_URL = "https://api.charmhub.io"
+# Only the fields of the channel map are requested, which keeps responses small
+INFO_FIELDS = [
+    "channel-map.channel.name",
+    "channel-map.channel.track",
+    "channel-map.channel.risk",
+    "channel-map.channel.released-at",
+    "channel-map.revision.revision",
+    "channel-map.revision.version",
+]
+
+
+class CharmhubBackend(InfoBackend):
+    """Gets the info of charms from the Charmhub `info` endpoint.
+
+    Requests share a session, keeping up to `pool_size` connections to Charmhub alive so that
+    concurrent lookups do not each open a new connection.
+
+    Args:
+        api_url: The base url of the Charmhub API
+        pool_size: How many connections to keep open
+        timeout: How long, in seconds, to wait for Charmhub to answer
+    """
+
+    def __init__(
+        self, api_url: str = CHARMHUB_API_URL, pool_size: int = 10, timeout: float = 30.0
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def info(self, charm_name: str) -> dict:
+        """Returns the name and channel map of a charm, like `juju info --format yaml` would"""
+        try:
+            response = self.session.get(
+                f"{self.api_url}/v2/charms/info/{charm_name}",
+                params={"fields": ",".join(INFO_FIELDS)},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise BackendUnavailableError(
+                f"Failed to reach Charmhub: {e}", stderr=str(e), stdout=""
+            )
+        if response.status_code >= 500:
+            raise BackendUnavailableError(
+                f"Charmhub answered {response.status_code}", stderr="", stdout=response.text
+            )
+        if response.status_code != 200:
+            message = _error_message(response)
+            raise JujuFailedError(message, stderr=message, stdout=response.text)
+        return {
+            "name": charm_name,
+            "channel-map": channel_map_from_charmhub(response.json()["channel-map"]),
+        }
+
+
+def channel_map_from_charmhub(entries: List[dict]) -> dict:
+    """Returns the channel map of a Charmhub `info` response in the format of `juju info`.
+
+    Charmhub lists a channel once per base and architecture.  Like `juju info`, this keeps one
+    entry per channel, the one with the highest revision.  Unlike `juju info`, each entry also
+    lists the `revisions` of every base and architecture of the channel, in ascending order.
+    """
+    channel_map = {}
+    revisions = {}
+    for entry in entries:
+        channel, revision = entry["channel"], entry["revision"]
+        revisions.setdefault(channel["name"], set()).add(revision["revision"])
+        existing = channel_map.get(channel["name"])
+        if existing is not None and existing["revision"] >= revision["revision"]:
+            continue
+        channel_map[channel["name"]] = {
+            "released-at": channel.get("released-at"),
+            "track": channel["track"],
+            "risk": channel["risk"],
+            "revision": revision["revision"],
+            "version": revision.get("version"),
+        }
+    for name, channel in channel_map.items():
+        channel["revisions"] = sorted(revisions[name])
+    return channel_map
+
+
+def _error_message(response: requests.Response) -> str:
+    """Returns the error messages of a Charmhub response"""
+    try:
+        errors = response.json()["error-list"]
+        return " ".join(error["message"] for error in errors)
+    except (ValueError, KeyError, TypeError):
+        return f"Charmhub answered {response.status_code}"
@@ -0,0 +1,118 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""A local HTTP server standing in for the Charmhub `info` endpoint, for tests and benchmarks."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+INFO_PATH = "/v2/charms/info/"
+
+
+class CharmhubStub:
+    """A threaded HTTP server answering `info` requests for the charms it is given.
+
+    Args:
+        charms: The tracks of each charm, as {charm_name: [track]}.  Each track is published with
+                a stable and an edge channel, for two architectures.
+        latency: How long, in seconds, to wait before answering each request
+
+    Attributes:
+        url: The base url of the server, once started
+        requests: The path and parsed query of every request received
+        connections: The (host, port) of every connection opened to the server
+    """
+
+    def __init__(self, charms: Dict[str, List[str]], latency: float = 0.0):
+        self.charms = charms
+        self.latency = latency
+        self.requests = []
+        self.connections = set()
+        self.url = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    def channel_map(self, charm_name: str) -> List[dict]:
+        """Returns the channel map Charmhub would list for a charm"""
+        entries = []
+        for index, track in enumerate(self.charms[charm_name]):
+            for risk in ["stable", "edge"]:
+                for architecture in ["amd64", "arm64"]:
+                    revision = index * 10 + (2 if risk == "edge" else 1)
+                    entries.append(
+                        {
+                            "channel": {
+                                "name": f"{track}/{risk}",
+                                "track": track,
+                                "risk": risk,
+                                "released-at": "2023-01-01T00:00:00+00:00",
+                                "base": {"architecture": architecture},
+                            },
+                            "revision": {"revision": revision, "version": str(revision)},
+                        }
+                    )
+        return entries
+
+    def answer(self, path: str):
+        """Returns the status and body to answer a request with"""
+        time.sleep(self.latency)
+        url = urlparse(path)
+        with self._lock:
+            self.requests.append((url.path, parse_qs(url.query)))
+        charm_name = url.path.replace(INFO_PATH, "", 1)
+        if not url.path.startswith(INFO_PATH) or charm_name not in self.charms:
+            message = f"No charm or bundle with name '{charm_name}'."
+            return 404, {"error-list": [{"code": "not-found", "message": message}]}
+        return 200, {"name": charm_name, "channel-map": self.channel_map(charm_name)}
+
+    def start(self) -> "CharmhubStub":
+        """Starts serving on a free port of localhost"""
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler_class(self))
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops the server"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        """Starts the server"""
+        return self.start()
+
+    def __exit__(self, *args):
+        """Stops the server"""
+        self.stop()
+
+
+def _handler_class(stub: CharmhubStub):
+    """Returns a request handler class that answers requests through stub"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with stub._lock:
+                stub.connections.add(self.client_address)
+
+        def _handle(self):
+            status, payload = stub.answer(self.path)
+            content = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = _handle  # noqa: N815
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
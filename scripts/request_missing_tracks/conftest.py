@@ -0,0 +1,50 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from juju import Juju, JujuCliBackend
+
+# The tests use the charm cache shared by the scripts of this repo, like the scripts do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+FAKE_JUJU = """#!/usr/bin/env python3
+import sys
+import time
+
+time.sleep({delay})
+charm = sys.argv[2]
+sys.stderr.write("-" * {stderr_size})
+with open("{calls}", "a") as calls:
+    calls.write(charm + "\\n")
+if charm.startswith("missing"):
+    sys.stderr.write(f"ERROR: No charm or bundle with name '{{charm}}'.\\n")
+else:
+    print(f"name: {{charm}}")
+    print("channel-map:")
+    print(f"  {{charm}}/stable:")
+    print(f"    track: '{{charm}}'")
+    print("    risk: stable")
+"""
+
+
+@pytest.fixture()
+def fake_juju(tmp_path, monkeypatch):
+    """Puts a fake `juju` executable on the PATH, used by Juju.info.
+
+    The fake takes `delay` seconds to answer, and writes `stderr_size` bytes of noise to stderr.
+    Returns the path of a file listing the charm of each call.
+    """
+    monkeypatch.setattr(Juju, "backend", JujuCliBackend())
+
+    def install(delay: float = 0.0, stderr_size: int = 0):
+        juju = tmp_path / "juju"
+        calls = tmp_path / "calls"
+        juju.write_text(FAKE_JUJU.format(delay=delay, calls=calls, stderr_size=stderr_size))
+        juju.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+        return calls
+
+    return install
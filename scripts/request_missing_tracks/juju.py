@@ -1,22 +1,77 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
-"""Helper for shelling out to the Juju CLI"""
+"""Helper for shelling out to the Juju CLI, and the backends of Juju.info"""
 
+import logging
 from subprocess import PIPE, Popen
 
 from ruamel.yaml import YAML
 
+logger = logging.getLogger(__name__)
+
+
+class InfoBackend:
+    """Interface of the backends that Juju.info gets the info of charms from"""
+
+    def info(self, charm_name: str) -> dict:
+        """Returns the info of a charm, in the format of `juju info --format yaml`.
+
+        Raises:
+            JujuFailedError: if the charm's info cannot be found
+            BackendUnavailableError: if the backend itself cannot be used
+        """
+        raise NotImplementedError
+
+
+class JujuCliBackend(InfoBackend):
+    """Gets the info of charms from `juju info`"""
+
+    def info(self, charm_name: str) -> dict:
+        """Returns the info of a charm from `juju info`"""
+        stdout, stderr = Juju.juju("info", charm_name, "--format", "yaml", raise_on_stderr=False)
+        failure_message = "Failed to load valid yaml from `juju info`"
+        try:
+            yaml = YAML(typ="rt")
+            data_dict = yaml.load(stdout)
+        except Exception:  # TODO: This should be more specific
+            raise JujuFailedError(failure_message, stderr=stderr, stdout=stdout)
+
+        if not data_dict:
+            raise JujuFailedError(failure_message, stderr=stderr, stdout=stdout)
+
+        return data_dict
+
+
+class FallbackBackend(InfoBackend):
+    """Gets the info of charms from the first of its backends that is available"""
+
+    def __init__(self, *backends: InfoBackend):
+        self.backends = backends
+
+    def info(self, charm_name: str) -> dict:
+        """Returns the info of a charm from the first backend that is available"""
+        for backend in self.backends:
+            try:
+                return backend.info(charm_name)
+            except BackendUnavailableError as e:
+                logger.warning(f"{type(backend).__name__} unavailable, falling back: {e}")
+                error = e
+        raise error
+
 
 class Juju:
     """Helpers to interact with the Juju CLI"""
 
+    # Where Juju.info gets the info of charms from
+    backend: InfoBackend = JujuCliBackend()
+
     @staticmethod
     def juju(*args, raise_on_stderr: bool = False):
         """Executes `juju`"""
         cmd = ["juju"] + list(args)
         proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        stdout = proc.stdout.read().decode("utf-8")
-        stderr = proc.stderr.read().decode("utf-8")
+        # Reading both pipes at once, so that juju cannot block on a full stderr pipe
+        stdout, stderr = (output.decode("utf-8") for output in proc.communicate())
         if raise_on_stderr and stderr:
             raise ValueError(
                 f"failed to run juju command successfully.  Got this from stderr: {stderr}"
@@ -25,19 +80,8 @@ class Juju:
 
     @classmethod
     def info(cls, charm_name: str):
-        """Convenience function for `juju info`"""
-        stdout, stderr = cls.juju("info", charm_name, "--format", "yaml", raise_on_stderr=False)
-        failure_message = "Failed to load valid yaml from `juju info`"
-        try:
-            yaml = YAML(typ="rt")
-            data_dict = yaml.load(stdout)
-        except Exception:  # TODO: This should be more specific
-            raise JujuFailedError(failure_message, stderr=stderr, stdout=stdout)
-
-        if not data_dict:
-            raise JujuFailedError(failure_message, stderr=stderr, stdout=stdout)
-
-        return data_dict
+        """Convenience function for `juju info`, answered by Juju.backend"""
+        return cls.backend.info(charm_name)
 
 
 class JujuFailedError(Exception):
@@ -47,3 +91,7 @@ class JujuFailedError(Exception):
         super().__init__(str(msg))
         self.stderr = stderr
         self.stdout = stdout
+
+
+class BackendUnavailableError(JujuFailedError):
+    """Error raised when a backend cannot be used at all, rather than failing for one charm"""
@@ -4,18 +4,58 @@
 
 """Script for requesting missing tracks in a bundle"""
 
+import csv
+import glob
+import io
+import json
 import logging
-from typing import Dict
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import typer
-from bundle import Bundle
-from juju import Juju, JujuFailedError
+
+# The charm cache and the bundle diff are shared with the other scripts of this repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bundle import Bundle  # noqa: E402
+from charm_cache import DEFAULT_TTL, ChannelMapCache, get_channel_map_cache  # noqa: E402
+from charmhub import CharmhubBackend  # noqa: E402
+from juju import FallbackBackend, InfoBackend, Juju, JujuCliBackend, JujuFailedError  # noqa: E402
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 
+# How many `juju info` calls to run at the same time by default
+DEFAULT_CONCURRENCY = 8
+# Backends for getting the info of charms: Charmhub, falling back to the juju CLI, or the CLI only
+CHARMHUB_BACKEND = "charmhub"
+CLI_BACKEND = "cli"
+RISKS = ("stable", "candidate", "beta", "edge")
+# Formats of the report
+TEXT_FORMAT = "text"
+JSON_FORMAT = "json"
+CSV_FORMAT = "csv"
+
+
+def get_info_backend(name: str) -> InfoBackend:
+    """Returns the backend for getting the info of charms called name"""
+    if name == CHARMHUB_BACKEND:
+        return FallbackBackend(CharmhubBackend(pool_size=DEFAULT_CONCURRENCY), JujuCliBackend())
+    if name == CLI_BACKEND:
+        return JujuCliBackend()
+    raise ValueError(f"Unknown backend `{name}`, expected `{CHARMHUB_BACKEND}` or `{CLI_BACKEND}`")
 
-def get_charm_channel_map_for_applications(applications: Dict[str, dict]) -> Dict[str, dict]:
+
+def get_charm_channel_map_for_applications(
+    applications: Dict[str, dict],
+    concurrency: int = 1,
+    cache: Optional[ChannelMapCache] = None,
+    refresh: bool = False,
+) -> Dict[str, dict]:
     """Return a dict of {charm_name: charm_channel_map} for charms in a map of applications.
 
     The charm_channel_map returned is the channel_map key of the yaml returned for
@@ -51,60 +91,148 @@ def get_charm_channel_map_for_applications(applications: Dict[str, dict]) -> Dic
 
     Note that this returns {charm_name: charm_info}, not {application_name: charm_info}.  Multiple
     applications might deploy the same charm, and thus len(applications) >= len(returned).
+
+    With a concurrency above 1, up to that many `juju info` calls run at the same time.  Charms
+    that fail are left out, with a warning printed in the order of the applications either way.
+
+    With a cache, charms with a fresh cached channel map are not looked up, unless refresh is set,
+    and the channel maps looked up are stored in the cache.  Failures are not cached.
     """
     logger.debug("Getting charm channel map for applications")
-    charm_channel_map = {}
+    # The first application deploying each charm, in order.  Each charm is only looked up once
+    charm_applications = {}
     for name, application in applications.items():
         logger.debug(f"Processing application: {name}")
-        if application["charm"] not in charm_channel_map:
+        if application["charm"] not in charm_applications:
             logger.debug(
                 f"Getting info from juju application '{name}' that deploys charm {application['charm']}"
             )
-            try:
-                juju_info = Juju.info(application["charm"])
-                pass
-            except JujuFailedError as e:
-                print(
-                    f"WARNING: Failed getting info for application '{name}'.  "
-                    f"Does this charm exist?"
-                    f"\nGot stderr from Juju: {e.stderr}"
-                )
-                continue
-            charm_channel_map[application["charm"]] = juju_info["channel-map"]
+            charm_applications[application["charm"]] = name
         else:
             logger.debug(
                 f"Skipping application '{name}' that deploys charm "
                 f"'{application['charm']}' - charm alreaddy in map"
             )
 
+    cached = {}
+    if cache is not None and not refresh:
+        for charm in charm_applications:
+            channel_map = cache.get(charm)
+            if channel_map is not None:
+                logger.debug(f"Using cached channel map of charm '{charm}'")
+                cached[charm] = channel_map
+    results = _get_juju_infos(
+        [charm for charm in charm_applications if charm not in cached], concurrency
+    )
+
+    charm_channel_map = {}
+    for charm, name in charm_applications.items():
+        if charm in cached:
+            charm_channel_map[charm] = cached[charm]
+            continue
+        juju_info = results[charm]
+        if isinstance(juju_info, JujuFailedError):
+            print(
+                f"WARNING: Failed getting info for application '{name}'.  "
+                f"Does this charm exist?"
+                f"\nGot stderr from Juju: {juju_info.stderr}"
+            )
+            continue
+        charm_channel_map[charm] = juju_info["channel-map"]
+
+    if cache is not None:
+        cache.store(
+            {charm: charm_channel_map[charm] for charm in results if charm in charm_channel_map}
+        )
     return charm_channel_map
 
 
-def get_missing_tracks(applications: dict[str, dict], charm_channel_map: dict[str, dict]):
-    """Returns charm and track for applications that deploy charms from non-existent tracks.
+def _get_juju_infos(
+    charms: List[str], concurrency: int
+) -> Dict[str, Union[dict, JujuFailedError]]:
+    """Returns the `juju info` of charms, or the error raised getting it, concurrency at once"""
+    if concurrency > 1 and len(charms) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return dict(zip(charms, executor.map(_get_juju_info, charms)))
+    return {charm: _get_juju_info(charm) for charm in charms}
 
-    Silently ignores any charms that are in appliocations but not in charm_channel_map
+
+def _get_juju_info(charm: str) -> Union[dict, JujuFailedError]:
+    """Returns the `juju info` of a charm, or the error raised getting it"""
+    try:
+        return Juju.info(charm)
+    except JujuFailedError as e:
+        return e
+
+
+def split_channel(channel: str) -> Tuple[str, str]:
+    """Returns the (track, risk) of a channel, like juju reads them.
+
+    A risk alone is a risk of the `latest` track, and a track alone is its `stable` risk.  Any
+    branch after the risk is ignored.
     """
-    missing_tracks = {}
-    for name, application in applications.items():
+    parts = channel.split("/")
+    if len(parts) == 1:
+        return ("latest", parts[0]) if parts[0] in RISKS else (parts[0], "stable")
+    return parts[0], parts[1]
+
+
+def index_channel_maps(charm_channel_map: Dict[str, dict]) -> Dict[str, Dict[str, Set[str]]]:
+    """Returns the risks published in each track of each charm, as {charm: {track: {risk}}}"""
+    index = {}
+    for charm, channel_map in charm_channel_map.items():
+        tracks = index[charm] = {}
+        for channel in channel_map:
+            track, risk = split_channel(channel)
+            tracks.setdefault(track, set()).add(risk)
+    return index
+
+
+def get_missing_channels(
+    applications: Dict[str, dict], charm_channel_map: Dict[str, dict]
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Returns the missing tracks and missing risks of the channels deployed by applications.
+
+    The channel maps are indexed once, and each application's channel is then looked up exactly,
+    so that track `1.1` is not mistaken for `1.10`.  Returns
+        {charm: track} for charms deployed from a track that does not exist, and
+        {charm: channel} for charms deployed from a track that exists, but has no release in the
+        application's risk
+    Silently ignores any charms that are in applications but not in charm_channel_map
+    """
+    index = index_channel_maps(charm_channel_map)
+    missing_tracks, missing_risks = {}, {}
+    for application in applications.values():
         charm = application["charm"]
-        if charm not in charm_channel_map:
+        if charm not in index:
             # Skip if we do not have info on this charm
             logging.debug(f"No channel data found for charm {charm}.  Skipping this application")
             continue
 
-        # Get first channel that matches this applications track
-        application_track = application["channel"].split("/")[0]
-        try:
-            next(
-                channel
-                for channel in charm_channel_map[application["charm"]].keys()
-                if channel.startswith(application_track)
-            )
-        except StopIteration:
-            missing_tracks[application["charm"]] = application_track
+        track, risk = split_channel(application["channel"])
+        if track not in index[charm]:
+            missing_tracks[charm] = track
+        elif risk not in index[charm][track]:
+            missing_risks[charm] = f"{track}/{risk}"
 
-    return missing_tracks
+    return missing_tracks, missing_risks
+
+
+def get_missing_tracks(applications: dict[str, dict], charm_channel_map: dict[str, dict]):
+    """Returns charm and track for applications that deploy charms from non-existent tracks.
+
+    Silently ignores any charms that are in appliocations but not in charm_channel_map
+    """
+    return get_missing_channels(applications, charm_channel_map)[0]
+
+
+def print_missing_risk_summary(missing_risks: dict[str, str]):
+    """Prints the channels of a missing-risks dict, whose track exists but has no release"""
+    if missing_risks:
+        print("\nAt least one channel in the bundle has no release, though its track exists:\n")
+        print("\tCharm: Channel\n")
+        for charm, channel in missing_risks.items():
+            print(f"\t{charm}: {channel}")
 
 
 def print_missing_track_summary(missing_tracks: dict[str, str]):
@@ -125,19 +253,155 @@ def print_missing_track_summary(missing_tracks: dict[str, str]):
         print("All tracks are present")
 
 
+def find_bundle_files(paths: List[str]) -> List[str]:
+    """Returns the bundle files at paths, which may be files, directories or glob patterns.
+
+    Directories are searched recursively for `.yaml` files.  Files are returned sorted, once each.
+    """
+    bundle_files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            bundle_files.update(glob.glob(os.path.join(path, "**", "*.yaml"), recursive=True))
+        elif os.path.isfile(path):
+            bundle_files.add(path)
+        else:
+            bundle_files.update(glob.glob(path, recursive=True))
+    return sorted(bundle_files)
+
+
+def audit_bundles(
+    bundle_files: List[str], **fetch_options
+) -> Dict[str, Tuple[Dict[str, str], Dict[str, str]]]:
+    """Returns the missing tracks and missing risks of each bundle, see get_missing_channels.
+
+    The charms of every bundle are looked up together, so each charm's channel map is fetched
+    once however many bundles deploy it.  fetch_options are passed to
+    get_charm_channel_map_for_applications.
+    """
+    bundles = {bundle_file: Bundle(bundle_file, read_only=True) for bundle_file in bundle_files}
+    all_applications = {
+        f"{bundle_file}:{name}": application
+        for bundle_file, bundle in bundles.items()
+        for name, application in bundle.applications.items()
+    }
+    charm_channel_map = get_charm_channel_map_for_applications(all_applications, **fetch_options)
+    return {
+        bundle_file: get_missing_channels(bundle.applications, charm_channel_map)
+        for bundle_file, bundle in bundles.items()
+    }
+
+
+def combine_missing_channels(
+    results: Dict[str, Tuple[Dict[str, str], Dict[str, str]]]
+) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """Returns the missing tracks and missing risks of all bundles, as {charm: [missing]}"""
+    missing_tracks, missing_risks = {}, {}
+    for bundle_missing_tracks, bundle_missing_risks in results.values():
+        for combined, missing in [
+            (missing_tracks, bundle_missing_tracks),
+            (missing_risks, bundle_missing_risks),
+        ]:
+            for charm, value in missing.items():
+                if value not in combined.setdefault(charm, []):
+                    combined[charm].append(value)
+    return missing_tracks, missing_risks
+
+
+def format_report_json(results: Dict[str, Tuple[Dict[str, str], Dict[str, str]]]) -> str:
+    """Returns the missing channels of each bundle and of all bundles combined, as JSON"""
+    missing_tracks, missing_risks = combine_missing_channels(results)
+    report = {
+        "bundles": {
+            bundle_file: {"missing_tracks": tracks, "missing_risks": risks}
+            for bundle_file, (tracks, risks) in results.items()
+        },
+        "combined": {"missing_tracks": missing_tracks, "missing_risks": missing_risks},
+    }
+    return json.dumps(report, indent=2)
+
+
+def format_report_csv(results: Dict[str, Tuple[Dict[str, str], Dict[str, str]]]) -> str:
+    """Returns the missing channels of each bundle as CSV, one row per missing track or risk"""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(["bundle", "charm", "missing", "value"])
+    for bundle_file, (missing_tracks, missing_risks) in results.items():
+        for charm, track in missing_tracks.items():
+            writer.writerow([bundle_file, charm, "track", track])
+        for charm, channel in missing_risks.items():
+            writer.writerow([bundle_file, charm, "risk", channel])
+    return output.getvalue()
+
+
+def print_report_text(results: Dict[str, Tuple[Dict[str, str], Dict[str, str]]]):
+    """Prints the missing channels of each bundle, then the request for all bundles combined"""
+    if len(results) > 1:
+        for bundle_file, (missing_tracks, missing_risks) in results.items():
+            print(f"== {bundle_file} ==")
+            for charm, track in missing_tracks.items():
+                print(f"\tmissing track {charm}: {track}")
+            for charm, channel in missing_risks.items():
+                print(f"\tno release in {charm}: {channel}")
+        print("\n== All bundles ==")
+    missing_tracks, missing_risks = combine_missing_channels(results)
+    print_missing_track_summary(
+        {charm: ", ".join(tracks) for charm, tracks in missing_tracks.items()}
+    )
+    print_missing_risk_summary({charm: ", ".join(risks) for charm, risks in missing_risks.items()})
+
+
 def main(
-    bundle_file: str = typer.Argument(..., help="Path to Charm Bundle file"),
+    bundle_files: List[str] = typer.Argument(
+        ..., help="Paths to Charm Bundle files, directories of them, or glob patterns"
+    ),
     verbose: bool = typer.Option(False, "--verbose"),
+    concurrency: int = typer.Option(
+        DEFAULT_CONCURRENCY, "--concurrency", help="How many `juju info` calls to run at once"
+    ),
+    cache_file: Optional[str] = typer.Option(
+        None, "--cache-file", help="Cache of channel maps.  Defaults to $CHARM_CACHE_FILE"
+    ),
+    cache_ttl: float = typer.Option(
+        DEFAULT_TTL, "--cache-ttl", help="Seconds a cached channel map is trusted for"
+    ),
+    refresh: bool = typer.Option(
+        False, "--refresh", help="Look up every charm again, refreshing the cache"
+    ),
+    backend: str = typer.Option(
+        CHARMHUB_BACKEND,
+        "--backend",
+        help=f"`{CHARMHUB_BACKEND}`, falling back to the juju CLI, or `{CLI_BACKEND}`",
+    ),
+    output_format: str = typer.Option(
+        TEXT_FORMAT, "--format", help=f"`{TEXT_FORMAT}`, `{JSON_FORMAT}` or `{CSV_FORMAT}`"
+    ),
 ):
-    """Parse a bundle file, printing the charm:track pairs in the bundle that do not exist."""
+    """Parse bundle files, printing the charm:track pairs in the bundles that do not exist."""
     if verbose:
         logger.info("Setting verbose logging")
         logger.setLevel(logging.DEBUG)
 
-    bundle = Bundle(bundle_file)
-    charm_channel_map = get_charm_channel_map_for_applications(bundle.applications)
-    missing_tracks = get_missing_tracks(bundle.applications, charm_channel_map)
-    print_missing_track_summary(missing_tracks)
+    if output_format not in (TEXT_FORMAT, JSON_FORMAT, CSV_FORMAT):
+        raise typer.BadParameter(f"Unknown format `{output_format}`")
+    files = find_bundle_files(bundle_files)
+    if not files:
+        raise typer.BadParameter(f"No bundle files found in {bundle_files}")
+
+    Juju.backend = get_info_backend(backend)
+    # Warnings are printed with the text report, but kept out of machine readable ones
+    with nullcontext() if output_format == TEXT_FORMAT else redirect_stdout(sys.stderr):
+        results = audit_bundles(
+            files,
+            concurrency=concurrency,
+            cache=get_channel_map_cache(cache_file, ttl=cache_ttl),
+            refresh=refresh,
+        )
+    if output_format == JSON_FORMAT:
+        print(format_report_json(results))
+    elif output_format == CSV_FORMAT:
+        print(format_report_csv(results), end="")
+    else:
+        print_report_text(results)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test suite for Bundle"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+from bundle import Bundle, freeze
+
+BUNDLE = """# The Kubeflow bundle
+bundle: kubernetes
+name: kubeflow
+applications:
+  argo-controller:
+    charm: argo-controller
+    channel: 3.3/stable  # Pinned until 3.4 is tested
+    scale: 1
+    options:
+      some-option: value
+    to:
+    - some-machine
+  dex-auth:
+    charm: dex-auth
+    channel: 2.31/stable
+    scale: 1
+    trust: true
+"""
+
+
+@pytest.fixture()
+def bundle_file(tmp_path):
+    path = tmp_path / "bundle.yaml"
+    path.write_text(BUNDLE)
+    return str(path)
+
+
+def test_read_only_bundle_has_the_same_applications(bundle_file):
+    read_only = Bundle(bundle_file, read_only=True)
+    round_trip = Bundle(bundle_file)
+
+    assert read_only.read_only and not round_trip.read_only
+    assert read_only.applications == freeze(round_trip.applications)
+    assert read_only.applications["argo-controller"]["to"] == ("some-machine",)
+
+
+def test_read_only_applications_cannot_be_mutated(bundle_file):
+    bundle = Bundle(bundle_file, read_only=True)
+    with pytest.raises(TypeError):
+        bundle.applications["argo-controller"]["channel"] = "3.4/stable"
+    with pytest.raises(TypeError):
+        del bundle.applications["dex-auth"]
+    with pytest.raises(TypeError):
+        bundle.applications["argo-controller"]["options"]["some-option"] = "changed"
+
+
+def test_to_dict_upgrades_to_round_trip(bundle_file, tmp_path):
+    """Mutating a read-only bundle through to_dict keeps its comments when dumped"""
+    bundle = Bundle(bundle_file, read_only=True)
+
+    bundle.to_dict()["applications"]["argo-controller"]["channel"] = "3.4/stable"
+    assert not bundle.read_only
+    assert bundle.applications["argo-controller"]["channel"] == "3.4/stable"
+
+    output = tmp_path / "output.yaml"
+    bundle.dump(str(output))
+    assert output.read_text() == BUNDLE.replace("3.3/stable", "3.4/stable")
+
+
+def test_dump_of_a_read_only_bundle_keeps_comments(bundle_file, tmp_path):
+    output = tmp_path / "output.yaml"
+    Bundle(bundle_file, read_only=True).dump(str(output))
+    assert output.read_text() == BUNDLE
+
+
+LOAD_SCRIPT = """
+import json, sys, time, tracemalloc
+from bundle import Bundle
+
+tracemalloc.start()
+start = time.monotonic()
+bundle = Bundle(sys.argv[1], read_only=sys.argv[2] == "read_only")
+len(bundle.applications)
+elapsed = time.monotonic() - start
+print(json.dumps({"elapsed": elapsed, "peak": tracemalloc.get_traced_memory()[1]}))
+"""
+
+
+@pytest.mark.benchmark
+def test_benchmark_load_modes(tmp_path):
+    """Compares load time and peak memory of both modes on a bundle of 800 applications.
+
+    The peak is that of the memory allocated by Python while loading, as traced by tracemalloc,
+    since the peak RSS of the process is dominated by the imports.
+    """
+    lines = ["# A large bundle", "bundle: kubernetes", "applications:"]
+    for index in range(800):
+        lines += [
+            f"  app-{index}:  # application {index}",
+            f"    charm: charm-{index}",
+            f"    channel: 1.{index % 20}/stable",
+            "    scale: 1",
+            "    trust: true",
+            "    options:",
+            f"      some-option: value-{index}",
+            "    _github_repo_name: some-operator",
+        ]
+    path = tmp_path / "large.yaml"
+    path.write_text("\n".join(lines) + "\n")
+
+    results = {}
+    for mode in ["round_trip", "read_only"]:
+        output = subprocess.run(
+            [sys.executable, "-c", LOAD_SCRIPT, str(path), mode],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(output)
+
+    print(
+        "800 applications: "
+        + ", ".join(
+            f"{mode} {result['elapsed']:.3f}s and {result['peak'] / 2 ** 20:.1f}MiB peak"
+            for mode, result in results.items()
+        )
+    )
+    assert results["read_only"]["elapsed"] < results["round_trip"]["elapsed"]
+    assert results["read_only"]["peak"] < results["round_trip"]["peak"]
+
+
+def test_diff_and_equality(bundle_file, tmp_path):
+    bundle = Bundle(bundle_file)
+    assert bundle == Bundle(bundle_file, read_only=True)
+
+    other = bundle.deepcopy()
+    other.to_dict()["applications"]["dex-auth"]["channel"] = "2.36/stable"
+    assert bundle != other
+    assert bundle.diff(other).channel_changes == {"dex-auth": ("2.31/stable", "2.36/stable")}
@@ -0,0 +1,109 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test suite for the backends of Juju.info"""
+
+import threading
+import time
+
+import pytest
+from charmhub import INFO_FIELDS, CharmhubBackend
+from charmhub_stub import CharmhubStub
+from juju import BackendUnavailableError, FallbackBackend, Juju, JujuCliBackend, JujuFailedError
+from request_missing_tracks import get_charm_channel_map_for_applications, get_missing_tracks
+
+CHARMS = {f"charm{i}": ["1.7", "1.8"] for i in range(10)}
+
+
+@pytest.fixture()
+def charmhub_stub():
+    with CharmhubStub(CHARMS) as stub:
+        yield stub
+
+
+def test_charmhub_info(charmhub_stub):
+    """The channel map has one entry per channel, and only its fields are requested"""
+    info = CharmhubBackend(charmhub_stub.url).info("charm0")
+
+    assert info["name"] == "charm0"
+    assert list(info["channel-map"]) == ["1.7/stable", "1.7/edge", "1.8/stable", "1.8/edge"]
+    assert info["channel-map"]["1.8/edge"] == {
+        "released-at": "2023-01-01T00:00:00+00:00",
+        "track": "1.8",
+        "risk": "edge",
+        "revision": 12,
+        "version": "12",
+        "revisions": [12],
+    }
+    path, query = charmhub_stub.requests[0]
+    assert path == "/v2/charms/info/charm0"
+    assert query["fields"] == [",".join(INFO_FIELDS)]
+
+
+def test_charmhub_info_not_found(charmhub_stub):
+    """A missing charm fails like `juju info` does, without falling back to another backend"""
+    backend = FallbackBackend(CharmhubBackend(charmhub_stub.url), JujuCliBackend())
+    with pytest.raises(JujuFailedError) as error:
+        backend.info("missing-charm")
+    assert not isinstance(error.value, BackendUnavailableError)
+    assert error.value.stderr == "No charm or bundle with name 'missing-charm'."
+
+
+def test_unreachable_charmhub_falls_back_to_cli(charmhub_stub, fake_juju):
+    calls = fake_juju()
+    url = charmhub_stub.url
+    charmhub_stub.stop()
+
+    with pytest.raises(BackendUnavailableError):
+        CharmhubBackend(url).info("charm0")
+    info = FallbackBackend(CharmhubBackend(url), JujuCliBackend()).info("charm0")
+
+    assert info["channel-map"] == {"charm0/stable": {"track": "charm0", "risk": "stable"}}
+    assert calls.read_text().split() == ["charm0"]
+
+
+def test_missing_tracks_with_charmhub_backend(charmhub_stub, monkeypatch):
+    monkeypatch.setattr(Juju, "backend", CharmhubBackend(charmhub_stub.url, pool_size=4))
+    applications = {f"app{i}": {"charm": f"charm{i}", "channel": "1.8/stable"} for i in range(10)}
+    applications["app3"]["channel"] = "1.9/stable"
+
+    charm_channel_map = get_charm_channel_map_for_applications(applications, concurrency=4)
+
+    assert get_missing_tracks(applications, charm_channel_map) == {"charm3": "1.9"}
+    # Connections are reused across lookups
+    assert len(charmhub_stub.connections) <= 4
+
+
+def test_juju_cli_does_not_block_on_large_stderr(fake_juju):
+    """`juju` writing more to stderr than a pipe holds does not block reading its output"""
+    fake_juju(stderr_size=1024 * 1024)
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(Juju.info("charm0")), daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+    assert result["name"] == "charm0"
+
+
+@pytest.mark.benchmark
+def test_benchmark_backends(charmhub_stub, fake_juju):
+    """Compares the per-charm latency of the juju CLI and Charmhub backends"""
+    fake_juju()
+    charms = list(CHARMS)
+
+    cli = JujuCliBackend()
+    start = time.monotonic()
+    for charm in charms:
+        cli.info(charm)
+    cli_latency = (time.monotonic() - start) / len(charms)
+
+    charmhub = CharmhubBackend(charmhub_stub.url)
+    start = time.monotonic()
+    for charm in charms:
+        charmhub.info(charm)
+    charmhub_latency = (time.monotonic() - start) / len(charms)
+
+    print(
+        f"per charm: juju CLI {cli_latency * 1000:.1f}ms, Charmhub {charmhub_latency * 1000:.1f}ms"
+    )
+    assert charmhub_latency < cli_latency
@@ -3,10 +3,29 @@
 
 """Test suite for request_missing_tracks"""
 
+import json
+import random
+import time
 from unittest import mock
 
+import pytest
+from charm_cache import ChannelMapCache
 from juju import JujuFailedError
-from request_missing_tracks import Juju, get_charm_channel_map_for_applications, get_missing_tracks
+from request_missing_tracks import (
+    RISKS,
+    Juju,
+    audit_bundles,
+    combine_missing_channels,
+    find_bundle_files,
+    format_report_csv,
+    format_report_json,
+    get_charm_channel_map_for_applications,
+    get_missing_channels,
+    get_missing_tracks,
+    main,
+    print_report_text,
+    split_channel,
+)
 
 
 def test_get_charm_channel_map_for_applications():
@@ -82,3 +101,290 @@ def test_get_missing_tracks():
     missing_tracks = get_missing_tracks(applications, charm_channel_map)
     assert len(missing_tracks) == 1
     assert missing_tracks == {"someCharm0": "missingtrack"}
+
+
+def test_get_charm_channel_map_for_applications_concurrently(fake_juju, capsys):
+    """Concurrent lookups give the same result and warnings as serial ones"""
+    fake_juju()
+    applications = {f"app{i}": {"charm": f"charm{i % 4}", "channel": "1/stable"} for i in range(8)}
+    applications["broken"] = {"charm": "missing-charm", "channel": "1/stable"}
+
+    serial = get_charm_channel_map_for_applications(applications)
+    serial_output = capsys.readouterr().out
+    concurrent = get_charm_channel_map_for_applications(applications, concurrency=4)
+    concurrent_output = capsys.readouterr().out
+
+    assert concurrent == serial
+    assert list(concurrent) == ["charm0", "charm1", "charm2", "charm3"]
+    assert concurrent["charm1"] == {"charm1/stable": {"track": "charm1", "risk": "stable"}}
+    assert concurrent_output == serial_output
+    assert "Failed getting info for application 'broken'" in concurrent_output
+    assert "No charm or bundle with name 'missing-charm'" in concurrent_output
+
+
+@pytest.mark.benchmark
+def test_benchmark_concurrent_juju_info(fake_juju):
+    """Compares serial and concurrent lookups against a `juju` taking a while to answer"""
+    fake_juju(delay=0.2)
+    applications = {f"app{i}": {"charm": f"charm{i}", "channel": "1/stable"} for i in range(10)}
+
+    start = time.monotonic()
+    serial = get_charm_channel_map_for_applications(applications)
+    serial_elapsed = time.monotonic() - start
+
+    start = time.monotonic()
+    concurrent = get_charm_channel_map_for_applications(applications, concurrency=10)
+    concurrent_elapsed = time.monotonic() - start
+
+    print(f"10 charms: serial {serial_elapsed:.3f}s, concurrent {concurrent_elapsed:.3f}s")
+    assert concurrent == serial
+    assert concurrent_elapsed < serial_elapsed / 2
+
+
+def test_get_charm_channel_map_for_applications_uses_cache(fake_juju, tmp_path):
+    """Charms cached by an earlier run, for another bundle, are not looked up again"""
+    calls = fake_juju()
+    cache_file = str(tmp_path / "channel_maps.json")
+    bundle_1 = {f"app{i}": {"charm": f"charm{i}", "channel": "1/stable"} for i in range(3)}
+    bundle_2 = {f"app{i}": {"charm": f"charm{i}", "channel": "1/stable"} for i in range(1, 5)}
+    bundle_2["broken"] = {"charm": "missing-charm", "channel": "1/stable"}
+
+    first = get_charm_channel_map_for_applications(bundle_1, cache=ChannelMapCache(cache_file))
+    second = get_charm_channel_map_for_applications(bundle_2, cache=ChannelMapCache(cache_file))
+
+    assert second["charm1"] == first["charm1"]
+    assert list(second) == ["charm1", "charm2", "charm3", "charm4"]
+    assert calls.read_text().split() == [
+        "charm0",
+        "charm1",
+        "charm2",
+        "charm3",
+        "charm4",
+        "missing-charm",
+    ]
+
+    # Failures are not cached, and refresh looks every charm up again
+    calls.write_text("")
+    get_charm_channel_map_for_applications(bundle_2, cache=ChannelMapCache(cache_file))
+    assert calls.read_text().split() == ["missing-charm"]
+    calls.write_text("")
+    get_charm_channel_map_for_applications(
+        bundle_2, cache=ChannelMapCache(cache_file), refresh=True
+    )
+    assert len(calls.read_text().split()) == len(bundle_2)
+
+
+@pytest.mark.parametrize(
+    "channel, expected",
+    [
+        ("1.7/stable", ("1.7", "stable")),
+        ("1.7/edge/some-branch", ("1.7", "edge")),
+        ("1.7", ("1.7", "stable")),
+        ("edge", ("latest", "edge")),
+        ("latest/beta", ("latest", "beta")),
+    ],
+)
+def test_split_channel(channel, expected):
+    assert split_channel(channel) == expected
+
+
+def test_get_missing_tracks_is_exact():
+    """Track 1.1 is not found in a charm only publishing track 1.10"""
+    applications = {"app": {"charm": "someCharm", "channel": "1.1/stable"}}
+    charm_channel_map = {"someCharm": {"1.10/stable": None, "1.1x/edge": None}}
+    assert get_missing_tracks(applications, charm_channel_map) == {"someCharm": "1.1"}
+
+
+def test_get_missing_channels_reports_missing_risks():
+    applications = {
+        "app0": {"charm": "someCharm0", "channel": "1.7/stable"},
+        "app1": {"charm": "someCharm1", "channel": "1.7/edge"},
+        "app2": {"charm": "someCharm2", "channel": "1.8/stable"},
+    }
+    charm_channel_map = {
+        "someCharm0": {"1.7/edge": None},
+        "someCharm1": {"1.7/edge": None},
+        "someCharm2": {"1.7/stable": None},
+    }
+    assert get_missing_channels(applications, charm_channel_map) == (
+        {"someCharm2": "1.8"},
+        {"someCharm0": "1.7/stable"},
+    )
+
+
+def generate_channel_maps(
+    seed: int, n_charms: int, n_channels: int, n_tracks: int = 120, n_applications: int = 3
+):
+    """Returns random applications and channel maps, with many tracks sharing prefixes.
+
+    Applications deploy from twice as many tracks as the charms publish, so that about half of
+    them are missing.
+    """
+    rng = random.Random(seed)
+    tracks = [f"{index // 12}.{index % 12}" for index in range(n_tracks)] + ["latest"]
+    application_tracks = tracks + [f"{track}0" for track in tracks]
+    applications, charm_channel_map = {}, {}
+    for charm_index in range(n_charms):
+        charm = f"charm{charm_index}"
+        charm_channel_map[charm] = {
+            f"{rng.choice(tracks)}/{rng.choice(RISKS)}": None for _ in range(n_channels)
+        }
+        for app_index in range(n_applications):
+            channel = f"{rng.choice(application_tracks)}/{rng.choice(RISKS)}"
+            applications[f"app{charm_index}-{app_index}"] = {"charm": charm, "channel": channel}
+    return applications, charm_channel_map
+
+
+def reference_missing_channels(applications, charm_channel_map):
+    """Finds missing channels by comparing every channel of a charm, as the spec reads"""
+    missing_tracks, missing_risks = {}, {}
+    for application in applications.values():
+        charm = application["charm"]
+        track, risk = application["channel"].split("/")
+        channels = [channel.split("/") for channel in charm_channel_map[charm]]
+        if all(channel[0] != track for channel in channels):
+            missing_tracks[charm] = track
+        elif [track, risk] not in channels:
+            missing_risks[charm] = f"{track}/{risk}"
+    return missing_tracks, missing_risks
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_get_missing_channels_matches_reference(seed):
+    """Property test: on generated channel maps, the index agrees with an exhaustive search"""
+    applications, charm_channel_map = generate_channel_maps(seed, n_charms=10, n_channels=200)
+    assert get_missing_channels(applications, charm_channel_map) == reference_missing_channels(
+        applications, charm_channel_map
+    )
+
+
+@pytest.mark.benchmark
+def test_benchmark_get_missing_tracks():
+    """Compares the former linear startswith scan with the indexed lookup"""
+    applications, charm_channel_map = generate_channel_maps(
+        0, n_charms=20, n_channels=5000, n_tracks=1250, n_applications=100
+    )
+
+    start = time.monotonic()
+    for application in applications.values():
+        track = application["channel"].split("/")[0]
+        next(
+            (c for c in charm_channel_map[application["charm"]] if c.startswith(track)),
+            None,
+        )
+    scan_elapsed = time.monotonic() - start
+
+    start = time.monotonic()
+    get_missing_channels(applications, charm_channel_map)
+    index_elapsed = time.monotonic() - start
+
+    print(
+        f"{len(applications)} applications: scan {scan_elapsed:.4f}s, index {index_elapsed:.4f}s"
+    )
+
+
+def write_bundle(path, channels: dict):
+    """Writes a bundle deploying each charm of channels, from its channel"""
+    lines = ["bundle: kubernetes", "applications:"]
+    for charm, channel in channels.items():
+        lines += [f"  {charm}-app:", f"    charm: {charm}", f"    channel: {channel}"]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+@pytest.fixture()
+def releases(tmp_path):
+    """Three releases sharing most of their charms.  The fake juju publishes `<charm>/stable`"""
+    return [
+        write_bundle(tmp_path / "releases/1.7/bundle.yaml", {"a": "a/stable", "b": "1.7/stable"}),
+        write_bundle(tmp_path / "releases/1.8/bundle.yaml", {"a": "a/edge", "b": "1.8/stable"}),
+        write_bundle(tmp_path / "releases/latest/bundle.yaml", {"a": "a/stable", "c": "c/stable"}),
+    ]
+
+
+def test_find_bundle_files(releases, tmp_path):
+    assert find_bundle_files([str(tmp_path / "releases")]) == releases
+    assert find_bundle_files([str(tmp_path / "releases/1.*/*.yaml")]) == releases[:2]
+    assert find_bundle_files([releases[2], releases[2]]) == releases[2:]
+    assert find_bundle_files([str(tmp_path / "nothing-here")]) == []
+
+
+def test_audit_bundles_fetches_each_charm_once(releases, fake_juju):
+    calls = fake_juju()
+
+    results = audit_bundles(releases, concurrency=4)
+
+    assert sorted(calls.read_text().split()) == ["a", "b", "c"]
+    assert results == {
+        releases[0]: ({"b": "1.7"}, {}),
+        releases[1]: ({"b": "1.8"}, {"a": "a/edge"}),
+        releases[2]: ({}, {}),
+    }
+    assert combine_missing_channels(results) == ({"b": ["1.7", "1.8"]}, {"a": ["a/edge"]})
+
+
+def test_report_formats(releases, fake_juju, capsys):
+    fake_juju()
+    results = audit_bundles(releases)
+
+    report = json.loads(format_report_json(results))
+    assert report["bundles"][releases[1]] == {
+        "missing_tracks": {"b": "1.8"},
+        "missing_risks": {"a": "a/edge"},
+    }
+    assert report["combined"] == {
+        "missing_tracks": {"b": ["1.7", "1.8"]},
+        "missing_risks": {"a": ["a/edge"]},
+    }
+
+    assert format_report_csv(results).splitlines() == [
+        "bundle,charm,missing,value",
+        f"{releases[0]},b,track,1.7",
+        f"{releases[1]},b,track,1.8",
+        f"{releases[1]},a,risk,a/edge",
+    ]
+
+    print_report_text(results)
+    text = capsys.readouterr().out
+    assert f"== {releases[1]} ==" in text
+    assert "\tb: 1.7, 1.8" in text
+
+
+def test_main_json_report_of_a_directory(releases, fake_juju, tmp_path, capsys):
+    fake_juju()
+    main(
+        bundle_files=[str(tmp_path / "releases")],
+        verbose=False,
+        concurrency=2,
+        cache_file=str(tmp_path / "channel_maps.json"),
+        cache_ttl=60,
+        refresh=False,
+        backend="cli",
+        output_format="json",
+    )
+    report = json.loads(capsys.readouterr().out)
+    assert sorted(report["bundles"]) == releases
+
+
+def test_main_keeps_warnings_out_of_machine_readable_reports(fake_juju, tmp_path, capsys):
+    fake_juju()
+    bundle = write_bundle(tmp_path / "bundle.yaml", {"missing-charm": "1.8/stable"})
+    options = dict(
+        verbose=False,
+        concurrency=1,
+        cache_file=str(tmp_path / "channel_maps.json"),
+        cache_ttl=60,
+        refresh=False,
+        backend="cli",
+    )
+
+    main(bundle_files=[bundle], output_format="json", **options)
+    captured = capsys.readouterr()
+    assert json.loads(captured.out)["bundles"] == {
+        bundle: {"missing_tracks": {}, "missing_risks": {}}
+    }
+    assert "Failed getting info for application" in captured.err
+
+    main(bundle_files=[bundle], output_format="text", **options)
+    assert "Failed getting info for application" in capsys.readouterr().out
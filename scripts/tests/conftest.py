@@ -0,0 +1,41 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+import os
+import subprocess
+
+import pytest
+
+
+class GitRepo:
+    """A throwaway git repository, for tests of the scripts reading git history."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.git("init", "-q", "-b", "main")
+        self.git("config", "user.email", "tests@example.com")
+        self.git("config", "user.name", "tests")
+
+    def git(self, *args) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=self.path, check=True, capture_output=True, text=True
+        ).stdout.strip()
+
+    def commit(self, files: dict, message: str = "commit") -> str:
+        """Write files, given as {path: content or None to delete}, commit them, return the sha"""
+        for path, content in files.items():
+            if content is None:
+                self.git("rm", "-q", path)
+                continue
+            full_path = f"{self.path}/{path}"
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w") as file:
+                file.write(content)
+            self.git("add", path)
+        self.git("commit", "-q", "--allow-empty", "-m", message)
+        return self.git("rev-parse", "HEAD")
+
+
+@pytest.fixture()
+def git_repo(tmp_path):
+    return GitRepo(tmp_path / "repo")
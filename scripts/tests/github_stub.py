@@ -0,0 +1,263 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""A local HTTP server standing in for the Github REST API, for tests and benchmarks."""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple, Union
+
+# A route answers with a (status, body) tuple, or computes one from the request
+Route = Union[Tuple[int, object], Callable[[str, str, Optional[dict]], Tuple[int, object]]]
+
+
+class GithubStub:
+    """A threaded HTTP server answering the routes it is given like the Github API would.
+
+    Responses carry an ETag and the X-RateLimit-* headers.  Requests with a matching If-None-Match
+    are answered with 304 Not Modified, which, like on Github, does not use up the rate limit.
+    The server keeps connections alive, and records every request and every connection so that
+    tests can count them.
+
+    Args:
+        latency: How long, in seconds, to wait before answering each request
+        rate_limit: The rate limit reported by the server
+        rate_limit_reset: The unix timestamp the rate limit resets at.  Defaults to an hour from
+                          the start of the server.
+
+    Attributes:
+        url: The base url of the server, once started
+        requests: Every request received, as (method, path, status) tuples
+        connections: The (host, port) of every connection opened to the server
+        routes: A dict of {(method, path): route}.  Unknown routes answer 404.
+        branches: The branches of the repositories added with add_repository, as
+                  {"owner/repo": {"branch": sha}}
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rate_limit: int = 5000,
+        rate_limit_reset: Optional[float] = None,
+    ):
+        self.latency = latency
+        self.rate_limit_remaining = rate_limit
+        self.rate_limit_reset = rate_limit_reset or time.time() + 3600
+        self.routes: Dict[Tuple[str, str], Route] = {}
+        self.requests = []
+        self.connections = set()
+        self.branches: Dict[str, Dict[str, str]] = {}
+        self.default_branches: Dict[str, str] = {}
+        self.failing_repositories = set()
+        self.url = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.add("POST", "/graphql", self._graphql)
+
+    def add(self, method: str, path: str, route: Route):
+        """Answers requests to method and path with route"""
+        self.routes[(method, path)] = route
+
+    def add_repository(
+        self, full_name: str, branches: Dict[str, str], default_branch: Optional[str] = None
+    ):
+        """Adds a repository with its branches and the refs API to read and create branches.
+
+        Args:
+            full_name: The "owner/repo" name of the repository
+            branches: The branches of the repository, as {"branch": sha}
+            default_branch: The default branch of the repository.  Defaults to the first branch.
+        """
+        self.branches[full_name] = {}
+        self.default_branches[full_name] = default_branch or next(iter(branches))
+        owner, name = full_name.split("/")
+        self.add(
+            "GET",
+            f"/repos/{full_name}",
+            (
+                200,
+                {
+                    "name": name,
+                    "full_name": full_name,
+                    "owner": {"login": owner},
+                    "default_branch": self.default_branches[full_name],
+                },
+            ),
+        )
+        for branch, sha in branches.items():
+            self._add_branch(full_name, branch, sha)
+        self.add("POST", f"/repos/{full_name}/git/refs", partial(self._create_ref, full_name))
+
+    def _add_branch(self, full_name: str, branch: str, sha: str):
+        """Adds a branch to a repository, readable through the refs API"""
+        self.branches[full_name][branch] = sha
+        self.add(
+            "GET",
+            f"/repos/{full_name}/git/ref/heads/{branch}",
+            (200, {"ref": f"refs/heads/{branch}", "object": {"sha": sha, "type": "commit"}}),
+        )
+
+    def _create_ref(self, full_name: str, method: str, path: str, body: Optional[dict]):
+        """Answers a request creating a ref, like POST /repos/{owner}/{repo}/git/refs"""
+        branch = body["ref"][len("refs/heads/") :]
+        with self._lock:
+            if branch in self.branches[full_name]:
+                return 422, {"message": "Reference already exists"}
+            self._add_branch(full_name, branch, body["sha"])
+        return 201, {"ref": body["ref"], "object": {"sha": body["sha"], "type": "commit"}}
+
+    def _graphql(self, method: str, path: str, body: Optional[dict]):
+        """Answers GraphQL requests, like POST /graphql.
+
+        Only the shapes of queries and mutations our scripts send are understood: aliased
+        `repository(owner: "...", name: "...")` lookups, answered with the id, default branch,
+        head commit and (if asked for) a `ref(qualifiedName: "...")` of the repository, and
+        aliased `createRef(input: {...})` mutations.  Repositories in failing_repositories fail
+        their createRef mutations, to simulate partial errors.
+        """
+        query = body["query"]
+        data, errors = {}, []
+        lookups = list(
+            re.finditer(r'(\w+): repository\(owner: "([^"]+)", name: "([^"]+)"\)', query)
+        )
+        for index, lookup in enumerate(lookups):
+            alias, owner, name = lookup.groups()
+            end = lookups[index + 1].start() if index + 1 < len(lookups) else len(query)
+            data[alias] = self._graphql_repository(f"{owner}/{name}", query[lookup.end() : end])
+            if data[alias] is None:
+                errors.append({"type": "NOT_FOUND", "path": [alias]})
+
+        for alias, repository_id, ref, oid in re.findall(
+            r'(\w+): createRef\(input: \{repositoryId: "([^"]+)", name: "([^"]+)", '
+            r'oid: "([^"]+)"\}\)',
+            query,
+        ):
+            full_name = repository_id[len("R_") :]
+            branch = ref[len("refs/heads/") :]
+            with self._lock:
+                if full_name in self.failing_repositories or branch in self.branches[full_name]:
+                    data[alias] = None
+                    errors.append({"type": "UNPROCESSABLE", "path": [alias]})
+                    continue
+                self._add_branch(full_name, branch, oid)
+            data[alias] = {"ref": {"name": ref}}
+
+        response = {"data": data}
+        if errors:
+            response["errors"] = errors
+        return 200, response
+
+    def _graphql_repository(self, full_name: str, fields: str) -> Optional[dict]:
+        """Returns the fields of a repository for a GraphQL query, or None if it does not exist"""
+        if full_name not in self.branches:
+            return None
+        default_branch = self.default_branches[full_name]
+        repository = {
+            "id": f"R_{full_name}",
+            "defaultBranchRef": {
+                "name": default_branch,
+                "target": {"oid": self.branches[full_name][default_branch]},
+            },
+        }
+        ref = re.search(r'ref\(qualifiedName: "refs/heads/([^"]+)"\)', fields)
+        if ref:
+            branch = ref.group(1)
+            repository["ref"] = {"name": branch} if branch in self.branches[full_name] else None
+        return repository
+
+    def count(self, method: Optional[str] = None, path: Optional[str] = None, status=None) -> int:
+        """Returns the number of requests received matching all of the given fields"""
+        return sum(
+            (method is None or request[0] == method)
+            and (path is None or request[1] == path)
+            and (status is None or request[2] == status)
+            for request in self.requests
+        )
+
+    def start(self) -> "GithubStub":
+        """Starts serving on a free port of localhost"""
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler_class(self))
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        """Starts the server"""
+        return self.start()
+
+    def __exit__(self, *args):
+        """Stops the server"""
+        self.stop()
+
+    def answer(
+        self, method: str, path: str, body: Optional[dict], headers
+    ) -> Tuple[int, dict, bytes]:
+        """Returns the status, headers and body to answer a request with"""
+        time.sleep(self.latency)
+        route = self.routes.get((method, path.split("?")[0]))
+        if route is None:
+            status, payload = 404, {"message": "Not Found"}
+        elif callable(route):
+            status, payload = route(method, path, body)
+        else:
+            status, payload = route
+        content = json.dumps(payload).encode("utf-8")
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+
+        with self._lock:
+            if status == 200 and headers.get("If-None-Match") == etag:
+                status, content = 304, b""
+            elif self.rate_limit_remaining > 0:
+                self.rate_limit_remaining -= 1
+            self.requests.append((method, path, status))
+            response_headers = {
+                "ETag": etag,
+                "X-RateLimit-Remaining": str(self.rate_limit_remaining),
+                "X-RateLimit-Reset": str(int(self.rate_limit_reset)),
+            }
+        return status, response_headers, content
+
+
+def _handler_class(stub: GithubStub):
+    """Returns a request handler class that answers requests through stub"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with stub._lock:
+                stub.connections.add(self.client_address)
+
+        def _handle(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            status, headers, content = stub.answer(self.command, self.path, body, self.headers)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if status != 304:
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            if status != 304:
+                self.wfile.write(content)
+
+        do_GET = do_POST = do_PATCH = _handle
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
@@ -1,47 +1,46 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import json
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+import yaml
+from github_client import GithubClient
+from github_stub import GithubStub
 from requests_mock.mocker import Mocker
 
 from scripts.branch_creation import (
+    CREATED,
     DEFAULT_REPO_OWNER,
+    EXISTS,
+    FAILED,
     GITHUB_API_URL,
+    GRAPHQL_BACKEND,
+    REST_BACKEND,
+    BranchCreationResult,
+    DefaultBranchResolver,
+    branch_creation_automation,
     create_git_branch,
+    create_git_branches,
+    format_branch_creation_report,
+    get_branches_to_create,
+    get_changed_charms,
+    get_default_branch_resolver,
     get_latest_commit_sha,
-    get_modified_releases_dirs,
     parse_yamls,
     trim_bundle_dict,
 )
 
 
-def test_get_modified_releases_dirs_only_include_files_in_releases_dir():
-    file_paths = [
-        "scripts/branch_creation.py",
-        "scripts/tests/test_branch_creation.py",
-        "scripts/tests/test_bundle.yaml",
-        "tox.ini",
-    ]
-    result = get_modified_releases_dirs(file_paths)
-    assert result == set()
-
-
-def test_get_modified_releases_dirs_only_include_yaml_changes():
-    file_paths = [
-        "releases/1.3/charm.yaml",
-        "releases/1.4/script.py",
-    ]
-    result = get_modified_releases_dirs(file_paths)
-    assert result == set(["releases/1.3"])
-
-
-def test_get_modified_releases_dirs_no_duplicates_in_return():
-    file_paths = [
-        "releases/1.4/charm.yaml",
-        "releases/1.4/bundle.yaml",
-        "releases/1.2/bundle.yaml",
-    ]
-    result = get_modified_releases_dirs(file_paths)
-    assert result == set(["releases/1.4", "releases/1.2"])
+@pytest.fixture(autouse=True)
+def default_branch_resolver(mocker, tmp_path):
+    resolver = DefaultBranchResolver(str(tmp_path / "default_branches.json"))
+    mocker.patch("scripts.branch_creation._default_branch_resolver", resolver)
+    return resolver
 
 
 def test_trim_bundle_dict_success():
@@ -171,6 +170,10 @@ def test_parse_yaml_fail(caplog):
 
 def test_latest_commit_sha_repo_with_branch_main(requests_mock: Mocker):
     test_repo_name = "test-repo-name"
+    # The default branch cannot be resolved, so main then master are tried
+    requests_mock.get(
+        f"{GITHUB_API_URL}/repos/{DEFAULT_REPO_OWNER}/{test_repo_name}", status_code=404
+    )
     requests_mock.get(
         f"{GITHUB_API_URL}/repos/{DEFAULT_REPO_OWNER}/{test_repo_name}/git/ref/heads/main",
         json={
@@ -190,6 +193,10 @@ def test_latest_commit_sha_repo_with_branch_main(requests_mock: Mocker):
 
 def test_latest_commit_sha_repo_with_branch_master(requests_mock: Mocker):
     test_repo_name = "test-repo-name"
+    # The default branch cannot be resolved, so main then master are tried
+    requests_mock.get(
+        f"{GITHUB_API_URL}/repos/{DEFAULT_REPO_OWNER}/{test_repo_name}", status_code=404
+    )
     requests_mock.get(
         f"{GITHUB_API_URL}/repos/{DEFAULT_REPO_OWNER}/{test_repo_name}/git/ref/heads/main",
         json={
@@ -217,6 +224,10 @@ def test_latest_commit_sha_repo_with_branch_master(requests_mock: Mocker):
 
 def test_latest_commit_sha_repo_with_no_main_branches_found(requests_mock: Mocker):
     test_repo_name = "test-repo-name"
+    # The default branch cannot be resolved, so main then master are tried
+    requests_mock.get(
+        f"{GITHUB_API_URL}/repos/{DEFAULT_REPO_OWNER}/{test_repo_name}", status_code=404
+    )
     requests_mock.get(
         f"{GITHUB_API_URL}/repos/{DEFAULT_REPO_OWNER}/{test_repo_name}/git/ref/heads/main",
         json={
@@ -308,3 +319,349 @@ def test_create_git_branch_other_errors(mocker, caplog, requests_mock):
     )
     create_git_branch(github_repo_name, new_branch_name)
     assert "Something went wrong." in caplog.text
+
+
+@pytest.fixture()
+def refs_stub(mocker):
+    with GithubStub(latency=0.05) as stub:
+        mocker.patch("scripts.branch_creation.GITHUB_API_URL", stub.url)
+        stub.add_repository("canonical/main-repo", {"main": "sha-main"})
+        stub.add_repository("canonical/master-repo", {"master": "sha-master"})
+        stub.add_repository("canonical/existing-repo", {"main": "sha-1", "track/1.4": "sha-0"})
+        yield stub
+
+
+def test_get_branches_to_create_deduplicates_repos():
+    charms_info = {
+        "charm-a": {"version": "1.4", "github_repo_name": "multi-repo"},
+        "charm-b": {"version": "1.4", "github_repo_name": "multi-repo"},
+        "charm-c": {"version": "2.0", "github_repo_name": "multi-repo"},
+        "charm-d": {"version": "1.4", "github_repo_name": "single-repo"},
+    }
+    assert get_branches_to_create(charms_info) == {
+        ("multi-repo", "track/1.4"): ["charm-a", "charm-b"],
+        ("multi-repo", "track/2.0"): ["charm-c"],
+        ("single-repo", "track/1.4"): ["charm-d"],
+    }
+
+
+def test_create_git_branches_reports_each_outcome(refs_stub):
+    branches = {
+        ("main-repo", "track/1.4"): ["charm-a", "charm-b"],
+        ("master-repo", "track/1.4"): ["charm-c"],
+        ("existing-repo", "track/1.4"): ["charm-d"],
+        ("missing-repo", "track/1.4"): ["charm-e"],
+    }
+
+    results = create_git_branches(branches, concurrency=4)
+
+    assert results == [
+        BranchCreationResult("main-repo", "track/1.4", ["charm-a", "charm-b"], CREATED),
+        BranchCreationResult("master-repo", "track/1.4", ["charm-c"], CREATED),
+        BranchCreationResult("existing-repo", "track/1.4", ["charm-d"], EXISTS),
+        BranchCreationResult("missing-repo", "track/1.4", ["charm-e"], FAILED),
+    ]
+    assert refs_stub.branches["canonical/main-repo"]["track/1.4"] == "sha-main"
+    assert refs_stub.branches["canonical/master-repo"]["track/1.4"] == "sha-master"
+    assert refs_stub.branches["canonical/existing-repo"]["track/1.4"] == "sha-0"
+    # Only one branch was created per repository
+    assert refs_stub.count(method="POST", status=201) == 2
+
+    report = format_branch_creation_report(results).splitlines()
+    assert report[0].split() == ["REPOSITORY", "BRANCH", "OUTCOME", "CHARMS"]
+    assert report[1].split() == ["main-repo", "track/1.4", CREATED, "charm-a,charm-b"]
+    assert report[-1] == "2 created, 1 exists, 1 failed"
+
+
+def test_create_git_branches_runs_concurrently(refs_stub, mocker):
+    branches = {(f"repo-{i}", "track/1.4"): [f"charm-{i}"] for i in range(8)}
+    for i in range(8):
+        refs_stub.add_repository(f"canonical/repo-{i}", {"main": f"sha-{i}"})
+    # Every branch waits for all the others to be in progress, which breaks the barrier after
+    # its timeout if they are created one at a time
+    barrier = threading.Barrier(8, timeout=5)
+
+    def create_git_branch_together(*args):
+        barrier.wait()
+        return create_git_branch(*args)
+
+    mocker.patch("scripts.branch_creation.create_git_branch", create_git_branch_together)
+    results = create_git_branches(branches, concurrency=8)
+
+    assert [result.outcome for result in results] == [CREATED] * 8
+
+
+def test_create_git_branches_invalid_concurrency():
+    with pytest.raises(ValueError):
+        create_git_branches({}, concurrency=0)
+
+
+def test_branch_creation_automation(refs_stub):
+    refs_stub.add_repository("canonical/admission-webhook-operator", {"main": "sha"})
+    refs_stub.add_repository("canonical/argo-operators", {"master": "sha"})
+    refs_stub.add_repository("canonical/dex-auth-operator", {"main": "sha"})
+
+    results = branch_creation_automation("scripts/tests", concurrency=2)
+
+    assert {result.github_repo_name: result.outcome for result in results} == {
+        "spark-operator": FAILED,
+        "admission-webhook-operator": CREATED,
+        "argo-operators": CREATED,
+        "dex-auth-operator": CREATED,
+    }
+
+
+def test_default_branch_resolver_caches_in_file(refs_stub, default_branch_resolver):
+    assert get_default_branch_resolver() is default_branch_resolver
+    assert default_branch_resolver.resolve("master-repo") == "master"
+    assert default_branch_resolver.resolve("master-repo") == "master"
+    assert default_branch_resolver.resolve("missing-repo") is None
+    assert refs_stub.count(path="/repos/canonical/master-repo") == 1
+
+    # A new resolver reads the cache file instead of asking Github again
+    resolver = DefaultBranchResolver(default_branch_resolver.cache_file)
+    assert resolver.resolve("master-repo") == "master"
+    assert refs_stub.count(path="/repos/canonical/master-repo") == 1
+    with open(default_branch_resolver.cache_file) as file:
+        assert json.load(file)["canonical/master-repo"]["default_branch"] == "master"
+
+
+def test_default_branch_resolver_expires_entries(refs_stub, tmp_path):
+    resolver = DefaultBranchResolver(str(tmp_path / "cache.json"), ttl=0)
+    resolver.resolve("master-repo")
+    time.sleep(0.01)
+    resolver.resolve("master-repo")
+    assert refs_stub.count(path="/repos/canonical/master-repo") == 2
+
+
+def test_default_branch_resolver_ignores_corrupt_cache(tmp_path, caplog):
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text("{not json")
+    resolver = DefaultBranchResolver(str(cache_file))
+    assert resolver.cached("canonical/some-repo") is None
+    assert "Ignoring unreadable default branch cache" in caplog.text
+
+
+def test_default_branch_resolver_prefetch(refs_stub, default_branch_resolver):
+    default_branch_resolver.prefetch(
+        ["canonical/main-repo", "canonical/master-repo", "canonical/missing-repo"]
+    )
+
+    assert refs_stub.count(path="/graphql") == 1
+    assert default_branch_resolver.cached("canonical/main-repo") == "main"
+    assert default_branch_resolver.cached("canonical/master-repo") == "master"
+    assert default_branch_resolver.cached("canonical/missing-repo") is None
+
+    # Fresh entries are not looked up again
+    default_branch_resolver.prefetch(["canonical/main-repo", "canonical/master-repo"])
+    assert refs_stub.count(path="/graphql") == 1
+
+
+def test_latest_commit_sha_uses_default_branch(refs_stub):
+    assert get_latest_commit_sha("master-repo") == "sha-master"
+    assert refs_stub.count(path="/repos/canonical/master-repo/git/ref/heads/main") == 0
+
+
+@pytest.mark.benchmark
+def test_benchmark_default_branch_resolution(refs_stub, mocker):
+    """Counts the requests looking up the latest commit of a release's worth of repositories."""
+    refs_stub.latency = 0
+    with open(os.path.join(os.path.dirname(__file__), "repositories.json")) as file:
+        repositories = json.load(file)
+    for repository in repositories:
+        refs_stub.add_repository(
+            repository["full_name"],
+            {repository["default_branch"]: f"sha-{repository['name']}"},
+        )
+    full_names = [repository["full_name"] for repository in repositories]
+
+    def count_lookups(prefetch):
+        before = len(refs_stub.requests)
+        if prefetch:
+            get_default_branch_resolver().prefetch(full_names)
+        for repository in repositories:
+            assert get_latest_commit_sha(repository["name"]) == f"sha-{repository['name']}"
+        return len(refs_stub.requests) - before
+
+    with mock.patch.object(DefaultBranchResolver, "resolve", return_value=None):
+        probing = count_lookups(prefetch=False)
+    cold_cache = count_lookups(prefetch=True)
+    # Drop the ETag cache of the shared client, to only measure the default branch cache
+    mocker.patch(
+        "scripts.branch_creation.get_client", side_effect=lambda *args: GithubClient(*args)
+    )
+    warm_cache = count_lookups(prefetch=True)
+
+    masters = sum(repository["default_branch"] == "master" for repository in repositories)
+    print(
+        f"{len(repositories)} repositories: {probing} requests probing main then master, "
+        f"{cold_cache} with a cold default branch cache, {warm_cache} with a warm one"
+    )
+    assert probing == len(repositories) + masters
+    assert cold_cache == len(repositories) + 1
+    assert warm_cache == len(repositories)
+
+
+def test_create_git_branches_graphql(refs_stub):
+    branches = {
+        ("main-repo", "track/1.4"): ["charm-a"],
+        ("master-repo", "track/1.4"): ["charm-b"],
+        ("existing-repo", "track/1.4"): ["charm-c"],
+    }
+
+    results = create_git_branches(branches, backend=GRAPHQL_BACKEND)
+
+    assert [result.outcome for result in results] == [CREATED, CREATED, EXISTS]
+    assert refs_stub.branches["canonical/main-repo"]["track/1.4"] == "sha-main"
+    assert refs_stub.branches["canonical/master-repo"]["track/1.4"] == "sha-master"
+    # One query and one mutation, nothing through REST
+    assert len(refs_stub.requests) == 2
+    assert refs_stub.count(path="/graphql") == 2
+
+
+def test_create_git_branches_graphql_falls_back_to_rest(refs_stub):
+    refs_stub.failing_repositories.add("canonical/master-repo")
+    branches = {
+        ("main-repo", "track/1.4"): ["charm-a"],
+        ("master-repo", "track/1.4"): ["charm-b"],
+        ("missing-repo", "track/1.4"): ["charm-c"],
+    }
+
+    results = create_git_branches(branches, backend=GRAPHQL_BACKEND)
+
+    assert [result.outcome for result in results] == [CREATED, CREATED, FAILED]
+    assert refs_stub.count(method="POST", path="/repos/canonical/main-repo/git/refs") == 0
+    assert refs_stub.count(method="POST", path="/repos/canonical/master-repo/git/refs") == 1
+
+
+def test_create_git_branches_graphql_unavailable(refs_stub):
+    refs_stub.add("POST", "/graphql", (502, {"message": "Server Error"}))
+    branches = {("main-repo", "track/1.4"): ["charm-a"]}
+
+    results = create_git_branches(branches, backend=GRAPHQL_BACKEND)
+
+    assert [result.outcome for result in results] == [CREATED]
+    assert refs_stub.count(method="POST", path="/repos/canonical/main-repo/git/refs") == 1
+
+
+def test_create_git_branches_graphql_in_batches(refs_stub, mocker):
+    mocker.patch("scripts.branch_creation.GRAPHQL_BATCH_SIZE", 10)
+    refs_stub.latency = 0
+    branches = {(f"repo-{i}", "track/1.4"): [f"charm-{i}"] for i in range(25)}
+    for i in range(25):
+        refs_stub.add_repository(f"canonical/repo-{i}", {"main": f"sha-{i}"})
+
+    rest_requests = len(refs_stub.requests)
+    create_git_branches(branches, backend=REST_BACKEND)
+    rest_requests = len(refs_stub.requests) - rest_requests
+    for i in range(25):
+        del refs_stub.branches[f"canonical/repo-{i}"]["track/1.4"]
+
+    graphql_requests = len(refs_stub.requests)
+    results = create_git_branches(branches, backend=GRAPHQL_BACKEND)
+    graphql_requests = len(refs_stub.requests) - graphql_requests
+
+    assert [result.outcome for result in results] == [CREATED] * 25
+    print(f"25 branches: {rest_requests} REST requests, {graphql_requests} GraphQL requests")
+    assert graphql_requests == 6
+
+
+def test_create_git_branches_unknown_backend():
+    with pytest.raises(ValueError):
+        create_git_branches({}, backend="carrier-pigeon")
+
+
+def build_bundle(**channels):
+    applications = {
+        charm: {"charm": charm, "channel": channel, "_github_repo_name": f"{charm}-operator"}
+        for charm, channel in channels.items()
+    }
+    return yaml.safe_dump({"bundle": "kubernetes", "applications": applications})
+
+
+def test_get_changed_charms_compares_parsed_bundles(git_repo):
+    base = git_repo.commit(
+        {
+            "releases/1.7/bundle.yaml": build_bundle(argo="3.3/stable", dex="2.31/stable"),
+            "releases/1.7/other.yaml": build_bundle(minio="ckf-1.7/stable"),
+        }
+    )
+    head = git_repo.commit(
+        {
+            # dex moves to a new track, and katib is added
+            "releases/1.7/bundle.yaml": build_bundle(
+                argo="3.3/stable", dex="2.36/stable", katib="0.15/stable"
+            ),
+            # Only comments change
+            "releases/1.7/other.yaml": "# a comment\n" + build_bundle(minio="ckf-1.7/stable"),
+            "releases/1.8/bundle.yaml": build_bundle(argo="3.4/stable"),
+        }
+    )
+
+    assert get_changed_charms(base, head, git_repo.path) == {
+        "releases/1.7": {
+            "dex": {"version": "2.36", "github_repo_name": "dex-operator"},
+            "katib": {"version": "0.15", "github_repo_name": "katib-operator"},
+        },
+        "releases/1.8": {"argo": {"version": "3.4", "github_repo_name": "argo-operator"}},
+    }
+
+
+def test_get_changed_charms_ignores_deleted_bundles(git_repo):
+    base = git_repo.commit({"releases/1.7/bundle.yaml": build_bundle(argo="3.3/stable")})
+    head = git_repo.commit({"releases/1.7/bundle.yaml": None})
+    assert get_changed_charms(base, head, git_repo.path) == {}
+
+
+def test_parse_yamls_reports_conflicting_tracks(tmp_path, caplog):
+    (tmp_path / "a.yaml").write_text(build_bundle(argo="3.3/stable", dex="2.31/stable"))
+    (tmp_path / "b.yaml").write_text(build_bundle(argo="3.4/stable", dex="2.31/stable"))
+
+    result = parse_yamls(str(tmp_path))
+
+    # The last file wins, as it always did
+    assert result["argo"]["version"] == "3.4"
+    assert "Charm `argo` has track `3.3`" in caplog.text
+    assert "track `3.4`" in caplog.text
+    assert "Charm `dex`" not in caplog.text
+
+
+def write_synthetic_release(path, n_files, charms_per_file=20):
+    for index in range(n_files):
+        channels = {
+            f"charm-{index}-{charm}": f"1.{charm}/stable" for charm in range(charms_per_file)
+        }
+        (path / f"bundle-{index:04}.yaml").write_text(build_bundle(**channels))
+
+
+def test_parse_yamls_in_process_pool_matches_serial_parsing(tmp_path, mocker):
+    write_synthetic_release(tmp_path, 40)
+    parallel = parse_yamls(str(tmp_path))
+    mocker.patch("scripts.branch_creation.PARSE_PROCESSES_THRESHOLD", 1000)
+    serial = parse_yamls(str(tmp_path))
+    assert parallel == serial
+    assert len(parallel) == 40 * 20
+
+
+@pytest.mark.benchmark
+def test_benchmark_parse_yamls(tmp_path):
+    """Compares parse_yamls with the former serial, pure Python, copying implementation."""
+    n_files = 300
+    write_synthetic_release(tmp_path, n_files)
+
+    start = time.monotonic()
+    former = {}
+    for file_name in sorted(os.listdir(tmp_path)):
+        with open(tmp_path / file_name, "r") as file:
+            former = {**former, **trim_bundle_dict(yaml.safe_load(file))}
+    former_elapsed = time.monotonic() - start
+
+    start = time.monotonic()
+    result = parse_yamls(str(tmp_path))
+    elapsed = time.monotonic() - start
+
+    print(
+        f"{n_files} bundle files: former parsing {former_elapsed:.3f}s, "
+        f"parse_yamls {elapsed:.3f}s"
+    )
+    assert result == former
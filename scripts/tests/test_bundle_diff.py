@@ -0,0 +1,147 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+import copy
+import time
+
+import pytest
+from deepdiff import DeepDiff
+
+from scripts.bundle_diff import MISSING, application_hash, diff_bundles, normalize_relations
+
+BUNDLE = {
+    "bundle": "kubernetes",
+    "name": "kubeflow",
+    "applications": {
+        "argo-controller": {
+            "charm": "argo-controller",
+            "channel": "3.3/stable",
+            "scale": 1,
+            "options": {"bucket": "mlpipeline", "executor": "emissary"},
+        },
+        "dex-auth": {"charm": "dex-auth", "channel": "2.31/stable", "scale": 1, "trust": True},
+        "minio": {"charm": "minio", "channel": "ckf-1.7/stable", "scale": 1},
+    },
+    "relations": [
+        ["argo-controller", "minio"],
+        ["dex-auth:oidc-client", "oidc-gatekeeper:oidc-client"],
+    ],
+}
+
+
+def test_identical_bundles_have_no_diff():
+    other = copy.deepcopy(BUNDLE)
+    # Neither the order of keys, relations nor endpoints matters
+    other["applications"]["argo-controller"] = dict(
+        reversed(list(other["applications"]["argo-controller"].items()))
+    )
+    other["relations"] = [list(reversed(relation)) for relation in reversed(other["relations"])]
+
+    diff = diff_bundles(BUNDLE, other)
+
+    assert not diff
+    assert application_hash(BUNDLE["applications"]["argo-controller"]) == application_hash(
+        other["applications"]["argo-controller"]
+    )
+
+
+def test_diff_bundles():
+    new = copy.deepcopy(BUNDLE)
+    new["name"] = "kubeflow-1.8"
+    new["applications"]["argo-controller"]["channel"] = "3.4/stable"
+    new["applications"]["argo-controller"]["options"]["executor"] = "pns"
+    new["applications"]["argo-controller"]["options"]["new-option"] = 1
+    new["applications"]["dex-auth"]["scale"] = 2
+    del new["applications"]["minio"]
+    new["applications"]["katib-controller"] = {"charm": "katib-controller", "channel": "0.16"}
+    new["relations"] = [["dex-auth:oidc-client", "oidc-gatekeeper:oidc-client"], ["a", "b"]]
+
+    diff = diff_bundles(BUNDLE, new)
+
+    assert diff
+    assert list(diff.added_applications) == ["katib-controller"]
+    assert list(diff.removed_applications) == ["minio"]
+    assert sorted(diff.changed_applications) == ["argo-controller", "dex-auth"]
+    assert diff.channel_changes == {"argo-controller": ("3.3/stable", "3.4/stable")}
+    assert diff.config_changes == {
+        "argo-controller": {"executor": ("emissary", "pns"), "new-option": (MISSING, 1)}
+    }
+    assert diff.changed_applications["dex-auth"].changes == {"scale": (1, 2)}
+    assert diff.added_relations == {frozenset(["a", "b"])}
+    assert diff.removed_relations == {frozenset(["argo-controller", "minio"])}
+    assert diff.changes == {"name": ("kubeflow", "kubeflow-1.8")}
+
+
+def test_equal_values_hashing_differently_are_not_changes():
+    new = copy.deepcopy(BUNDLE)
+    new["applications"]["dex-auth"]["scale"] = 1.0
+    assert not diff_bundles(BUNDLE, new)
+
+
+def large_bundle(n_applications: int) -> dict:
+    applications = {
+        f"app-{index}": {
+            "charm": f"charm-{index}",
+            "channel": f"1.{index % 20}/stable",
+            "scale": 1,
+            "options": {f"option-{option}": option for option in range(10)},
+        }
+        for index in range(n_applications)
+    }
+    relations = [[f"app-{index}", f"app-{index + 1}"] for index in range(n_applications - 1)]
+    return {"bundle": "kubernetes", "applications": applications, "relations": relations}
+
+
+def test_nested_relations_are_expanded():
+    relations = [["argo-controller", ["minio", "dex-auth"]], ["minio", "argo-controller"]]
+    assert normalize_relations(relations) == {
+        frozenset(["argo-controller", "minio"]),
+        frozenset(["argo-controller", "dex-auth"]),
+    }
+    old = dict(BUNDLE, relations=[["argo-controller", "minio"], ["argo-controller", "dex-auth"]])
+    assert not diff_bundles(
+        old, dict(BUNDLE, relations=[["argo-controller", ["minio", "dex-auth"]]])
+    )
+
+
+@pytest.mark.parametrize(
+    "relation", [["argo-controller"], "argo-controller:minio", ["argo-controller", [["minio"]]]]
+)
+def test_invalid_relations_are_rejected(relation):
+    with pytest.raises(ValueError, match="Invalid relation"):
+        normalize_relations([relation])
+
+
+@pytest.mark.benchmark
+def test_benchmark_against_deepdiff():
+    """Compares diff_bundles with DeepDiff(ignore_order=True) on bundles of 400 applications"""
+    old = large_bundle(400)
+    new = copy.deepcopy(old)
+    new["applications"]["app-7"]["channel"] = "2.0/stable"
+    new["applications"]["app-9"]["options"]["option-1"] = 100
+    new["relations"].reverse()
+
+    start = time.monotonic()
+    deep_diff = DeepDiff(old, new, ignore_order=True)
+    deepdiff_elapsed = time.monotonic() - start
+
+    start = time.monotonic()
+    diff = diff_bundles(old, new)
+    elapsed = time.monotonic() - start
+
+    print(f"400 applications: DeepDiff {deepdiff_elapsed:.3f}s, diff_bundles {elapsed:.3f}s")
+    # Both find the same changes, and neither sees the reordered relations as one
+    assert deep_diff["values_changed"] == {
+        "root['applications']['app-7']['channel']": {
+            "new_value": "2.0/stable",
+            "old_value": "1.7/stable",
+        },
+        "root['applications']['app-9']['options']['option-1']": {
+            "new_value": 100,
+            "old_value": 1,
+        },
+    }
+    assert set(deep_diff) == {"values_changed"}
+    assert diff.channel_changes == {"app-7": ("1.7/stable", "2.0/stable")}
+    assert diff.config_changes == {"app-9": {"option-1": (1, 100)}}
+    assert set(diff.changed_applications) == {"app-7", "app-9"}
+    assert not diff.added_relations and not diff.removed_relations
@@ -0,0 +1,76 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+import json
+import multiprocessing
+import time
+
+from scripts.charm_cache import ChannelMapCache, get_channel_map_cache
+
+CHANNEL_MAP = {"1.7/stable": {"track": "1.7", "risk": "stable", "revision": 12}}
+
+
+def test_channel_maps_are_persisted(tmp_path):
+    cache_file = str(tmp_path / "cache" / "channel_maps.json")
+    ChannelMapCache(cache_file).store({"argo-controller": CHANNEL_MAP})
+
+    cache = ChannelMapCache(cache_file)
+    assert cache.get("argo-controller") == CHANNEL_MAP
+    assert cache.get("dex-auth") is None
+
+
+def test_expired_channel_maps_are_ignored(tmp_path):
+    cache_file = tmp_path / "channel_maps.json"
+    cache_file.write_text(
+        json.dumps(
+            {"argo-controller": {"channel_map": CHANNEL_MAP, "fetched_at": time.time() - 100}}
+        )
+    )
+    assert ChannelMapCache(str(cache_file), ttl=1000).get("argo-controller") == CHANNEL_MAP
+    assert ChannelMapCache(str(cache_file), ttl=10).get("argo-controller") is None
+
+
+def test_unreadable_cache_is_ignored(tmp_path, caplog):
+    cache_file = tmp_path / "channel_maps.json"
+    cache_file.write_text("{not json")
+    cache = ChannelMapCache(str(cache_file))
+    assert cache.get("argo-controller") is None
+    assert "Ignoring unreadable charm cache" in caplog.text
+
+    cache.store({"argo-controller": CHANNEL_MAP})
+    assert ChannelMapCache(str(cache_file)).get("argo-controller") == CHANNEL_MAP
+
+
+def test_memory_only_cache():
+    cache = ChannelMapCache()
+    cache.store({"argo-controller": CHANNEL_MAP})
+    assert cache.get("argo-controller") == CHANNEL_MAP
+
+
+def store_charms(cache_file, worker):
+    cache = ChannelMapCache(cache_file)
+    for index in range(20):
+        cache.store({f"charm-{worker}-{index}": CHANNEL_MAP})
+
+
+def test_concurrent_processes_do_not_lose_entries(tmp_path):
+    """Caches opened by parallel jobs keep the channel maps stored by each other"""
+    cache_file = str(tmp_path / "channel_maps.json")
+    processes = [
+        multiprocessing.Process(target=store_charms, args=(cache_file, worker))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    cache = ChannelMapCache(cache_file)
+    for worker in range(4):
+        for index in range(20):
+            assert cache.get(f"charm-{worker}-{index}") == CHANNEL_MAP
+
+
+def test_get_channel_map_cache_reads_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHARM_CACHE_FILE", str(tmp_path / "from_env.json"))
+    assert get_channel_map_cache().cache_file == str(tmp_path / "from_env.json")
+    assert get_channel_map_cache("other.json").cache_file == "other.json"
@@ -0,0 +1,165 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+import time
+
+import pytest
+import requests
+from github_stub import GithubStub
+
+from scripts.github_client import GithubClient, get_client
+
+REPOSITORY = {"name": "some-repo", "full_name": "canonical/some-repo"}
+WORKFLOW = {
+    "id": 123,
+    "name": "Release",
+    "path": ".github/workflows/release.yaml",
+    "state": "active",
+    "url": "https://api.github.com/repos/canonical/some-repo/actions/workflows/123",
+}
+
+
+@pytest.fixture()
+def github_stub():
+    with GithubStub() as stub:
+        stub.add("GET", "/repos/canonical/some-repo", (200, REPOSITORY))
+        stub.add(
+            "GET", "/repos/canonical/some-repo/actions/workflows/release.yaml", (200, WORKFLOW)
+        )
+        yield stub
+
+
+def test_get_is_revalidated_with_etag(github_stub):
+    client = GithubClient(token="some-token", api_url=github_stub.url)
+
+    first = client.get("/repos/canonical/some-repo")
+    second = client.get("/repos/canonical/some-repo")
+
+    assert first.json() == second.json() == REPOSITORY
+    assert github_stub.count(status=200) == 1
+    assert github_stub.count(status=304) == 1
+    assert client.not_modified == 1
+    # The 304 did not use up the rate limit
+    assert client.rate_limit_remaining == 4999
+
+
+def test_changed_resources_are_fetched_again(github_stub):
+    client = GithubClient(api_url=github_stub.url)
+    client.get("/repos/canonical/some-repo")
+
+    github_stub.add("GET", "/repos/canonical/some-repo", (200, dict(REPOSITORY, name="renamed")))
+
+    assert client.get("/repos/canonical/some-repo").json()["name"] == "renamed"
+    assert github_stub.count(status=200) == 2
+
+
+def test_errors_are_not_cached(github_stub):
+    client = GithubClient(api_url=github_stub.url)
+    assert client.get("/repos/canonical/missing").status_code == 404
+    assert client.get("/repos/canonical/missing").status_code == 404
+    assert github_stub.count(status=404) == 2
+
+
+def test_requests_reuse_connections(github_stub):
+    client = GithubClient(api_url=github_stub.url)
+    for _ in range(10):
+        client.post("/repos/canonical/some-repo")
+    assert len(github_stub.connections) == 1
+
+
+@pytest.mark.parametrize(
+    "remaining, expected_delay",
+    [
+        # Plenty left, so no waiting
+        (1000, None),
+        # Spread the requests left above the reserve over the time until reset
+        (150, 1000 / 100),
+        # At the reserve, wait for the reset
+        (50, 1000),
+    ],
+)
+def test_throttle(remaining, expected_delay):
+    delays = []
+    client = GithubClient(rate_limit_reserve=50, pace_below=500, sleep=delays.append)
+    client.rate_limit_remaining = remaining
+    client.rate_limit_reset = time.time() + 1000
+
+    client.throttle()
+
+    if expected_delay is None:
+        assert delays == []
+    else:
+        assert delays == [pytest.approx(expected_delay, rel=0.01)]
+
+
+def test_throttle_uses_rate_limit_reported_by_github():
+    delays = []
+    with GithubStub(rate_limit=52, rate_limit_reset=time.time() + 1000) as stub:
+        client = GithubClient(api_url=stub.url, rate_limit_reserve=50, sleep=delays.append)
+        client.post("/repos/canonical/some-repo")
+        assert delays == []
+        client.post("/repos/canonical/some-repo")
+    # Only one request was left above the reserve, so it waited for the rate limit to reset
+    assert delays == [pytest.approx(1000, rel=0.01)]
+    assert client.rate_limit_remaining == 50
+
+
+def test_get_workflow_is_cached(github_stub):
+    pytest.importorskip("github")
+    client = GithubClient(token="some-token", api_url=github_stub.url)
+
+    workflow = client.get_workflow("canonical/some-repo", "release.yaml")
+
+    assert workflow.id == 123
+    assert workflow.name == "Release"
+    assert client.get_workflow("canonical/some-repo", "release.yaml") is workflow
+    assert github_stub.count(status=200) == 1
+    assert github_stub.count(status=304) == 1
+
+
+def test_get_workflow_not_found(github_stub):
+    github = pytest.importorskip("github")
+    client = GithubClient(api_url=github_stub.url)
+    with pytest.raises(github.UnknownObjectException):
+        client.get_workflow("canonical/some-repo", "missing.yaml")
+
+
+def test_get_client_is_shared():
+    assert get_client("some-token") is get_client("some-token")
+    assert get_client("some-token") is not get_client("other-token")
+
+
+@pytest.mark.benchmark
+def test_benchmark_against_one_off_requests():
+    """Compares bare requests.get calls with a shared GithubClient, on a server with latency."""
+    n_requests = 20
+    path = "/repos/canonical/some-repo"
+
+    with GithubStub(latency=0.01) as stub:
+        stub.add("GET", path, (200, REPOSITORY))
+        start = time.monotonic()
+        for _ in range(n_requests):
+            requests.get(f"{stub.url}{path}")
+        bare_elapsed = time.monotonic() - start
+        bare_connections = len(stub.connections)
+        bare_rate_limit_used = 5000 - stub.rate_limit_remaining
+
+    with GithubStub(latency=0.01) as stub:
+        stub.add("GET", path, (200, REPOSITORY))
+        client = GithubClient(api_url=stub.url)
+        start = time.monotonic()
+        for _ in range(n_requests):
+            client.get(path)
+        client_elapsed = time.monotonic() - start
+        client_connections = len(stub.connections)
+        client_rate_limit_used = 5000 - stub.rate_limit_remaining
+
+    print(
+        f"bare requests: {bare_elapsed:.3f}s, {bare_connections} connections, "
+        f"{bare_rate_limit_used} rate limit used\n"
+        f"GithubClient: {client_elapsed:.3f}s, {client_connections} connections, "
+        f"{client_rate_limit_used} rate limit used"
+    )
+    assert bare_connections == n_requests
+    assert client_connections == 1
+    assert bare_rate_limit_used == n_requests
+    assert client_rate_limit_used == 1
@@ -0,0 +1,111 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+import os
+import subprocess
+import threading
+
+import pytest
+
+from scripts.release_changes import (
+    is_release_file,
+    iter_changed_files,
+    iter_changed_release_files,
+    read_file_at,
+)
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("releases/1.7/bundle.yaml", True),
+        ("releases/1.7/notes.md", False),
+        ("releases/bundle.yaml", False),
+        ("releases/1.7/tests/bundle.yaml", False),
+        ("scripts/releases/1.7/bundle.yaml", False),
+    ],
+)
+def test_is_release_file(path, expected):
+    assert is_release_file(path) == expected
+
+
+def test_iter_changed_files_covers_every_commit_of_the_range(git_repo):
+    base = git_repo.commit({"README.md": "readme"})
+    git_repo.commit({"releases/1.7/bundle.yaml": "a: 1"})
+    git_repo.commit({"releases/1.8/bundle.yaml": "a: 1", "scripts/tool.py": "pass"})
+    head = git_repo.commit({"releases/1.7/bundle.yaml": None})
+
+    assert sorted(iter_changed_files(base, head, git_repo.path)) == [
+        "releases/1.8/bundle.yaml",
+        "scripts/tool.py",
+    ]
+    assert list(iter_changed_release_files(base, head, git_repo.path)) == [
+        "releases/1.8/bundle.yaml"
+    ]
+
+
+def test_iter_changed_files_sees_merged_branches(git_repo):
+    base = git_repo.commit({"README.md": "readme"})
+    git_repo.git("checkout", "-q", "-b", "feature")
+    git_repo.commit({"releases/1.7/bundle.yaml": "a: 1"})
+    git_repo.git("checkout", "-q", "main")
+    git_repo.commit({"releases/1.8/bundle.yaml": "a: 1"})
+    git_repo.git("merge", "-q", "--no-ff", "-m", "merge", "feature")
+    head = git_repo.git("rev-parse", "HEAD")
+
+    # Diffing only the last commit against its first parent misses what main brought in
+    assert sorted(iter_changed_release_files(base, head, git_repo.path)) == [
+        "releases/1.7/bundle.yaml",
+        "releases/1.8/bundle.yaml",
+    ]
+
+
+def test_iter_changed_files_streams_many_unusual_paths(git_repo, mocker):
+    mocker.patch("scripts.release_changes.READ_SIZE", 7)
+    base = git_repo.commit({"README.md": "readme"})
+    files = {f"releases/1.{i}/bundle with spaces.yaml": "a: 1" for i in range(50)}
+    head = git_repo.commit(files)
+
+    assert sorted(iter_changed_release_files(base, head, git_repo.path)) == sorted(files)
+
+
+def test_iter_changed_files_unknown_revision(git_repo):
+    git_repo.commit({"README.md": "readme"})
+    with pytest.raises(subprocess.CalledProcessError):
+        list(iter_changed_files("does-not-exist", "HEAD", git_repo.path))
+
+
+FAKE_GIT = """#!/bin/sh
+# Writes far more than a pipe holds to stderr before any path to stdout
+head -c 1048576 /dev/zero | tr '\\0' 'w' >&2
+printf 'releases/1.7/bundle.yaml\\0'
+exit 1
+"""
+
+
+def test_iter_changed_files_with_a_lot_of_stderr(tmp_path, monkeypatch):
+    git = tmp_path / "git"
+    git.write_text(FAKE_GIT)
+    git.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    result = {}
+
+    def read_changed_files():
+        try:
+            result["paths"] = list(iter_changed_files("base", "head", str(tmp_path)))
+        except subprocess.CalledProcessError as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=read_changed_files, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive(), "iter_changed_files deadlocked on git's stderr"
+    assert len(result["error"].stderr) == 1024 * 1024
+
+
+def test_read_file_at(git_repo):
+    first = git_repo.commit({"releases/1.7/bundle.yaml": "a: 1"})
+    second = git_repo.commit({"releases/1.7/bundle.yaml": "a: 2"})
+    assert read_file_at(first, "releases/1.7/bundle.yaml", git_repo.path) == "a: 1"
+    assert read_file_at(second, "releases/1.7/bundle.yaml", git_repo.path) == "a: 2"
+    assert read_file_at(first, "releases/1.7/missing.yaml", git_repo.path) is None